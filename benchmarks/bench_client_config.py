@@ -0,0 +1,138 @@
+# Latency distribution of SSM calls against a local stub endpoint under different botocore settings
+# The stub answers GetParametersByPath with a mix of fast, slow and stalled responses and throttles callers
+# that exceed its request rate, so timeouts, retry modes and connection reuse all show up in the percentiles
+# Run from the repository root: python benchmarks/bench_client_config.py [calls]
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import boto3
+from botocore.config import Config
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from reminder_app.client_config import client_config
+
+CONCURRENCY = 10
+# Requests per second the stub accepts before answering ThrottlingException, like SSM's per account limit
+STUB_RATE = 50.0
+# Chance of each kind of response from the stub
+SLOW_RATE = 0.05
+STALL_RATE = 0.01
+FAST_SECONDS = 0.005
+SLOW_SECONDS = 0.3
+STALL_SECONDS = 5.0
+BUDGET_SECONDS = 3.0
+
+RESPONSE = json.dumps({'Parameters': [{'Name': '/bench-app/bench/max_retry_count', 'Value': '3'}]}).encode('utf-8')
+THROTTLED = json.dumps({'__type': 'ThrottlingException', 'message': 'Rate exceeded'}).encode('utf-8')
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class TokenBucket(object):
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    bucket = TokenBucket(STUB_RATE)
+    throttled = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        StubHandler.connections.add(self.client_address)
+        roll = random.random()
+        status, body = 200, RESPONSE
+        if not StubHandler.bucket.take():
+            StubHandler.throttled += 1
+            status, body = 400, THROTTLED
+        elif roll < STALL_RATE:
+            time.sleep(STALL_SECONDS)
+        elif roll < STALL_RATE + SLOW_RATE:
+            time.sleep(SLOW_SECONDS)
+        else:
+            time.sleep(FAST_SECONDS)
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/x-amz-json-1.1')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+SETTINGS = [
+    ('botocore defaults', Config()),
+    ('legacy retries', Config(retries={'mode': 'legacy'})),
+    ('standard retries, 2s read', Config(read_timeout=2, connect_timeout=1, retries={'mode': 'standard', 'total_max_attempts': 3})),
+    ('client_config standard', client_config('ssm', environ={'CLIENT_RETRY_MODE': 'standard'})),
+    ('client_config adaptive', client_config('ssm', environ={'CLIENT_RETRY_MODE': 'adaptive'})),
+]
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(name, config, endpoint, calls):
+    client = boto3.session.Session().client('ssm', region_name='us-east-1', endpoint_url=endpoint,
+        aws_access_key_id='bench', aws_secret_access_key='bench', config=config)
+    StubHandler.connections = set()
+    StubHandler.bucket = TokenBucket(STUB_RATE)
+    StubHandler.throttled = 0
+    latencies = []
+    errors = [0]
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            client.get_parameters_by_path(Path='/bench-app/bench', Recursive=False)
+        except Exception:
+            errors[0] += 1
+        latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        list(executor.map(call, range(calls)))
+
+    over_budget = len([latency for latency in latencies if latency > BUDGET_SECONDS])
+    sys.stdout.write('{0:<28} {1:7.1f} {2:7.1f} {3:7.1f} {4:8.1f} {5:7d} {6:9d} {7:7d} {8:6d}\n'.format(name,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000, percentile(latencies, 0.99) * 1000,
+        max(latencies) * 1000, errors[0], StubHandler.throttled, over_budget, len(StubHandler.connections)))
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    random.seed(42)
+    server = ThreadingServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = 'http://127.0.0.1:{port}'.format(port=server.server_address[1])
+
+    sys.stdout.write('{0:<28} {1:>7} {2:>7} {3:>7} {4:>8} {5:>7} {6:>9} {7:>7} {8:>6}\n'.format(
+        'setting', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'errors', 'throttled', '>3s', 'conns'))
+    for name, config in SETTINGS:
+        run(name, config, endpoint, calls)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Cold start benchmark - init time of each handler entry point in a fresh interpreter
+# import: time to import the handler module
+# lazy init: creating only the clients the entry point calls, as the handlers do now
+# eager init: creating every client of the module up front, as the handlers did at import before
+# Run from the repository root: python benchmarks/bench_cold_start.py [runs]
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Module level clients each entry point makes calls through
+ENTRY_POINTS = [
+    ('api_reminder_handler', 'create_reminder', ['table', 'ssm', 'sfn']),
+    ('api_reminder_handler', 'create_reminders_batch', ['dynamodb', 'table', 'ssm', 'sfn']),
+    ('api_reminder_handler', 'update_reminder', ['table', 'ssm', 'sfn']),
+    ('api_reminder_handler', 'delete_reminder', ['table', 'sfn']),
+    ('api_reminder_handler', 'ack_reminder', ['table', 'sfn']),
+    ('api_reminder_handler', 'list_reminders', ['dynamodb', 'table']),
+    ('execute_reminder_handler', 'execute_reminder', ['table', 'ssm', 'sns']),
+]
+ALL_CLIENTS = {
+    'api_reminder_handler': ['dynamodb', 'table', 'ssm', 'sfn'],
+    'execute_reminder_handler': ['dynamodb', 'table', 'ssm', 'sns', 'ses'],
+}
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import importlib
+handler = importlib.import_module('reminder_app.' + sys.argv[1])
+imported = time.perf_counter()
+for name in sys.argv[2].split(','):
+    getattr(handler, name)._resolve()
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'init': done - imported}))
+'''
+
+ENV = dict(os.environ, APP_NAME='bench-app', STAGE='bench', STACK_NAME='bench-stack',
+    STEP_FUNCTION_ARN='bench-arn', AWS_DEFAULT_REGION='us-east-1')
+
+def measure(module, clients):
+    output = subprocess.check_output([sys.executable, '-c', CHILD, module, ','.join(clients)], cwd=ROOT, env=ENV)
+    return json.loads(output.decode('utf-8'))
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.stdout.write('{0:<25} {1:>10} {2:>12} {3:>12}\n'.format('entry point', 'import ms', 'lazy init ms', 'eager init ms'))
+    for module, entry_point, clients in ENTRY_POINTS:
+        lazy = [measure(module, clients) for i in range(runs)]
+        eager = [measure(module, ALL_CLIENTS[module]) for i in range(runs)]
+        sys.stdout.write('{0:<25} {1:10.1f} {2:12.1f} {3:12.1f}\n'.format(entry_point,
+            median([run['import'] for run in lazy]) * 1000,
+            median([run['init'] for run in lazy]) * 1000,
+            median([run['init'] for run in eager]) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Micro-benchmark of reminder_app.date_utils against the strptime/strftime helpers it replaced
+# Run from the repository root: python benchmarks/bench_date_utils.py
+import contextlib
+import io
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
+
+NUMBER = 20000
+
+# The helpers previously copied into both handlers
+def legacy_isostr_to_datetime(date_string):
+    print("From Datestr:",date_string)
+    dtval = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%f%z').replace(tzinfo=None)
+    print ("To Datetime:",dtval)
+    return dtval
+
+def legacy_datetime_to_isostr(date):
+    print("From Datetime:",date)
+    dt = date.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')+'Z'
+    print("To Datestr:",dt)
+    return dt
+
+def report(name, seconds, baseline=None):
+    per_call = seconds / NUMBER * 1e6
+    speedup = '' if baseline is None else '  x{0:.1f}'.format(baseline / seconds)
+    sys.stdout.write('{0:<40} {1:8.3f} us/call{2}\n'.format(name, per_call, speedup))
+
+def main():
+    now = datetime.utcnow()
+    # Distinct strings so the uncached numbers are not served from the memo
+    distinct = [datetime_to_isostr(now + timedelta(microseconds=i)) for i in range(NUMBER)]
+    repeated = distinct[0]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_parse = timeit.timeit(lambda: legacy_isostr_to_datetime(repeated), number=NUMBER)
+        legacy_format = timeit.timeit(lambda: legacy_datetime_to_isostr(now), number=NUMBER)
+    strptime_only = timeit.timeit(lambda: datetime.strptime(repeated, '%Y-%m-%dT%H:%M:%S.%f%z'), number=NUMBER)
+
+    isostr_to_datetime.cache_clear()
+    strings = iter(distinct)
+    uncached_parse = timeit.timeit(lambda: isostr_to_datetime(next(strings)), number=NUMBER)
+    cached_parse = timeit.timeit(lambda: isostr_to_datetime(repeated), number=NUMBER)
+    fast_format = timeit.timeit(lambda: datetime_to_isostr(now), number=NUMBER)
+
+    report('legacy isostr_to_datetime (with print)', legacy_parse)
+    report('strptime only', strptime_only)
+    report('isostr_to_datetime uncached', uncached_parse, legacy_parse)
+    report('isostr_to_datetime cached', cached_parse, legacy_parse)
+    report('legacy datetime_to_isostr (with print)', legacy_format)
+    report('datetime_to_isostr', fast_format, legacy_format)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# Per-invocation benchmarks of the handler entry points against stubbed AWS services
+# Every botocore request is answered in process by a before-send hook, so request building, signing and
+# response parsing are measured but nothing goes over the network
+# Per case: median and p95 latency, peak traced memory and memory blocks still held after the call,
+# and the AWS calls made by one warm invocation (SSM parameters are already cached by then)
+# Results can be saved as a baseline and later runs compared against it:
+#   python benchmarks/bench_handlers.py --save        write the baseline
+#   python benchmarks/bench_handlers.py --compare     exit 1 when a case regressed by more than --threshold
+# Run from the repository root
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BASELINE = os.path.normpath(os.path.join(ROOT, 'benchmarks', 'baselines', 'handlers.json'))
+
+for name, value in [('APP_NAME', 'bench-app'), ('STAGE', 'bench'), ('STACK_NAME', 'bench-stack'),
+        ('STEP_FUNCTION_ARN', 'arn:aws:states:us-east-1:123456789012:stateMachine:bench'), ('AWS_DEFAULT_REGION', 'us-east-1'),
+        ('AWS_ACCESS_KEY_ID', 'bench'), ('AWS_SECRET_ACCESS_KEY', 'bench'), ('CONFIG_BACKGROUND_REFRESH', 'false'),
+        ('SES_MAX_SEND_RATE', '1000000'), ('SNS_MAX_SEND_RATE', '1000000')]:
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, ROOT)
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.awsrequest import AWSResponse
+from reminder_app import aws_clients
+from reminder_app import api_reminder_handler, execute_reminder_handler
+from reminder_app.date_utils import datetime_to_isostr
+from reminder_app import serialization
+
+ITERATIONS = 300
+ALLOCATION_ITERATIONS = 30
+WARMUP = 5
+THRESHOLD = float(os.environ.get('BENCH_REGRESSION_THRESHOLD', '0.25'))
+# Compared against the baseline - AWS calls are compared exactly
+COMPARED = ['median_us', 'p95_us', 'peak_kib']
+LIST_SIZE = 50
+SERIALIZE_SIZE = 100
+EMAIL_BATCH_SIZE = 100
+
+PARAMETERS = {'min_delay_param': '60', 'max_delay_param': '3600', 'max_retry_count': '3'}
+
+# Reminders with an id starting with email- are sent by email
+def reminder(reminder_id, notify_date_time='2020-01-01T12:00:00.000000Z'):
+    notify_by = {'type': 'SMS', 'phone_number': '+1-123-456-7890'}
+    if reminder_id.startswith('email-'):
+        notify_by = {'type': 'Email', 'to_address': reminder_id + '@example.com', 'from_address': 'bench@example.com'}
+    return {
+        'reminder_id': reminder_id,
+        'user_id': 'bench-user',
+        'notify_date_time': notify_date_time,
+        'remind_msg': 'Pay your taxes',
+        'state': 'Pending',
+        'to_execute': 'true',
+        'retry_count': 0,
+        #Current so a read after the handler's own write is not taken for a stale one
+        'updated_at': int(time.time() * 1000),
+        'notify_by': notify_by
+    }
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+def wire(item):
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+# Stub replies by service and operation - a function of the decoded request body
+def query(body):
+    if body.get('IndexName') == 'UserIdIndex':
+        keys = [{'reminder_id': {'S': str(i)}, 'user_id': {'S': 'bench-user'}} for i in range(body.get('Limit', LIST_SIZE))]
+        return {'Items': keys, 'Count': len(keys), 'LastEvaluatedKey': keys[-1]}
+    return {'Items': [wire(reminder('1'))], 'Count': 1}
+
+def batch_get_item(body):
+    return {'Responses': {table: [wire(reminder(key['reminder_id']['S'])) for key in request['Keys']]
+        for table, request in body['RequestItems'].items()}, 'UnprocessedKeys': {}}
+
+JSON_REPLIES = {
+    ('dynamodb', 'Query'): query,
+    ('dynamodb', 'GetItem'): lambda body: {'Item': wire(reminder(body['Key']['reminder_id']['S']))},
+    ('dynamodb', 'PutItem'): lambda body: {},
+    ('dynamodb', 'UpdateItem'): lambda body: {'Attributes': wire(reminder(body['Key']['reminder_id']['S']))},
+    ('dynamodb', 'DeleteItem'): lambda body: {'Attributes': wire(reminder(body['Key']['reminder_id']['S']))},
+    ('dynamodb', 'BatchGetItem'): batch_get_item,
+    ('dynamodb', 'BatchWriteItem'): lambda body: {'UnprocessedItems': {}},
+    ('ssm', 'GetParametersByPath'): lambda body: {'Parameters': [{'Name': body['Path'] + '/' + name, 'Value': value}
+        for name, value in PARAMETERS.items()]},
+    ('sfn', 'StartExecution'): lambda body: {'executionArn': 'arn:aws:states:us-east-1:123456789012:execution:bench:' + body['name'],
+        'startDate': 1577880000},
+    ('sfn', 'StopExecution'): lambda body: {'stopDate': 1577880000},
+}
+XML_REPLIES = {
+    ('sns', 'Publish'): '<PublishResponse xmlns="http://sns.amazonaws.com/doc/2010-03-31/"><PublishResult>'
+        '<MessageId>bench</MessageId></PublishResult></PublishResponse>',
+    ('ses', 'SendEmail'): '<SendEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/"><SendEmailResult>'
+        '<MessageId>bench</MessageId></SendEmailResult></SendEmailResponse>',
+    #One status per destination of the form encoded request
+    ('ses', 'SendBulkTemplatedEmail'): lambda body: '<SendBulkTemplatedEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+        '<SendBulkTemplatedEmailResult><Status>' + ''.join('<member><Status>Success</Status><MessageId>bench</MessageId></member>'
+            for name in parse_qs(body if isinstance(body, str) else body.decode('utf-8')) if name.endswith('.Destination.ToAddresses.member.1')) +
+        '</Status></SendBulkTemplatedEmailResult></SendBulkTemplatedEmailResponse>',
+}
+
+class RawBody(object):
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+calls = collections.Counter()
+
+def stub_aws(request, event_name, **kwargs):
+    service, operation = event_name.split('.')[1:3]
+    calls[service + '.' + operation] += 1
+    if (service, operation) in XML_REPLIES:
+        reply = XML_REPLIES[(service, operation)]
+        body = (reply(request.body) if callable(reply) else reply).encode('utf-8')
+    else:
+        body = json.dumps(JSON_REPLIES[(service, operation)](json.loads(request.body.decode('utf-8')))).encode('utf-8')
+    return AWSResponse(request.url, 200, {'x-amzn-requestid': 'bench'}, RawBody(body))
+
+def api_event(body=None, path=None, query_string=None):
+    return {'body': None if body is None else json.dumps(body), 'pathParameters': path, 'queryStringParameters': query_string}
+
+# execute_reminders_batch of due email reminders, sent one by one or in bulk with an SES template
+def email_batch(template):
+    saved = execute_reminder_handler.SES_TEMPLATE
+    execute_reminder_handler.SES_TEMPLATE = template
+    try:
+        return execute_reminder_handler.execute_reminders_batch({'reminders': [{'reminder_id': 'email-' + str(i),
+            'user_id': 'bench-user'} for i in range(EMAIL_BATCH_SIZE)]}, None)
+    finally:
+        execute_reminder_handler.SES_TEMPLATE = saved
+
+def cases():
+    notify_date_time = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
+    create = api_event({'user_id': 'bench-user', 'notify_date_time': notify_date_time, 'remind_msg': 'Pay your taxes',
+        'notify_by': {'type': 'SMS', 'phone_number': '+1-123-456-7890'}})
+    update = api_event({'notify_date_time': notify_date_time, 'remind_msg': 'Pay your taxes'},
+        {'reminder_id': '1'}, {'user_id': 'bench-user'})
+    ack = api_event(None, {'reminder_id': '1'}, {'user_id': 'bench-user'})
+    ack_lookup = api_event(None, {'reminder_id': '1'})
+    list_page = api_event(None, {'user_id': 'bench-user'}, {'limit': str(LIST_SIZE)})
+    #As the DynamoDB resource returns them - numbers are Decimal
+    items = [{name: deserializer.deserialize(value) for name, value in wire(reminder(str(i))).items()} for i in range(SERIALIZE_SIZE)]
+    return [
+        ('create_reminder', lambda: api_reminder_handler.create_reminder(create, None)),
+        ('update_reminder', lambda: api_reminder_handler.update_reminder(update, None)),
+        ('ack_reminder', lambda: api_reminder_handler.ack_reminder(ack, None)),
+        ('ack_reminder lookup', lambda: api_reminder_handler.ack_reminder(ack_lookup, None)),
+        ('list_reminders', lambda: api_reminder_handler.list_reminders(list_page, None)),
+        ('execute_reminder', lambda: execute_reminder_handler.execute_reminder({'reminder_id': '1'}, None)),
+        ('batch {count} emails'.format(count=EMAIL_BATCH_SIZE), lambda: email_batch('')),
+        ('batch {count} emails bulk'.format(count=EMAIL_BATCH_SIZE), lambda: email_batch('bench-template')),
+        ('validate_notify_date_time', lambda: api_reminder_handler.validate_notify_date_time({'notify_date_time': notify_date_time})),
+        ('json serialize {count}'.format(count=SERIALIZE_SIZE), lambda: serialization.json_response(items)),
+    ]
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure(run, iterations):
+    for i in range(WARMUP):
+        run()
+    calls.clear()
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    aws_calls = {name: count / float(iterations) for name, count in sorted(calls.items())}
+
+    peaks = []
+    blocks = []
+    tracemalloc.start()
+    for i in range(ALLOCATION_ITERATIONS):
+        tracemalloc.clear_traces()
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak)
+        blocks.append(sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename')))
+    tracemalloc.stop()
+
+    return {
+        'median_us': round(percentile(latencies, 0.5) * 1e6, 1),
+        'p95_us': round(percentile(latencies, 0.95) * 1e6, 1),
+        'peak_kib': round(percentile(peaks, 0.5) / 1024.0, 1),
+        'blocks': percentile(blocks, 0.5),
+        'aws_calls': aws_calls,
+    }
+
+# Cases whose metric grew by more than threshold, or that make more AWS calls than the baseline
+def regressions(results, baseline, threshold):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in COMPARED:
+            if result[metric] > baseline[name][metric] * (1 + threshold):
+                found.append('{0}: {1} {2} -> {3}'.format(name, metric, baseline[name][metric], result[metric]))
+        if sum(result['aws_calls'].values()) > sum(baseline[name]['aws_calls'].values()):
+            found.append('{0}: aws calls {1} -> {2}'.format(name, baseline[name]['aws_calls'], result['aws_calls']))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='exit 1 when a case regressed against the baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed relative growth, default BENCH_REGRESSION_THRESHOLD or 0.25')
+    args = parser.parse_args()
+
+    aws_clients.reset()
+    aws_clients.session().events.register('before-send', stub_aws)
+
+    results = collections.OrderedDict()
+    sys.stdout.write('{0:<27} {1:>10} {2:>10} {3:>9} {4:>7}  {5}\n'.format('case', 'median us', 'p95 us', 'peak KiB', 'blocks', 'aws calls'))
+    for name, run in cases():
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = result = measure(run, args.iterations)
+        sys.stdout.write('{0:<27} {1:10.1f} {2:10.1f} {3:9.1f} {4:7d}  {5}\n'.format(name, result['median_us'], result['p95_us'],
+            result['peak_kib'], result['blocks'], ', '.join('{0} x{1:g}'.format(*call) for call in result['aws_calls'].items()) or '-'))
+
+    if args.save:
+        if not os.path.isdir(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(), 'iterations': args.iterations, 'cases': results}, baseline_file, indent=2)
+            baseline_file.write('\n')
+        sys.stdout.write('Baseline written to {0}\n'.format(args.baseline))
+
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(results, baseline['cases'], args.threshold)
+        for regression in found:
+            sys.stdout.write('REGRESSION ' + regression + '\n')
+        if found:
+            sys.exit(1)
+        sys.stdout.write('No regressions over {0:.0%} against {1}\n'.format(args.threshold, args.baseline))
+
+if __name__ == '__main__':
+    main()
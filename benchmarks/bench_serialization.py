@@ -0,0 +1,69 @@
+# Micro-benchmark of reminder_app.serialization on list responses against the DecimalEncoder it replaced
+# Items are built as the DynamoDB resource returns them - numbers are Decimal
+# Run from the repository root: python benchmarks/bench_serialization.py [--items 1000]
+import argparse
+import decimal
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from reminder_app import serialization
+
+NUMBER = 50
+
+# The encoder every handler used before
+class LegacyDecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            if o % 1 > 0:
+                return float(o)
+            else:
+                return int(o)
+        return super(LegacyDecimalEncoder, self).default(o)
+
+def items(count):
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    reminders = [{
+        'reminder_id': 'reminder-{0}'.format(i),
+        'user_id': 'bench-user',
+        'notify_date_time': '2020-01-01T12:00:00.000000Z',
+        'due_at': 1577880000 + i,
+        'remind_msg': 'Pay your taxes',
+        'retry_count': i % 4,
+        'state': 'Pending',
+        'updated_at': 1600000000000 + i,
+        'notify_by': {'type': 'SMS', 'phone_number': '+1-123-456-7890'}
+    } for i in range(count)]
+    #Through the wire format and back, as a BatchGetItem page would come back
+    return [deserializer.deserialize(serializer.serialize(reminder)) for reminder in reminders]
+
+def report(name, seconds, baseline=None):
+    per_call = seconds / NUMBER * 1e3
+    speedup = '' if baseline is None else '  x{0:.1f}'.format(baseline / seconds)
+    sys.stdout.write('{0:<40} {1:8.3f} ms/call{2}\n'.format(name, per_call, speedup))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args()
+    page = items(args.items)
+
+    legacy = timeit.timeit(lambda: {'statusCode': 200, 'body': json.dumps(page, cls=LegacyDecimalEncoder)}, number=NUMBER)
+    stdlib = timeit.timeit(lambda: {'statusCode': 200, 'body': serialization._stdlib_dumps(page)}, number=NUMBER)
+    sys.stdout.write('{0} items, {1} bytes, JSON_BACKEND {2}\n'.format(args.items, len(serialization.dumps_bytes(page)),
+        serialization.BACKEND))
+    report('legacy DecimalEncoder', legacy)
+    report('serialization json', stdlib, legacy)
+    if serialization.orjson is not None:
+        fast = timeit.timeit(lambda: {'statusCode': 200, 'body': serialization._orjson_dumps(page)}, number=NUMBER)
+        report('serialization orjson', fast, legacy)
+    else:
+        sys.stdout.write('orjson is not installed\n')
+    report('json_response', timeit.timeit(lambda: serialization.json_response(page), number=NUMBER), legacy)
+
+if __name__ == '__main__':
+    main()
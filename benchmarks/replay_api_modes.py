@@ -0,0 +1,178 @@
+# Replays API traffic against the two API deployments of template.yaml (ApiDeployment) and compares cold starts
+#   functions - one function, and so one pool of warm containers, per route
+#   single    - api_router.route serving every route from one pool
+# Warm latencies are measured by invoking every route through api_router.route against the stubbed AWS services of
+# bench_handlers. A cold start adds the runtime init (--runtime-init-ms, not measurable locally) to the import and
+# client creation of api_router measured in a fresh interpreter
+# Lambda containers are modelled as reused while busy for less than --idle-seconds in between, one request at a time,
+# the most recently used one first - a request finding none free starts a new one
+# Traffic is a Poisson process per route (requests per minute, --rates) or a trace of NDJSON lines
+# {"time": seconds, "resource": "/ack/{reminder_id}", "httpMethod": "GET"} such as API Gateway access logs
+# Run from the repository root: python benchmarks/replay_api_modes.py [--hours 6] [--trace trace.ndjson]
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_handlers
+from bench_handlers import ROOT, api_event, percentile, stub_aws
+from reminder_app import api_router, aws_clients
+
+# Requests per minute by route - a few busy routes, rarely used /delete and /ack
+DEFAULT_RATES = {
+    ('/list/{user_id}', 'GET'): 30.0,
+    ('/create', 'POST'): 6.0,
+    ('/update/{reminder_id}', 'POST'): 1.0,
+    ('/ack/{reminder_id}', 'GET'): 0.2,
+    ('/delete/{reminder_id}', 'GET'): 0.05,
+}
+SAMPLES = 200
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from reminder_app import api_router, api_reminder_handler
+for name in ('dynamodb', 'table', 'ssm', 'sfn'):
+    getattr(api_reminder_handler, name)._resolve()
+print(json.dumps({'init': time.perf_counter() - start}))
+'''
+
+# Import and client creation of a new container in seconds, median of runs fresh interpreters
+def measure_init(runs):
+    env = dict(os.environ, APP_NAME='bench-app', STAGE='bench', STACK_NAME='bench-stack', STEP_FUNCTION_ARN='bench-arn',
+        AWS_DEFAULT_REGION='us-east-1')
+    inits = [json.loads(subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT, env=env).decode('utf-8'))['init']
+        for i in range(runs)]
+    return percentile(inits, 0.5)
+
+def route_event(resource, method):
+    notify_date_time = (datetime.utcnow() + timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    if resource == '/create':
+        event = api_event({'user_id': 'bench-user', 'notify_date_time': notify_date_time, 'remind_msg': 'Pay your taxes',
+            'notify_by': {'type': 'SMS', 'phone_number': '+1-123-456-7890'}})
+    elif resource == '/update/{reminder_id}':
+        event = api_event({'notify_date_time': notify_date_time, 'remind_msg': 'Pay your taxes'}, {'reminder_id': '1'},
+            {'user_id': 'bench-user'})
+    elif resource == '/list/{user_id}':
+        event = api_event(None, {'user_id': 'bench-user'}, {'limit': str(bench_handlers.LIST_SIZE)})
+    else:
+        event = api_event(None, {'reminder_id': '1'}, {'user_id': 'bench-user'})
+    return dict(event, resource=resource, httpMethod=method)
+
+# Warm latencies in seconds of each route through api_router.route
+def measure_routes(routes, samples):
+    aws_clients.reset()
+    aws_clients.session().events.register('before-send', stub_aws)
+    latencies = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for resource, method in routes:
+            event = route_event(resource, method)
+            for i in range(bench_handlers.WARMUP):
+                api_router.route(event, None)
+            measured = []
+            for i in range(samples):
+                start = time.perf_counter()
+                api_router.route(event, None)
+                measured.append(time.perf_counter() - start)
+            latencies[(resource, method)] = measured
+    return latencies
+
+def poisson_trace(rates, seconds, rng):
+    requests = []
+    for route, per_minute in sorted(rates.items()):
+        t = rng.expovariate(per_minute / 60.0)
+        while t < seconds:
+            requests.append((t, route))
+            t += rng.expovariate(per_minute / 60.0)
+    return sorted(requests)
+
+def load_trace(path):
+    with open(path) as trace_file:
+        requests = [json.loads(line) for line in trace_file if line.strip()]
+    start = min(request['time'] for request in requests)
+    return sorted((request['time'] - start, (request['resource'], request['httpMethod'].upper())) for request in requests)
+
+# Replays requests against pools of containers - pool_of(route) names the pool, i.e. the function, serving a route
+# Returns [(route, cold, latency seconds)]
+def replay(requests, pool_of, latencies, cold_seconds, idle_seconds, rng):
+    #pool -> [[busy_until, last_used]] of containers still warm
+    pools = collections.defaultdict(list)
+    results = []
+    for t, route in requests:
+        containers = pools[pool_of(route)]
+        containers[:] = [container for container in containers if container[0] > t or t - container[1] < idle_seconds]
+        free = [container for container in containers if container[0] <= t]
+        latency = rng.choice(latencies[route])
+        if free:
+            container = max(free, key=lambda container: container[1])
+            cold = False
+        else:
+            container = [0, 0]
+            containers.append(container)
+            cold = True
+            latency += cold_seconds
+        container[0] = container[1] = t + latency
+        results.append((route, cold, latency))
+    return results
+
+def summarize(results):
+    latencies = [latency for route, cold, latency in results]
+    cold_starts = sum(1 for route, cold, latency in results if cold)
+    return {
+        'requests': len(results),
+        'cold_starts': cold_starts,
+        'cold_ratio': cold_starts / float(len(results)) if results else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if results else 0.0,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if results else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=6, help='length of the generated trace')
+    parser.add_argument('--trace', help='NDJSON trace to replay instead of generating one')
+    parser.add_argument('--rates', help='JSON {"GET /ack/{reminder_id}": requests per minute, ...} for the generated trace')
+    parser.add_argument('--idle-seconds', type=float, default=600, help='idle time after which a container is recycled')
+    parser.add_argument('--runtime-init-ms', type=float, default=250, help='Lambda runtime start added to every cold start')
+    parser.add_argument('--init-runs', type=int, default=5, help='fresh interpreters the container init is measured in')
+    parser.add_argument('--samples', type=int, default=SAMPLES, help='warm invocations measured per route')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rates = DEFAULT_RATES
+    if args.rates:
+        rates = {tuple(reversed(name.split(' ', 1))): float(rate) for name, rate in json.loads(args.rates).items()}
+    requests = load_trace(args.trace) if args.trace else poisson_trace(rates, args.hours * 3600, rng)
+    routes = sorted(set(route for t, route in requests))
+    unknown = [route for route in routes if route not in api_router.ROUTES]
+    if unknown:
+        parser.error('no route for {0}'.format(', '.join(method + ' ' + resource for resource, method in unknown)))
+
+    cold_seconds = args.runtime_init_ms / 1000.0 + measure_init(args.init_runs)
+    latencies = measure_routes(routes, args.samples)
+    modes = [('functions', lambda route: route), ('single', lambda route: 'api')]
+    results = {mode: replay(requests, pool_of, latencies, cold_seconds, args.idle_seconds, random.Random(args.seed))
+        for mode, pool_of in modes}
+
+    sys.stdout.write('{0} requests over {1:.1f}h, cold start {2:.0f} ms, containers recycled after {3:.0f}s idle\n\n'.format(
+        len(requests), requests[-1][0] / 3600.0 if requests else 0, cold_seconds * 1000, args.idle_seconds))
+    sys.stdout.write('{0:<10} {1:<30} {2:>9} {3:>6} {4:>7} {5:>9} {6:>9}\n'.format('mode', 'route', 'requests', 'cold', 'cold %',
+        'p50 ms', 'p99 ms'))
+    for mode, pool_of in modes:
+        for route in routes + [None]:
+            selected = [result for result in results[mode] if route is None or result[0] == route]
+            summary = summarize(selected)
+            sys.stdout.write('{0:<10} {1:<30} {2:>9} {3:>6} {4:>7.2%} {5:>9.1f} {6:>9.1f}\n'.format(mode,
+                'all' if route is None else route[1] + ' ' + route[0], summary['requests'], summary['cold_starts'],
+                summary['cold_ratio'], summary['p50_ms'], summary['p99_ms']))
+
+if __name__ == '__main__':
+    main()
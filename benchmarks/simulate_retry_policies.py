@@ -0,0 +1,80 @@
+# Simulates the retry policies in reminder_app.retry_policy for a population of reminders
+# Reports the execute_reminder invocations, sends and time to a final state each policy needs per reminder
+# Run from the repository root: python benchmarks/simulate_retry_policies.py [--reminders 10000] [--max-retry-count 3]
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from reminder_app.retry_policy import FixedRetryPolicy, ExponentialRetryPolicy, JitteredRetryPolicy
+
+# Replays the life of one reminder under a policy without calling AWS
+# ack_after_seconds - when the user acknowledges after the first send, None if they never do
+# stop_on_ack - acknowledging stops the reminder's step function, so no check runs after it (the sweep keeps
+#               checking until its next visit finds the reminder acknowledged)
+# Returns the execute_reminder invocations and sends it takes, how the reminder ended and when (seconds after
+# the first send)
+def simulate(policy, max_retry_count, ack_after_seconds=None, stop_on_ack=True):
+    invocations = 0
+    sends = 0
+    elapsed = 0.0
+    while True:
+        acknowledged = sends > 0 and ack_after_seconds is not None and ack_after_seconds <= elapsed
+        if acknowledged and stop_on_ack:
+            return {'invocations': invocations, 'sends': sends, 'outcome': 'Acknowledged', 'seconds': ack_after_seconds}
+        invocations += 1
+        if acknowledged:
+            return {'invocations': invocations, 'sends': sends, 'outcome': 'Acknowledged', 'seconds': ack_after_seconds}
+        #Same check as process_reminder - retry_count counts the sends so far
+        if sends > max_retry_count:
+            return {'invocations': invocations, 'sends': sends, 'outcome': 'Unacknowledged', 'seconds': elapsed}
+        sends += 1
+        elapsed += policy.delay_seconds(sends)
+
+# Seconds after the first send users acknowledge at - None never acknowledges
+def ack_delays(count, never_ratio, mean_seconds, rng):
+    return [None if rng.random() < never_ratio else rng.expovariate(1.0 / mean_seconds) for _ in range(count)]
+
+def policies(interval_seconds, max_interval_seconds, rng):
+    return [
+        ('fixed', FixedRetryPolicy(interval_seconds)),
+        ('exponential', ExponentialRetryPolicy(interval_seconds, 2, max_interval_seconds)),
+        ('jittered', JitteredRetryPolicy(interval_seconds, 2, max_interval_seconds, random=rng.random)),
+    ]
+
+def run(name, policy, delays, max_retry_count, stop_on_ack):
+    results = [simulate(policy, max_retry_count, delay, stop_on_ack) for delay in delays]
+    given_up = [result for result in results if result['outcome'] == 'Unacknowledged']
+    return {
+        'policy': name,
+        'invocations': sum(result['invocations'] for result in results) / float(len(results)),
+        'sends': sum(result['sends'] for result in results) / float(len(results)),
+        'unacknowledged': len(given_up) / float(len(results)),
+        'give_up_minutes': sum(result['seconds'] for result in given_up) / 60.0 / len(given_up) if given_up else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reminders', type=int, default=10000)
+    parser.add_argument('--max-retry-count', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=300, help='retry_interval_seconds')
+    parser.add_argument('--max-interval', type=float, default=3600, help='retry_max_interval_seconds')
+    parser.add_argument('--never-ack', type=float, default=0.2, help='share of reminders never acknowledged')
+    parser.add_argument('--mean-ack', type=float, default=600, help='mean seconds to acknowledge')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    delays = ack_delays(args.reminders, args.never_ack, args.mean_ack, rng)
+    sys.stdout.write('{0} reminders, max_retry_count {1}, {2:.0%} never acknowledged, mean acknowledgement {3:.0f}s\n'.format(
+        args.reminders, args.max_retry_count, args.never_ack, args.mean_ack))
+    for scheduler, stop_on_ack in (('stepfunctions', True), ('sweep', False)):
+        sys.stdout.write('\n{0}\n{1:<12} {2:>12} {3:>8} {4:>15} {5:>16}\n'.format(
+            scheduler, 'policy', 'invocations', 'sends', 'unacknowledged', 'give up (mins)'))
+        for name, policy in policies(args.interval, args.max_interval, rng):
+            result = run(name, policy, delays, args.max_retry_count, stop_on_ack)
+            sys.stdout.write('{policy:<12} {invocations:>12.2f} {sends:>8.2f} {unacknowledged:>15.1%} {give_up_minutes:>16.1f}\n'.format(**result))
+
+if __name__ == '__main__':
+    main()
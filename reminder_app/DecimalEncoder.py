@@ -1,11 +1,11 @@
 import json
+try:
+    from reminder_app.serialization import convert
+except ImportError:
+    from serialization import convert
 
 # Helper class to convert a DynamoDB item to JSON.
+# Kept for json.dumps(..., cls=DecimalEncoder) callers - handlers use reminder_app.serialization
 class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            if o % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        return super(DecimalEncoder, self).default(o)
\ No newline at end of file
+        return convert(o)
@@ -1,62 +1,94 @@
+import base64
+import binascii
 import json
-import boto3
 import logging
 import os
 import time
 import uuid
-from datetime import datetime,timedelta
-from boto3.dynamodb.conditions import Key, Attr
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from botocore.exceptions import ClientError
-#from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
-
-#TODO PUT COMMON CODE IN LAYERS
-def isostr_to_datetime(date_string):
-    print("From Datestr:",date_string)
-    dtval = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%f%z').replace(tzinfo=None)
-    print ("To Datetime:",dtval)
-    return dtval
-
-def datetime_to_isostr(date):
-    print("From Datetime:",date)
-    #FIXME - handle propertly
-    dt = date.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')+'Z'
-    print("To Datestr:",dt)
-    return dt
-
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-ssm = boto3.client('ssm', region_name="us-east-1")
-sfn = boto3.client('stepfunctions')
-param_path= '/{app_name}/{stage}'.format(app_name=os.environ['APP_NAME'],stage=os.environ['STAGE'])
-
-table = dynamodb.Table('{stack_name}-RemindersTable'.format(stack_name=os.environ['STACK_NAME']))
+try:
+    from reminder_app import aws_clients
+    from reminder_app.archive_store import store_for
+    from reminder_app.config_provider import ConfigProvider, app_param_path
+    from reminder_app.date_utils import isostr_to_datetime, isostr_to_epoch
+    from reminder_app.scheduler import bucket_for, sweep_mode
+    from reminder_app.reminder_repository import CachedReminderRepository, DynamoDBReminderRepository, ReminderNotFound, finished_updates, \
+        iter_user_reminders
+    from reminder_app.reminder_export import EXPORT_FORMATS, EXPORT_INLINE_MAX_BYTES, EXPORT_PART_BYTES, ExportSpool, ExportTooLarge
+    from reminder_app.summary_reminder_handler import get_summary
+    from reminder_app.idempotency import IdempotencyStore, IdempotencyInProgress, IdempotencyKeyMismatch, idempotency_key, request_hash
+    from reminder_app.serialization import dumps, dumps_bytes, json_response, static_response
+    from reminder_app.instrumentation import instrumented
+except ImportError:
+    import aws_clients
+    from archive_store import store_for
+    from config_provider import ConfigProvider, app_param_path
+    from date_utils import isostr_to_datetime, isostr_to_epoch
+    from scheduler import bucket_for, sweep_mode
+    from reminder_repository import CachedReminderRepository, DynamoDBReminderRepository, ReminderNotFound, finished_updates, \
+        iter_user_reminders
+    from reminder_export import EXPORT_FORMATS, EXPORT_INLINE_MAX_BYTES, EXPORT_PART_BYTES, ExportSpool, ExportTooLarge
+    from summary_reminder_handler import get_summary
+    from idempotency import IdempotencyStore, IdempotencyInProgress, IdempotencyKeyMismatch, idempotency_key, request_hash
+    from serialization import dumps, dumps_bytes, json_response, static_response
+    from instrumentation import instrumented
+
+
+#Clients are created on first use - see aws_clients
+dynamodb = aws_clients.lazy_resource('dynamodb', region_name='us-east-1')
+ssm = aws_clients.lazy_client('ssm', region_name="us-east-1")
+sfn = aws_clients.lazy_client('stepfunctions')
+param_path= app_param_path()
+config = ConfigProvider(ssm, param_path)
+
+table = aws_clients.lazy_table('{stack_name}-RemindersTable'.format(stack_name=os.environ['STACK_NAME']), region_name='us-east-1')
+
+#Responses of creates made with an Idempotency-Key header
+idempotency_store = IdempotencyStore(aws_clients.lazy_table('{stack_name}-IdempotencyTable'.format(stack_name=os.environ['STACK_NAME']), region_name='us-east-1'))
+
+#Bulk create limits
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '1000'))
+BATCH_WRITE_MAX_ATTEMPTS = int(os.environ.get('BATCH_WRITE_MAX_ATTEMPTS', '5'))
+BATCH_SFN_CONCURRENCY = int(os.environ.get('BATCH_SFN_CONCURRENCY', '10'))
+
+#All reads and writes of reminders go through the repository
+#Reminder lookups are cached in a warm container - they only resolve the user_id of a reminder, which never changes
+reminders = CachedReminderRepository(DynamoDBReminderRepository(table, dynamodb, max_attempts=BATCH_WRITE_MAX_ATTEMPTS))
+
+#List page sizes - a page is hydrated with a single BatchGetItem so it can not exceed 100 keys
+LIST_DEFAULT_LIMIT = int(os.environ.get('LIST_DEFAULT_LIMIT', '50'))
+LIST_MAX_LIMIT = 100
+
+#Exports too large to return inline are written here - an S3 bucket (EXPORT_BUCKET) or a local directory (EXPORT_DIRECTORY)
+#and downloaded from a presigned URL valid for EXPORT_URL_EXPIRES_SECONDS
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET', '')
+EXPORT_DIRECTORY = os.environ.get('EXPORT_DIRECTORY', '')
+EXPORT_PREFIX = os.environ.get('EXPORT_PREFIX', 'exports/')
+EXPORT_URL_EXPIRES_SECONDS = int(os.environ.get('EXPORT_URL_EXPIRES_SECONDS', '3600'))
+export_store = store_for(EXPORT_BUCKET, EXPORT_DIRECTORY, EXPORT_PREFIX)
 
 def validate_field(data,fieldName):
     if fieldName not in data:
         logging.error("Validation Failed")
         raise Exception("Couldn't create the reminder item - {fieldName} missing".format(fieldName = fieldName))
 
-def validate_notify_date_time(data):
+# params - already loaded app parameters, lets bulk callers validate many reminders against one config read
+def validate_notify_date_time(data, params=None):
     current_ts = datetime.utcnow()
-    logging.info("Current ts:",current_ts)
-    print("Current ts:",current_ts)
     date_ts = isostr_to_datetime(data['notify_date_time'])
-    logging.info("Reminder ts:",date_ts)
-    print("Reminder ts:",date_ts)
+    logging.debug("Current ts: %s Reminder ts: %s", current_ts, date_ts)
     if current_ts > date_ts:
         logging.error("Validation Failed: Reminder in the past")
         raise Exception("Reminder {date_ts} in the past".format(date_ts=date_ts))
 
     diff = (date_ts - current_ts)
-    print("diff ts:",diff.seconds)
-
-    delay_params_list = ssm.get_parameters_by_path(Path=param_path,Recursive=False)['Parameters']
-
-    logging.debug(delay_params_list)
 
-    delay_params_dict = {param['Name'] : param for param in delay_params_list}
-    
-    min_delay_param = int(delay_params_dict[param_path+"/min_delay_param"]['Value'])
-    max_delay_param = int(delay_params_dict[param_path+"/max_delay_param"]['Value'])
+    if params is None:
+        params = config.params()
+    min_delay_param = int(params["min_delay_param"])
+    max_delay_param = int(params["max_delay_param"])
 
     delay_seconds = int(diff.seconds)
     if (min_delay_param >  delay_seconds)  or (delay_seconds > max_delay_param):
@@ -70,22 +102,111 @@ def validate_notify_date_time(data):
 # Create a scheduled event
 # validate not less than {MIN_DELAY_PARAM} mins left
 # validate not more than {MAX_DELAY_PARAM}
+# With an Idempotency-Key header a retried request gets the response of the first one back
+# and no second reminder or step function is created - keys are scoped to the user_id
+@instrumented
 def create_reminder(event, context):
     data = json.loads(event['body'],strict=False)
+    if not isinstance(data, dict):
+        return {
+            "statusCode": 400,
+            "body": "Expected a reminder"
+        }
+
+    key = idempotency_key(event)
+    if key is None:
+        return create_one_reminder(data)
+    try:
+        return idempotency_store.run('{user_id}#{key}'.format(user_id=data.get('user_id'), key=key), request_hash(data),
+            lambda: create_one_reminder(data))
+    except IdempotencyKeyMismatch:
+        return {
+            "statusCode": 422,
+            "body": "Idempotency-Key was already used for a different reminder"
+        }
+    except IdempotencyInProgress:
+        return {
+            "statusCode": 409,
+            "body": "A request with this Idempotency-Key is still in progress"
+        }
+
+def create_one_reminder(data):
+    validate_reminder(data)
+
+    reminder = build_reminder(data)
+
+    reminders.put(reminder)
+
+    #Invoke the step function to execute - in sweep mode the due_bucket on the item schedules it
+    #Started once the reminder is written so a failed write leaves no execution behind - its ARN follows from its
+    #name (reminder_execution_arn) so it is not stored
+    if not sweep_mode():
+        start_reminder_execution(reminder)
 
+    return json_response(reminder)
+
+# Create many reminders from one request - body is a json array of reminders as accepted by /create
+# All reminders are validated against a single config read, written with BatchWriteItem in chunks of 25
+# and their step functions started concurrently
+# Returns one result per input reminder in the same order
+@instrumented
+def create_reminders_batch(event, context):
+    data = json.loads(event['body'],strict=False)
+    if not isinstance(data, list):
+        return {
+            "statusCode": 400,
+            "body": "Expected a list of reminders"
+        }
+    if len(data) > BATCH_MAX_ITEMS:
+        return {
+            "statusCode": 400,
+            "body": "At most {max_items} reminders can be created in one request".format(max_items=BATCH_MAX_ITEMS)
+        }
+
+    params = config.params()
+    results = []
+    built = []
+    for index, reminder_data in enumerate(data):
+        try:
+            validate_reminder(reminder_data, params)
+        except Exception as e:
+            results.append({'index': index, 'status': 'invalid', 'error': str(e)})
+            continue
+        reminder = build_reminder(reminder_data)
+        built.append(reminder)
+        results.append({'index': index, 'status': 'created', 'reminder_id': reminder['reminder_id']})
+
+    unprocessed_ids = reminders.batch_put(built)
+    written = [reminder for reminder in built if reminder['reminder_id'] not in unprocessed_ids]
+    failed_starts = {} if sweep_mode() else start_reminder_executions(written)
+
+    for result in results:
+        reminder_id = result.get('reminder_id')
+        if reminder_id in unprocessed_ids:
+            result['status'] = 'failed'
+            result['error'] = 'Reminder could not be written'
+        elif reminder_id in failed_starts:
+            result['status'] = 'failed'
+            result['error'] = failed_starts[reminder_id]
+
+    return json_response(results)
+
+def validate_reminder(data, params=None):
     validate_field(data,'user_id')
     validate_field(data,'notify_date_time')
     validate_field(data,'remind_msg')
     validate_field(data,'notify_by')
 
-    validate_notify_date_time(data)
+    validate_notify_date_time(data, params)
 
+def build_reminder(data):
     timestamp = int(time.time() * 1000)
     reminder_id = str(uuid.uuid1())
     reminder = {
                 'reminder_id': reminder_id, #Partition key
                 'user_id': data['user_id'], #Sort key
                 'notify_date_time': data['notify_date_time'],
+                'due_at': isostr_to_epoch(data['notify_date_time']), #Epoch seconds of notify_date_time for range queries
                 'remind_msg': data['remind_msg'],
                 'state' : 'Pending',
                 'to_execute': 'true',
@@ -93,149 +214,297 @@ def create_reminder(event, context):
                 'updated_at': timestamp,
                 'notify_by': data['notify_by']
             }
+    if sweep_mode():
+        reminder['due_bucket'] = bucket_for(isostr_to_datetime(data['notify_date_time']))
+        reminder['wake_at'] = data['notify_date_time']
+    return reminder
 
-
-    result = table.put_item(Item=reminder)
- 
+# name - defaults to the name of the reminder's first execution
+def start_reminder_execution(reminder, name=None):
     reminder_step_input = {
-        "reminder_id": reminder_id,
+        "reminder_id": reminder['reminder_id'],
         "to_execute" : "true",
-        "notify_date_time" : data['notify_date_time']
+        "notify_date_time" : reminder['notify_date_time']
     }
 
-    #Invoke the step function to execute
-    response = sfn.start_execution(
+    return sfn.start_execution(
         stateMachineArn=os.environ['STEP_FUNCTION_ARN'],
-        name=reminder_id+"_reminder_fn",
+        name=name or reminder['reminder_id']+"_reminder_fn",
         input=json.dumps(reminder_step_input)
     )
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps(reminder),
-    }
+# ARN of the step function waiting on a reminder
+# Reminders without execution_arn (created in bulk or before it was stored) still have their first execution
+# whose ARN follows from the state machine ARN and the execution name
+def reminder_execution_arn(reminder):
+    if reminder.get('execution_arn'):
+        return reminder['execution_arn']
+    state_machine_arn = os.environ.get('STEP_FUNCTION_ARN', '')
+    if ':stateMachine:' not in state_machine_arn:
+        return None
+    return '{arn}:{reminder_id}_reminder_fn'.format(arn=state_machine_arn.replace(':stateMachine:', ':execution:'),
+        reminder_id=reminder['reminder_id'])
+
+# Stop the step function of an acknowledged, deleted or rescheduled reminder so it does not wake up for nothing
+# Failing to stop it only costs that wake up so errors are logged, not raised
+def stop_reminder_execution(reminder, cause):
+    if sweep_mode() or reminder is None:
+        return
+    execution_arn = reminder_execution_arn(reminder)
+    if execution_arn is None:
+        return
+    try:
+        sfn.stop_execution(executionArn=execution_arn, cause=cause)
+    except ClientError as e:
+        logging.error(e.response['Error']['Message'])
+
+# Start step functions for the reminders through a bounded thread pool
+# Returns {reminder_id: error message} for executions that could not be started
+def start_reminder_executions(reminders):
+    if not reminders:
+        return {}
+    failed = {}
+    with ThreadPoolExecutor(max_workers=min(BATCH_SFN_CONCURRENCY, len(reminders))) as executor:
+        futures = [(reminder['reminder_id'], executor.submit(start_reminder_execution, reminder)) for reminder in reminders]
+        for reminder_id, future in futures:
+            try:
+                future.result()
+            except ClientError as e:
+                logging.error(e.response['Error']['Message'])
+                failed[reminder_id] = e.response['Error']['Message']
+    return failed
 
 
 # Update a reminder in DynamoDB - ideally date change
 # Validate not less than {MIN_DELAY_PARAM} mins left 
+@instrumented
 def update_reminder(event, context):
-    #check if reminder exists
-    reminder = getReminder(event['pathParameters']['reminder_id'])
-    if reminder == None:
-        return {
-            "statusCode": 404,
-            "body": "Reminder not found" 
-        }
-    else:
-        print(reminder)
     data = json.loads(event['body'],strict=False)
 
     validate_field(data,'notify_date_time')
     validate_field(data,'remind_msg')
     validate_notify_date_time(data)
 
-    timestamp = int(time.time() * 1000)
+    #check if reminder exists
+    key = resolve_reminder_key(event, data)
+    if key == None:
+        return reminder_not_found()
 
-    result = table.update_item(
-        Key={
-            'reminder_id': reminder['reminder_id'],
-            'user_id': reminder['user_id']
-        },
-        UpdateExpression="SET notify_date_time= :notify_date_time, updated_at= :updated_at, remind_msg= :remind_msg",
-        ExpressionAttributeValues={
-                    ':notify_date_time':data['notify_date_time'],
-                    ':remind_msg' : data['remind_msg'],
-                    ':updated_at':timestamp
-        }
-    )
+    timestamp = int(time.time() * 1000)
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps(result),
+    updates = {
+        'notify_date_time': data['notify_date_time'],
+        'due_at': isostr_to_epoch(data['notify_date_time']),
+        'updated_at': timestamp,
+        'remind_msg': data['remind_msg']
     }
+    #Move the reminder to the bucket of its new time so the sweep picks it up then
+    if sweep_mode():
+        updates['due_bucket'] = bucket_for(isostr_to_datetime(data['notify_date_time']))
+        updates['wake_at'] = data['notify_date_time']
+    else:
+        #Replace the step function so it wakes at the new time - execution names can not be reused
+        execution = start_reminder_execution(dict(key, notify_date_time=data['notify_date_time']),
+            '{reminder_id}_{timestamp}_reminder_fn'.format(reminder_id=key['reminder_id'], timestamp=timestamp))
+        updates['execution_arn'] = execution['executionArn']
+
+    #The old attributes give the execution to stop, the new ones are the old ones with the updates applied
+    #The new execution is stopped when the write fails, whatever the reason - the old one keeps the reminder
+    new_execution = updates if 'execution_arn' in updates else None
+    try:
+        old = reminders.update(key, updates, must_exist=True, return_values='ALL_OLD')
+    except ReminderNotFound:
+        stop_reminder_execution(new_execution, 'Reminder not found')
+        return reminder_not_found()
+    except Exception:
+        stop_reminder_execution(new_execution, 'Reminder not updated')
+        raise
+    stop_reminder_execution(old, 'Reminder rescheduled')
+
+    return json_response(write_result(None if old is None else dict(old, **updates)))
 
 # Mark reminder as deleted in DynamoDB
+@instrumented
 def delete_reminder(event, context):
     #check if reminder exists
-    reminder = getReminder(event['pathParameters']['reminder_id'])
-    if reminder == None:
-        return {
-            "statusCode": 404,
-            "body": "Reminder not found" 
-        }
-    else:
-        print(reminder)
-    result = table.delete_item(
-        Key={
-            'reminder_id': reminder['reminder_id'],
-            'user_id': reminder['user_id']
-        }
-    )
-    return {
-        "statusCode": 200,
-        "body": json.dumps(result) 
-
-    }
-
-# Mark reminder as acknowledged in DynamoDB
+    key = resolve_reminder_key(event)
+    if key == None:
+        return reminder_not_found()
+    try:
+        attributes = reminders.delete(key, must_exist=True, return_values='ALL_OLD')
+    except ReminderNotFound:
+        return reminder_not_found()
+    stop_reminder_execution(attributes, 'Reminder deleted')
+    return json_response(write_result(attributes))
+
+# Mark reminder as acknowledged in DynamoDB - it expires FINISHED_REMINDER_TTL_SECONDS later
+@instrumented
 def ack_reminder(event, context):
     timestamp = int(time.time() * 1000)
     #check if reminder exists
-    reminder = getReminder(event['pathParameters']['reminder_id'])
+    key = resolve_reminder_key(event)
+    if key == None:
+        return reminder_not_found()
+    updates = {
+        'state': 'Acknowledged',
+        'updated_at': timestamp,
+        'to_execute': 'false'
+    }
+    updates.update(finished_updates(timestamp // 1000))
+    try:
+        attributes = reminders.update(key, updates, must_exist=True, return_values='ALL_NEW')
+    except ReminderNotFound:
+        return reminder_not_found()
+    stop_reminder_execution(attributes, 'Reminder acknowledged')
+
+    return json_response(write_result(attributes))
+
+# Table key of the reminder a request addresses
+# The key is reminder_id + user_id - when the client passes user_id (query string or body) the write
+# goes straight to DynamoDB and a missing reminder fails its attribute_exists condition
+# otherwise user_id is looked up with getReminder first
+def resolve_reminder_key(event, data=None):
+    reminder_id = event['pathParameters']['reminder_id']
+    user_id = (event.get('queryStringParameters') or {}).get('user_id') or (data or {}).get('user_id')
+    if user_id is not None:
+        return {'reminder_id': reminder_id, 'user_id': user_id}
+    reminder = getReminder(reminder_id)
     if reminder == None:
+        return None
+    return {'reminder_id': reminder['reminder_id'], 'user_id': reminder['user_id']}
+
+# Response body of a write - the written reminder under Attributes as DynamoDB returns it
+def write_result(attributes):
+    return {} if attributes is None else {'Attributes': attributes}
+
+reminder_not_found = static_response(404, "Reminder not found")
+invalid_cursor = static_response(400, "Invalid limit or cursor")
+
+# List a page of a user's reminders with all their attributes
+# Query string - limit: page size (default LIST_DEFAULT_LIMIT, max 100), cursor: X-Next-Cursor of the previous page
+# due_from / due_to: ISO-8601 date times, only reminders due in the range (inclusive) in due order from UserDueAtIndex
+# The indexes only project keys so each page is hydrated with one BatchGetItem
+@instrumented
+def list_reminders(event, context):
+    user_id = event['pathParameters']['user_id']
+    query_params = event.get('queryStringParameters') or {}
+
+    try:
+        limit = int(query_params.get('limit', LIST_DEFAULT_LIMIT))
+        exclusive_start_key = decode_cursor(query_params['cursor'], user_id) if query_params.get('cursor') else None
+    except ValueError:
+        return invalid_cursor()
+    try:
+        due_from = isostr_to_epoch(query_params['due_from']) if query_params.get('due_from') else None
+        due_to = isostr_to_epoch(query_params['due_to']) if query_params.get('due_to') else None
+    except ValueError:
         return {
-            "statusCode": 404,
-            "body": "Reminder not found" 
+            "statusCode": 400,
+            "body": "Invalid due_from or due_to"
         }
-    else:
-        print(reminder)
-    result = table.update_item(
-        Key={
-            'reminder_id': reminder['reminder_id'],
-            'user_id': reminder['user_id']
-        },
-        UpdateExpression="SET #st= :state, updated_at= :updated_at, to_execute= :to_execute",
-        ExpressionAttributeValues={
-                    ':state':'Acknowledged',
-                    ':updated_at':timestamp,
-                    ':to_execute':'false'
-        },
-        ExpressionAttributeNames={
-            "#st": "state"
+    #A cursor only continues the listing it came from - due range listings page on due_at too
+    if exclusive_start_key is not None and ('due_at' in exclusive_start_key) != (due_from is not None or due_to is not None):
+        return invalid_cursor()
+    if limit < 1 or limit > LIST_MAX_LIMIT:
+        return {
+            "statusCode": 400,
+            "body": "limit should be between 1 and {max_limit}".format(max_limit=LIST_MAX_LIMIT)
         }
-    )
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps(result) 
-    }
-
-# Mark reminder as acknowledged in DynamoDB
-def list_reminders(event, context):
+    keys, last_evaluated_key = reminders.query_by_user(user_id, limit, exclusive_start_key, due_from, due_to)
+
+    result = json_response(batch_get_reminders(keys))
+    if last_evaluated_key is not None:
+        result['headers'] = {'X-Next-Cursor': encode_cursor(last_evaluated_key)}
+    return result
+
+# Counts of a user's reminders by state, the next due notify_date_time and when they last changed
+# Reads the single summary item kept up to date by summary_reminder_handler.update_summaries
+@instrumented
+def get_reminder_summary(event, context):
+    summary = get_summary(event['pathParameters']['user_id'], reminders)
+    return json_response(summary)
+
+# Export all of a user's reminders, finished ones not archived yet included
+# Query string - format: ndjson (default) or csv
+# Reminders are read a page at a time (UserIdIndex query + BatchGetItem) and encoded as they arrive, so memory is
+# bounded by the inline limit and one upload part rather than the number of reminders. Exports up to
+# EXPORT_INLINE_MAX_BYTES are returned as an attachment, larger ones are uploaded to the export store and answered
+# with a 303 to a presigned URL
+@instrumented
+def export_reminders(event, context):
     user_id = event['pathParameters']['user_id']
+    query_params = event.get('queryStringParameters') or {}
+    export_format = query_params.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return {
+            "statusCode": 400,
+            "body": "format should be one of {formats}".format(formats=', '.join(sorted(EXPORT_FORMATS)))
+        }
+    content_type, extension, header, encode = EXPORT_FORMATS[export_format]
+    filename = '{user_id}-{timestamp}.{extension}'.format(user_id=user_id,
+        timestamp=datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'), extension=extension)
+    spool = ExportSpool(export_store, '{user_id}/{id}/{filename}'.format(user_id=user_id, id=uuid.uuid4(), filename=filename),
+        EXPORT_INLINE_MAX_BYTES, EXPORT_PART_BYTES)
 
-    response = table.query(
-        IndexName='UserIdIndex',
-        KeyConditionExpression=Key('user_id').eq(user_id))
+    try:
+        spool.write(header)
+        for item in iter_user_reminders(reminders, user_id):
+            spool.write(encode(item))
+        body = spool.close()
+    except ExportTooLarge:
+        logging.error("Export of user %s is over %s bytes and no export store is configured", user_id, spool.inline_max_bytes)
+        return {
+            "statusCode": 413,
+            "body": "Export too large"
+        }
+    except Exception:
+        spool.abort()
+        raise
 
+    if body is None:
+        url = export_store.url(spool.key, EXPORT_URL_EXPIRES_SECONDS)
+        return {
+            "statusCode": 303,
+            "headers": {'Location': url},
+            "body": dumps({'url': url, 'size': spool.size})
+        }
     return {
         "statusCode": 200,
-        "body": json.dumps(response['Items']),
+        "headers": {
+            'Content-Type': content_type,
+            'Content-Disposition': 'attachment; filename="{filename}"'.format(filename=filename)
+        },
+        "body": body.decode('utf-8')
     }
 
+# Opaque continuation token for a query's LastEvaluatedKey
+def encode_cursor(last_evaluated_key):
+    return base64.urlsafe_b64encode(dumps_bytes(last_evaluated_key)).decode('ascii')
+
+# Raises ValueError when the cursor is malformed or belongs to another user's listing
+def decode_cursor(cursor, user_id):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+    if not isinstance(key, dict) or key.get('user_id') != user_id:
+        raise ValueError("Cursor does not belong to user {user_id}".format(user_id=user_id))
+    return key
+
+# Fetch full reminders for a list of keys with BatchGetItem
+# Returns the reminders in the order of the keys, skipping any that no longer exist
+def batch_get_reminders(keys):
+    found = reminders.batch_get(keys)
+    return [found[key['reminder_id']] for key in keys if key['reminder_id'] in found]
+
 def getReminder(reminder_id):
     #fetch the reminder
     try:
-        response = table.query(
-        KeyConditionExpression=Key('reminder_id').eq(reminder_id)
-    )
+        item = reminders.get(reminder_id)
     except ClientError as e:
-        print(e.response['Error']['Message'])
-        logging.info(e.response['Error']['Message'])
+        logging.error(e.response['Error']['Message'])
         return None
     else:
-        item = None if len(response['Items']) == 0 else response['Items'][0]
-        logging.info("GetItem succeeded:")
-        print("GetItem succeeded:")
-        logging.info(item)
+        logging.debug("GetItem succeeded: %s", item)
         return item
\ No newline at end of file
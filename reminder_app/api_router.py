@@ -0,0 +1,46 @@
+import logging
+try:
+    from reminder_app import api_reminder_handler
+    from reminder_app.serialization import static_response
+except ImportError:
+    import api_reminder_handler
+    from serialization import static_response
+
+# Single function deployment of the API (ApiDeployment=single in template.yaml) - every route invokes route()
+# API Gateway passes the resource template of the matched route (/ack/{reminder_id}) and its method, which pick the
+# api_reminder_handler function that serves the route in the function per route deployment
+# All routes share one pool of warm containers and the clients, config cache and reminder cache of
+# api_reminder_handler - a container warmed by /list serves the next /ack without a cold start
+# Routes keep their own metrics, the handlers are @instrumented themselves
+ROUTES = {
+    ('/create', 'POST'): api_reminder_handler.create_reminder,
+    ('/create/batch', 'POST'): api_reminder_handler.create_reminders_batch,
+    ('/update/{reminder_id}', 'POST'): api_reminder_handler.update_reminder,
+    ('/delete/{reminder_id}', 'GET'): api_reminder_handler.delete_reminder,
+    ('/ack/{reminder_id}', 'GET'): api_reminder_handler.ack_reminder,
+    ('/list/{user_id}', 'GET'): api_reminder_handler.list_reminders,
+    ('/summary/{user_id}', 'GET'): api_reminder_handler.get_reminder_summary,
+    ('/export/{user_id}', 'GET'): api_reminder_handler.export_reminders,
+}
+
+#Methods by resource, for the Allow header of a 405
+METHODS = {}
+for resource, method in sorted(ROUTES):
+    METHODS.setdefault(resource, []).append(method)
+
+route_not_found = static_response(404, "Route not found")
+
+def route(event, context):
+    resource = event.get('resource')
+    method = (event.get('httpMethod') or '').upper()
+    handler = ROUTES.get((resource, method))
+    if handler is not None:
+        return handler(event, context)
+    if resource in METHODS:
+        return {
+            "statusCode": 405,
+            "headers": {'Allow': ', '.join(METHODS[resource])},
+            "body": "Method not allowed"
+        }
+    logging.error("No route for %s %s", method, resource)
+    return route_not_found()
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+try:
+    from reminder_app import aws_clients, instrumentation
+    from reminder_app.archive_store import NDJSONChunk, default_store
+    from reminder_app.reminder_repository import DynamoDBReminderRepository, FINISHED_STATES, parallel_scan, reminder_key
+    from reminder_app.instrumentation import instrumented
+except ImportError:
+    import aws_clients
+    import instrumentation
+    from archive_store import NDJSONChunk, default_store
+    from reminder_repository import DynamoDBReminderRepository, FINISHED_STATES, parallel_scan, reminder_key
+    from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Finished reminders last updated longer ago than this are archived (keep it under FINISHED_REMINDER_TTL_SECONDS
+# or DynamoDB TTL deletes them first)
+ARCHIVE_AFTER_SECONDS = int(os.environ.get('ARCHIVE_AFTER_SECONDS', '604800'))
+# A new run starts this long after the previous one started - invocations in between resume an unfinished run
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '86400'))
+ARCHIVE_SEGMENTS = int(os.environ.get('ARCHIVE_SEGMENTS', '4'))
+ARCHIVE_PAGE_SIZE = int(os.environ.get('ARCHIVE_PAGE_SIZE', '100'))
+# Reminders per NDJSON chunk - a chunk is written and its reminders deleted once it holds at least this many
+ARCHIVE_CHUNK_ITEMS = int(os.environ.get('ARCHIVE_CHUNK_ITEMS', '1000'))
+# No page is started once less time than this is left of the invocation
+ARCHIVE_STOP_MARGIN_SECONDS = float(os.environ.get('ARCHIVE_STOP_MARGIN_SECONDS', '60'))
+
+CHECKPOINT_KEY = 'checkpoint.json'
+
+dynamodb = aws_clients.lazy_resource('dynamodb', region_name='us-east-1')
+table = aws_clients.lazy_table('{stack_name}-RemindersTable'.format(stack_name=os.environ['STACK_NAME']), region_name='us-east-1')
+reminders = DynamoDBReminderRepository(table, dynamodb)
+store = default_store()
+
+# Triggered by a schedule - moves finished reminders out of RemindersTable into the archive store
+# A run scans the table in parallel segments for Acknowledged and Unacknowledged reminders updated before its cutoff
+# Each segment writes them to gzip NDJSON chunks (runs/<run>/segment-<n>/chunk-<n>.ndjson.gz). Once a chunk is
+# stored the segment's scan position after it is saved in checkpoint.json, and only then are the chunk's reminders
+# deleted with BatchWriteItem - an invocation that runs out of time (or fails) is resumed by the next one from there.
+# Chunks are named by their position in the run. A chunk is only written again when the checkpoint after it was not
+# saved, and then its reminders were not deleted either - the rescan finds them and the chunk replaces itself with them.
+# Reminders of a stored chunk that could not be deleted are archived again by a later run
+# Memory is one page and one compressed chunk per segment whatever the size of the table
+# BatchWriteItem deletes can not be conditional - a finished reminder changed between the scan and the delete is
+# archived as it was scanned
+@instrumented
+def archive_reminders(event, context):
+    stop = None
+    if context is not None:
+        stop = lambda: context.get_remaining_time_in_millis() < ARCHIVE_STOP_MARGIN_SECONDS * 1000
+    summary = archive(reminders, store, int(time.time() * 1000), stop)
+    logging.info(summary)
+    return summary
+
+# now_ms - epoch milliseconds, as updated_at
+def archive(repository, store, now_ms, stop=None, total_segments=ARCHIVE_SEGMENTS, page_size=ARCHIVE_PAGE_SIZE,
+        chunk_items=ARCHIVE_CHUNK_ITEMS):
+    checkpoint = load_checkpoint(store)
+    if checkpoint is None or checkpoint['complete']:
+        if checkpoint is not None and now_ms - checkpoint['started_at'] < ARCHIVE_INTERVAL_SECONDS * 1000:
+            return {'run': checkpoint['run'], 'complete': True, 'archived': 0, 'chunks': 0, 'not_deleted': 0}
+        checkpoint = new_checkpoint(now_ms, total_segments)
+        #Saved first so an invocation that fails before its first chunk is resumed with the same run and cutoff
+        save_checkpoint(store, checkpoint)
+    segments = {int(segment): progress for segment, progress in checkpoint['segments'].items()}
+    summary = {'run': checkpoint['run'], 'complete': False, 'archived': 0, 'chunks': 0, 'not_deleted': 0}
+    lock = threading.Lock()
+    #Reminders scanned but not written yet and where the scan got to, per segment
+    pending = {}
+    positions = {}
+
+    def flush(segment, last_evaluated_key):
+        chunk, keys = pending.pop(segment, (None, []))
+        progress = segments.get(segment, {'start_key': None, 'chunks': 0, 'done': False})
+        if keys:
+            store.put(chunk_key(checkpoint['run'], segment, progress['chunks']), chunk.close())
+        with lock:
+            segments[segment] = {'start_key': last_evaluated_key, 'chunks': progress['chunks'] + (1 if keys else 0),
+                'done': last_evaluated_key is None}
+            checkpoint['segments'] = {str(number): progress for number, progress in segments.items()}
+            save_checkpoint(store, checkpoint)
+        #The chunk is stored and no later invocation writes over it
+        not_deleted = repository.batch_delete(keys) if keys else set()
+        if not_deleted:
+            logger.error("Segment %s: %s archived reminders could not be deleted", segment, len(not_deleted))
+        with lock:
+            summary['archived'] += len(keys)
+            summary['chunks'] += 1 if keys else 0
+            summary['not_deleted'] += len(not_deleted)
+        instrumentation.count('Archive.Reminders', len(keys))
+
+    def process(segment, items, last_evaluated_key):
+        chunk, keys = pending.setdefault(segment, (NDJSONChunk(), []))
+        for item in items:
+            chunk.write(item)
+            keys.append(reminder_key(item))
+        positions[segment] = last_evaluated_key
+        if last_evaluated_key is None or chunk.count >= chunk_items:
+            flush(segment, last_evaluated_key)
+
+    start_keys = {segment: None if progress['done'] else progress['start_key'] for segment, progress in segments.items()
+        if progress['done'] or progress['start_key'] is not None}
+    try:
+        parallel_scan(repository, checkpoint['total_segments'], process, page_size=page_size, start_keys=start_keys, stop=stop,
+            states=FINISHED_STATES, updated_before=checkpoint['cutoff'])
+    finally:
+        #Segments stopped part way through a chunk write what they have so the next invocation starts after it
+        for segment in list(pending):
+            flush(segment, positions[segment])
+
+    if all(segments.get(segment, {}).get('done') for segment in range(checkpoint['total_segments'])):
+        checkpoint['complete'] = True
+        save_checkpoint(store, checkpoint)
+        summary['complete'] = True
+    return summary
+
+def new_checkpoint(now_ms, total_segments):
+    return {
+        'run': datetime.utcfromtimestamp(now_ms // 1000).strftime('%Y%m%dT%H%M%SZ'),
+        'started_at': now_ms,
+        #Finished reminders last updated before the cutoff are archived
+        'cutoff': now_ms - ARCHIVE_AFTER_SECONDS * 1000,
+        'total_segments': total_segments,
+        #{segment: {'start_key': scan position after the last chunk, 'chunks': chunks written, 'done': bool}}
+        'segments': {},
+        'complete': False
+    }
+
+def load_checkpoint(store):
+    body = store.get(CHECKPOINT_KEY)
+    return None if body is None else json.loads(body.decode('utf-8'))
+
+def save_checkpoint(store, checkpoint):
+    store.put(CHECKPOINT_KEY, json.dumps(checkpoint).encode('utf-8'))
+
+def chunk_key(run, segment, number):
+    return 'runs/{run}/segment-{segment:03d}/chunk-{number:06d}.ndjson.gz'.format(run=run, segment=segment, number=number)
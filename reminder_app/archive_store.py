@@ -0,0 +1,163 @@
+import gzip
+import io
+import os
+from botocore.exceptions import ClientError
+try:
+    from reminder_app import aws_clients
+    from reminder_app.serialization import dumps_bytes
+except ImportError:
+    import aws_clients
+    from serialization import dumps_bytes
+
+# Object stores for the archival job and exports - an S3 bucket in a deployed stack (ARCHIVE_BUCKET), a local
+# directory standing in for it otherwise (ARCHIVE_DIRECTORY, e.g. with sam local or in tests)
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', '')
+ARCHIVE_DIRECTORY = os.environ.get('ARCHIVE_DIRECTORY', '')
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'reminders/')
+
+# S3 rejects multipart uploads with a part other than the last under 5MB
+S3_MIN_PART_BYTES = 5 * 1024 * 1024
+
+# Keys are relative paths such as runs/<run>/segment-000/chunk-000000.ndjson.gz
+class ArchiveStore(object):
+    # Stores body (bytes) under key, replacing what was there
+    def put(self, key, body):
+        raise NotImplementedError
+
+    # The bytes stored under key, or None
+    def get(self, key):
+        raise NotImplementedError
+
+    # Writer storing an object under key from parts written one after the other, see S3MultipartWriter
+    def writer(self, key):
+        raise NotImplementedError
+
+    # URL to download key from for expires_in seconds
+    def url(self, key, expires_in):
+        raise NotImplementedError
+
+class S3ArchiveStore(ArchiveStore):
+    def __init__(self, s3, bucket, prefix=ARCHIVE_PREFIX):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, key, body):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=body)
+
+    def get(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def writer(self, key):
+        return S3MultipartWriter(self.s3, self.bucket, self.prefix + key)
+
+    def url(self, key, expires_in):
+        return self.s3.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key},
+            ExpiresIn=expires_in)
+
+# Multipart upload of one object - every part but the last must be at least S3_MIN_PART_BYTES
+# The object only appears once close() completes the upload, abort() discards the parts
+class S3MultipartWriter(object):
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        self.parts = []
+
+    def write(self, body):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+class LocalArchiveStore(ArchiveStore):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    # Written to a temporary file first so a reader never sees half an object, as with S3
+    def put(self, key, body):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def writer(self, key):
+        return LocalFileWriter(self._path(key))
+
+    def url(self, key, expires_in):
+        return 'file://' + os.path.abspath(self._path(key))
+
+# Same protocol as S3MultipartWriter on a file - it only appears under its name once closed
+class LocalFileWriter(object):
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path + '.tmp', 'wb')
+
+    def write(self, body):
+        self._file.write(body)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.path + '.tmp')
+
+# An S3 store when bucket is set, else a local one (prefix as a subdirectory) when directory is set, else None
+def store_for(bucket, directory, prefix=''):
+    if bucket:
+        return S3ArchiveStore(aws_clients.lazy_client('s3'), bucket, prefix)
+    if directory:
+        return LocalArchiveStore(os.path.join(directory, *prefix.split('/')) if prefix else directory)
+    return None
+
+# The archive store configured by the environment, None when there is none
+def default_store():
+    if ARCHIVE_BUCKET:
+        return S3ArchiveStore(aws_clients.lazy_client('s3'), ARCHIVE_BUCKET)
+    if ARCHIVE_DIRECTORY:
+        return LocalArchiveStore(ARCHIVE_DIRECTORY)
+    return None
+
+# One gzip compressed NDJSON object built in memory, one item per line
+# Only the compressed bytes are kept so a chunk of a few thousand reminders stays small
+class NDJSONChunk(object):
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        #mtime 0 so the same reminders always compress to the same bytes
+        self._gzip = gzip.GzipFile(fileobj=self._buffer, mode='wb', mtime=0)
+        self.count = 0
+
+    def write(self, item):
+        self._gzip.write(dumps_bytes(item) + b'\n')
+        self.count += 1
+
+    # The compressed chunk - nothing can be written after it
+    def close(self):
+        self._gzip.close()
+        return self._buffer.getvalue()
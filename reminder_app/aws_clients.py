@@ -0,0 +1,104 @@
+import threading
+import boto3
+try:
+    from reminder_app import instrumentation
+    from reminder_app.client_config import client_config
+except ImportError:
+    import instrumentation
+    from client_config import client_config
+
+# Registry of the boto3 clients and resources used by the handlers
+# Everything is built from one boto3/botocore session so service models are only loaded once per container
+# and nothing is created until an entry point actually makes a call through it
+# Timeouts, retries and connection pooling come from client_config unless a config is passed
+# and every call is timed by the instrumentation hooks registered on the session
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_resources = {}
+#Bumped by reset so proxies drop clients created before it
+_generation = 0
+
+def session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                new_session = boto3.session.Session()
+                instrumentation.register(new_session.events)
+                _session = new_session
+    return _session
+
+def client(service_name, **kwargs):
+    key = (service_name, tuple(sorted(kwargs.items())))
+    found = _clients.get(key)
+    if found is None:
+        with _lock:
+            found = _clients.get(key)
+            if found is None:
+                found = _clients[key] = session().client(service_name, **with_config(service_name, kwargs))
+    return found
+
+def resource(service_name, **kwargs):
+    key = (service_name, tuple(sorted(kwargs.items())))
+    found = _resources.get(key)
+    if found is None:
+        with _lock:
+            found = _resources.get(key)
+            if found is None:
+                found = _resources[key] = session().resource(service_name, **with_config(service_name, kwargs))
+    return found
+
+def with_config(service_name, kwargs):
+    if 'config' in kwargs:
+        return kwargs
+    return dict(kwargs, config=client_config(service_name))
+
+# Names of the clients and resources created so far e.g. for cold start logging
+def created():
+    return sorted(key[0] for key in _clients) + sorted(key[0] + ' resource' for key in _resources)
+
+# Drop every cached client and the session
+def reset():
+    global _session, _generation
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _session = None
+        _generation += 1
+
+# Stands in for a client, resource or table and creates it on first attribute access
+# Module level names in the handlers stay the same so tests can keep wrapping them with Stubber
+class LazyProxy(object):
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_generation', None)
+
+    def _resolve(self):
+        if self._generation != _generation:
+            with _lock:
+                if self._generation != _generation:
+                    object.__setattr__(self, '_target', self._factory())
+                    object.__setattr__(self, '_generation', _generation)
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __repr__(self):
+        if self._generation != _generation:
+            return '<LazyProxy (not created)>'
+        return repr(self._target)
+
+def lazy_client(service_name, **kwargs):
+    return LazyProxy(lambda: client(service_name, **kwargs))
+
+def lazy_resource(service_name, **kwargs):
+    return LazyProxy(lambda: resource(service_name, **kwargs))
+
+def lazy_table(table_name, **kwargs):
+    return LazyProxy(lambda: resource('dynamodb', **kwargs).Table(table_name))
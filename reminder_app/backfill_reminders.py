@@ -0,0 +1,89 @@
+import argparse
+import collections
+import logging
+import sys
+import threading
+import time
+try:
+    from reminder_app import aws_clients
+    from reminder_app.date_utils import isostr_to_epoch
+    from reminder_app.reminder_repository import DynamoDBReminderRepository, ReminderChanged, FINISHED_STATES, \
+        finished_updates, parallel_scan, reminder_key
+except ImportError:
+    import aws_clients
+    from date_utils import isostr_to_epoch
+    from reminder_repository import DynamoDBReminderRepository, ReminderChanged, FINISHED_STATES, \
+        finished_updates, parallel_scan, reminder_key
+
+logger = logging.getLogger(__name__)
+
+# One-off migration of reminders written before due_at and expires_at were added
+# Adds due_at (epoch seconds of notify_date_time) where it is missing and expires_at to finished reminders without
+# one - their TTL runs from updated_at, so reminders that finished longer than FINISHED_REMINDER_TTL_SECONDS ago
+# are deleted by DynamoDB shortly after the migration
+# Every update is conditioned on the notify_date_time and state it was computed from - a reminder changed since it
+# was scanned is skipped, the change wrote its own due_at. Running it again only updates what is still missing
+# Run from the repository root: python -m reminder_app.backfill_reminders --stack-name <stack> [--segments 8] [--dry-run]
+DEFAULT_SEGMENTS = 8
+DEFAULT_PAGE_SIZE = 100
+
+SCANNED_ATTRIBUTES = ['reminder_id', 'user_id', 'notify_date_time', 'state', 'updated_at', 'due_at', 'expires_at']
+
+# The attributes a scanned reminder is missing
+def backfill_updates(item):
+    updates = {}
+    if 'due_at' not in item and 'notify_date_time' in item:
+        updates['due_at'] = isostr_to_epoch(item['notify_date_time'])
+    if item.get('state') in FINISHED_STATES and 'expires_at' not in item:
+        updates.update(finished_updates(int(item.get('updated_at', time.time() * 1000)) // 1000))
+    return updates
+
+# Returns counts of the reminders scanned, updated, changed since they were scanned (skipped) and with an
+# invalid notify_date_time
+def backfill(repository, total_segments=DEFAULT_SEGMENTS, page_size=DEFAULT_PAGE_SIZE, dry_run=False):
+    counts = collections.Counter(scanned=0, updated=0, changed=0, invalid=0)
+    lock = threading.Lock()
+
+    def process(segment, items, last_evaluated_key):
+        page = collections.Counter(scanned=len(items))
+        for item in items:
+            try:
+                updates = backfill_updates(item)
+            except ValueError:
+                logger.error("Reminder %s has an invalid notify_date_time %s", item['reminder_id'], item.get('notify_date_time'))
+                page['invalid'] += 1
+                continue
+            if not updates:
+                continue
+            if not dry_run:
+                try:
+                    repository.update(reminder_key(item), updates,
+                        conditions={name: item[name] for name in ('notify_date_time', 'state') if name in item})
+                except ReminderChanged:
+                    page['changed'] += 1
+                    continue
+            page['updated'] += 1
+        with lock:
+            counts.update(page)
+            logger.info("Segment %s: %s", segment, dict(counts))
+
+    parallel_scan(repository, total_segments, process, SCANNED_ATTRIBUTES, page_size)
+    return dict(counts)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stack-name', required=True)
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS, help='parallel scan segments, one thread each')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='reminders read per scan call')
+    parser.add_argument('--dry-run', action='store_true', help='count the reminders to update without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    dynamodb = aws_clients.resource('dynamodb', region_name=args.region)
+    table = dynamodb.Table('{stack_name}-RemindersTable'.format(stack_name=args.stack_name))
+    counts = backfill(DynamoDBReminderRepository(table, dynamodb), args.segments, args.page_size, args.dry_run)
+    sys.stdout.write('{scanned} scanned, {updated} updated, {changed} changed since scanned, {invalid} invalid\n'.format(**counts))
+
+if __name__ == '__main__':
+    main()
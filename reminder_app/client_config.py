@@ -0,0 +1,40 @@
+import os
+from botocore.config import Config
+
+# botocore settings applied to every client made through aws_clients
+# Each setting is read from CLIENT_<SETTING> and can be overridden for one service with CLIENT_<SERVICE>_<SETTING>
+# e.g. CLIENT_READ_TIMEOUT=2 and CLIENT_SES_READ_TIMEOUT=4 - service names as passed to boto3 upper cased
+# MAX_ATTEMPTS counts the first call. A stalled read fails after READ_TIMEOUT instead of botocore's 60 seconds
+# so the handlers get an error back while still inside their 3 second function timeout
+# adaptive retries throttle the client itself after throttling errors - fewer throttles but slower calls
+# so it is only turned on for SSM in template.yaml, see benchmarks/bench_client_config.py
+DEFAULTS = {
+    'CONNECT_TIMEOUT': '1',
+    'READ_TIMEOUT': '2',
+    'MAX_ATTEMPTS': '3',
+    'RETRY_MODE': 'standard',
+    'MAX_POOL_CONNECTIONS': '25',
+    'TCP_KEEPALIVE': 'true',
+}
+
+def setting(service_name, name, environ=os.environ):
+    service_key = 'CLIENT_{service}_{name}'.format(service=service_name.upper().replace('-', '_'), name=name)
+    if service_key in environ:
+        return environ[service_key]
+    return environ.get('CLIENT_' + name, DEFAULTS[name])
+
+def client_settings(service_name, environ=os.environ):
+    value = lambda name: setting(service_name, name, environ)
+    return {
+        'connect_timeout': float(value('CONNECT_TIMEOUT')),
+        'read_timeout': float(value('READ_TIMEOUT')),
+        'retries': {
+            'total_max_attempts': int(value('MAX_ATTEMPTS')),
+            'mode': value('RETRY_MODE')
+        },
+        'max_pool_connections': int(value('MAX_POOL_CONNECTIONS')),
+        'tcp_keepalive': value('TCP_KEEPALIVE').lower() == 'true',
+    }
+
+def client_config(service_name, environ=os.environ):
+    return Config(**client_settings(service_name, environ))
@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+# How long loaded SSM parameters are considered fresh (seconds)
+DEFAULT_TTL_SECONDS = int(os.environ.get('CONFIG_TTL_SECONDS', '300'))
+# When 'true' an expired cache keeps serving the last good values while a background thread reloads them
+BACKGROUND_REFRESH = os.environ.get('CONFIG_BACKGROUND_REFRESH', 'true').lower() == 'true'
+
+def app_param_path():
+    return '/{app_name}/{stage}'.format(app_name=os.environ['APP_NAME'],stage=os.environ['STAGE'])
+
+# Caches the app parameters stored under an SSM path for the life of a warm container
+# Parameters are exposed by their short name e.g. 'min_delay_param' for '/app/stage/min_delay_param'
+# Expired values are refreshed either in the background or inline on the next read
+# If SSM fails the last good values are served until a reload succeeds
+class ConfigProvider(object):
+    def __init__(self, ssm_client, path, ttl_seconds=DEFAULT_TTL_SECONDS, background_refresh=BACKGROUND_REFRESH, clock=time.time):
+        self.ssm = ssm_client
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.background_refresh = background_refresh
+        self.clock = clock
+        self._params = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, name):
+        return self.params()[name]
+
+    def get_int(self, name):
+        return int(self.get(name))
+
+    # Returns all the cached parameters, loading them from SSM when missing or expired
+    def params(self):
+        params = self._params
+        if params is not None and not self._expired():
+            self.hits += 1
+            return params
+
+        self.misses += 1
+        if params is not None and self.background_refresh:
+            self._refresh_in_background()
+            return params
+        return self._refresh()
+
+    def invalidate(self):
+        with self._lock:
+            self._params = None
+            self._loaded_at = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'age_seconds': None if self._params is None else self.clock() - self._loaded_at
+        }
+
+    def _expired(self):
+        return self.clock() - self._loaded_at >= self.ttl_seconds
+
+    def _load(self):
+        params = {}
+        prefix_len = len(self.path) + 1
+        kwargs = {'Path': self.path, 'Recursive': False}
+        while True:
+            response = self.ssm.get_parameters_by_path(**kwargs)
+            for param in response['Parameters']:
+                params[param['Name'][prefix_len:]] = param['Value']
+            if not response.get('NextToken'):
+                return params
+            kwargs['NextToken'] = response['NextToken']
+
+    def _refresh(self):
+        try:
+            params = self._load()
+        except (ClientError, BotoCoreError) as e:
+            self.errors += 1
+            if self._params is None:
+                raise
+            logger.warning("Could not reload parameters from %s, using last good values: %s", self.path, e)
+            # Back off for a full TTL so a throttled SSM is not hit on every request
+            self._loaded_at = self.clock()
+            return self._params
+        logger.debug("Loaded parameters from %s: %s", self.path, sorted(params))
+        self._params = params
+        self._loaded_at = self.clock()
+        return params
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception:
+                logger.exception("Background parameter refresh failed")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,74 @@
+import calendar
+import logging
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Number of recently parsed date strings kept per container
+DATE_CACHE_SIZE = int(os.environ.get('DATE_CACHE_SIZE', '1024'))
+
+ISO_FORMAT = '%04d-%02d-%02dT%02d:%02d:%02d.%06dZ'
+
+# Parse an ISO-8601 date time such as 2020-01-01T12:00:00.000000Z or 2020-01-01T17:30:00+05:30
+# Returns a naive datetime in UTC - offsets are applied rather than dropped
+# Fraction of seconds is optional, a Z or +-HH:MM / +-HHMM offset is required
+# Slices the fixed width fields instead of going through strptime and remembers recent strings
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def isostr_to_datetime(date_string):
+    length = len(date_string)
+    if (length < 20 or date_string[4] != '-' or date_string[7] != '-' or date_string[10] not in 'Tt '
+            or date_string[13] != ':' or date_string[16] != ':'
+            or not (date_string[0:4] + date_string[5:7] + date_string[8:10] + date_string[11:13]
+                    + date_string[14:16] + date_string[17:19]).isdigit()):
+        raise ValueError("Invalid ISO-8601 date time: {date_string!r}".format(date_string=date_string))
+    try:
+        pos = 19
+        microsecond = 0
+        if date_string[pos] == '.':
+            end = pos + 1
+            while end < length and '0' <= date_string[end] <= '9':
+                end += 1
+            if end == pos + 1:
+                raise ValueError("missing fraction digits")
+            microsecond = int(date_string[pos + 1:end][:6].ljust(6, '0'))
+            pos = end
+        dtval = datetime(int(date_string[0:4]), int(date_string[5:7]), int(date_string[8:10]),
+            int(date_string[11:13]), int(date_string[14:16]), int(date_string[17:19]), microsecond)
+        tz = date_string[pos:]
+        if tz != 'Z' and tz != 'z':
+            dtval -= _utc_offset(tz)
+    except (ValueError, IndexError) as e:
+        raise ValueError("Invalid ISO-8601 date time: {date_string!r} - {error}".format(date_string=date_string, error=e))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Parsed %s to %s", date_string, dtval)
+    return dtval
+
+# Format a datetime as 2020-01-01T12:00:00.000000Z
+# Naive datetimes are taken to be UTC, aware ones are converted to UTC first
+def datetime_to_isostr(date):
+    offset = date.utcoffset()
+    if offset is not None:
+        date = date.replace(tzinfo=None) - offset
+    return ISO_FORMAT % (date.year, date.month, date.day, date.hour, date.minute, date.second, date.microsecond)
+
+# Whole seconds since the epoch of a datetime - naive datetimes are taken to be UTC
+def datetime_to_epoch(date):
+    return calendar.timegm(date.utctimetuple())
+
+# Epoch seconds of an ISO-8601 date time, e.g. for the numeric due_at of a notify_date_time
+def isostr_to_epoch(date_string):
+    return datetime_to_epoch(isostr_to_datetime(date_string))
+
+def _utc_offset(tz):
+    if len(tz) == 6 and tz[3] == ':':
+        hours, minutes = tz[1:3], tz[4:6]
+    elif len(tz) == 5:
+        hours, minutes = tz[1:3], tz[3:5]
+    else:
+        raise ValueError("invalid UTC offset {tz!r}".format(tz=tz))
+    if tz[0] not in '+-' or not (hours + minutes).isdigit():
+        raise ValueError("invalid UTC offset {tz!r}".format(tz=tz))
+    offset = timedelta(hours=int(hours), minutes=int(minutes))
+    return offset if tz[0] == '+' else -offset
@@ -1,29 +1,31 @@
 import json
-import boto3
 import logging
 import os
 import time
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from boto3.dynamodb.conditions import Key, Attr
 #from reminder_app.api_reminder_handler import validate_field
-#import reminder_app.DecimalEncoder as DecimalEncoder
 from botocore.exceptions import ClientError
-#from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
-
-#TODO PUT COMMON CODE IN LAYERS
-def isostr_to_datetime(date_string):
-    print("From Datestr:",date_string)
-    dtval = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%f%z').replace(tzinfo=None)
-    print ("To Datetime:",dtval)
-    return dtval
-
-def datetime_to_isostr(date):
-    print("From Datetime:",date)
-    #FIXME - handle propertly
-    dt = date.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')+'Z'
-    print("To Datestr:",dt)
-    return dt
+try:
+    from reminder_app import aws_clients
+    from reminder_app.config_provider import ConfigProvider, app_param_path
+    from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr, isostr_to_epoch
+    from reminder_app.reminder_repository import CachedReminderRepository, DynamoDBReminderRepository, ReminderNotFound, finished_updates
+    from reminder_app.retry_policy import policy_from_params
+    from reminder_app.rate_limiter import RateLimiter, SendDeferred
+    from reminder_app.instrumentation import instrumented
+    from reminder_app.serialization import json_response
+except ImportError:
+    import aws_clients
+    from config_provider import ConfigProvider, app_param_path
+    from date_utils import isostr_to_datetime, datetime_to_isostr, isostr_to_epoch
+    from reminder_repository import CachedReminderRepository, DynamoDBReminderRepository, ReminderNotFound, finished_updates
+    from retry_policy import policy_from_params
+    from rate_limiter import RateLimiter, SendDeferred
+    from instrumentation import instrumented
+    from serialization import json_response
+
 
 def validate_field(data,fieldName):
     if fieldName not in data:
@@ -32,26 +34,16 @@ def validate_field(data,fieldName):
 
 def validate_notify_date_time(data):
     current_ts = datetime.utcnow()
-    logging.info("Current ts:",current_ts)
-    print("Current ts:",current_ts)
     date_ts = isostr_to_datetime(data['notify_date_time'])
-    logging.info("Reminder ts:",date_ts)
-    print("Reminder ts:",date_ts)
+    logging.debug("Current ts: %s Reminder ts: %s", current_ts, date_ts)
     if current_ts > date_ts:
         logging.error("Validation Failed: Reminder in the past")
         raise Exception("Reminder {date_ts} in the past".format(date_ts=date_ts))
 
     diff = (date_ts - current_ts)
-    print("diff ts:",diff.seconds)
-
-    delay_params_list = ssm.get_parameters_by_path(Path=param_path,Recursive=False)['Parameters']
 
-    logging.debug(delay_params_list)
-
-    delay_params_dict = {param['Name'] : param for param in delay_params_list}
-    
-    min_delay_param = int(delay_params_dict[param_path+"/min_delay_param"]['Value'])
-    max_delay_param = int(delay_params_dict[param_path+"/max_delay_param"]['Value'])
+    min_delay_param = config.get_int("min_delay_param")
+    max_delay_param = config.get_int("max_delay_param")
 
     delay_seconds = int(diff.seconds)
     if (min_delay_param >  delay_seconds)  or (delay_seconds > max_delay_param):
@@ -61,121 +53,361 @@ def validate_notify_date_time(data):
 
 
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-ssm = boto3.client('ssm', region_name="us-east-1")
-param_path= '/{app_name}/{stage}'.format(app_name=os.environ['APP_NAME'],stage=os.environ['STAGE'])
+#Clients are created on first use - see aws_clients
+dynamodb = aws_clients.lazy_resource('dynamodb', region_name='us-east-1')
+ssm = aws_clients.lazy_client('ssm', region_name="us-east-1")
+param_path= app_param_path()
+config = ConfigProvider(ssm, param_path)
 #SNS Client for SMS
-sns = boto3.client('sns')
+sns = aws_clients.lazy_client('sns')
 #SES Client for Emails
-ses = boto3.client('ses')
+ses = aws_clients.lazy_client('ses')
 CHARSET = "UTF-8"
 
-table = dynamodb.Table('{stack_name}-RemindersTable'.format(stack_name=os.environ['STACK_NAME']))
+#Send rates per warm container - see rate_limiter
+#SES uses the account's MaxSendRate from GetSendQuota unless SES_MAX_SEND_RATE is set
+SES_MAX_SEND_RATE = os.environ.get('SES_MAX_SEND_RATE', '')
+DEFAULT_SES_SEND_RATE = 14
+SNS_MAX_SEND_RATE = float(os.environ.get('SNS_MAX_SEND_RATE', '20'))
+#Longest a send waits for the limiter before the reminder is rescheduled instead
+SEND_MAX_WAIT_SECONDS = float(os.environ.get('SEND_MAX_WAIT_SECONDS', '0.5'))
+
+def ses_send_rate():
+    if SES_MAX_SEND_RATE:
+        return float(SES_MAX_SEND_RATE)
+    try:
+        return float(ses.get_send_quota()['MaxSendRate'])
+    except ClientError as e:
+        logging.error("Couldn't read the SES send quota: " + e.response['Error']['Message'])
+        return DEFAULT_SES_SEND_RATE
+
+ses_limiter = RateLimiter('ses', ses_send_rate, SEND_MAX_WAIT_SECONDS)
+sns_limiter = RateLimiter('sns', SNS_MAX_SEND_RATE, SEND_MAX_WAIT_SECONDS)
+
+#Batch execution limits
+EXECUTE_BATCH_CONCURRENCY = int(os.environ.get('EXECUTE_BATCH_CONCURRENCY', '10'))
+#Digest mode - reminders of a batch for the same user and notify_by target are sent as one message
+DIGEST_MODE = os.environ.get('DIGEST_MODE', 'false').lower() == 'true'
+#Reminders of the batch due up to this many seconds later are sent with the digest instead of on their own
+DIGEST_WINDOW_SECONDS = int(os.environ.get('DIGEST_WINDOW_SECONDS', '300'))
+#SES template for the emails of a batch, sent with SendBulkTemplatedEmail - when empty every email is sent on its own
+#The template is rendered with {"subject": ..., "remind_msg": ...} for each destination
+SES_TEMPLATE = os.environ.get('SES_TEMPLATE', '')
+#Destinations SES accepts in one SendBulkTemplatedEmail call
+BULK_EMAIL_CHUNK = 50
+
+table = aws_clients.lazy_table('{stack_name}-RemindersTable'.format(stack_name=os.environ['STACK_NAME']), region_name='us-east-1')
+#Reminders read again within the cache TTL (e.g. after a deferred send) are served from the warm container
+reminders = CachedReminderRepository(DynamoDBReminderRepository(table, dynamodb))
 
 # Gets triggered by step function
 # Check if reminder is still in pending state and the execution date is in the past
 # Check mode email or sms and send out email and call appropriate method
-# retry_count +=1
-# Create event to check if reminder is in acknowledged in 15 mins else mark as pending self again
-# if retry_count >= {MAX_RETRIES} mark the reminder as unacknowledged in dynamoDB
+# retry_count +=1 in the same write that records the send
+# Return the time to check whether the reminder was acknowledged - set by the retry policy (see retry_policy)
+# if retry_count > {MAX_RETRIES} mark the reminder as unacknowledged in dynamoDB
 # NOT USING CLOUD WATCH EVENTS AS 
+@instrumented
 def execute_reminder(event, context):
     #data = json.loads(event['body'],strict=False)
     data = event
-    logging.info("Event: "+str(event))
-    print("Event:>> "+str(event))
+    logging.debug("Event: %s", event)
     validate_field(data,'reminder_id')
-    timestamp = int(time.time() * 1000)
-    #fetch the reminder
+    logging.info("Executing reminder %s", data['reminder_id'])
+    #fetch the reminder - a failed read is raised so the state machine retries the task
+    item, cached = reminders.lookup(data['reminder_id'])
+    #A cached reminder about to be sent is read again strongly consistent - it may have been acknowledged since
+    if cached and item is not None and item['state'] == 'Pending' and due_at(item) <= time.time():
+        item = reminders.get(data['reminder_id'], item['user_id'], consistent=True)
+    if item is None:
+        raise ReminderNotFound(data['reminder_id'])
+    logging.debug("GetItem succeeded: %s", item)
+
+    return process_reminder(data['reminder_id'], item)
+
+# Execute many reminders in one invocation
+# event - {"reminders": [{"reminder_id": ..., "user_id": ...}, ...]} keys are loaded with BatchGetItem
+#         in DIGEST_MODE a key can carry the reminder's "wake_at" - it is not sent on its own before then
+#         bare reminder id strings are also accepted and looked up one by one like execute_reminder
+# Notifications are sent through a bounded thread pool, each reminder is handled exactly as execute_reminder would
+# In DIGEST_MODE or with an SES_TEMPLATE reminders are grouped before sending - see execute_grouped
+# Returns {"results": [...]} with one execute_reminder style result per reminder plus its reminder_id
+@instrumented
+def execute_reminders_batch(event, context):
+    keys = [key for key in event['reminders'] if isinstance(key, dict)]
+    ids = [key for key in event['reminders'] if not isinstance(key, dict)]
+    items = reminders.batch_get(keys)
+    for reminder_id in ids:
+        item = reminders.get(reminder_id)
+        if item is not None:
+            items[reminder_id] = item
+
+    def run(reminder_id):
+        if reminder_id not in items:
+            return {'reminder_id': reminder_id, 'to_execute': 'false', 'error': 'Reminder not found'}
+        try:
+            result = process_reminder(reminder_id, items[reminder_id])
+        except ClientError as e:
+            logging.error(e.response['Error']['Message'])
+            #Leave the reminder to be retried at its current time
+            return {'reminder_id': reminder_id, 'to_execute': 'true',
+                    'notify_date_time': items[reminder_id]['notify_date_time'], 'error': e.response['Error']['Message']}
+        return dict(result, reminder_id=reminder_id)
+
+    reminder_ids = [key['reminder_id'] if isinstance(key, dict) else key for key in event['reminders']]
+    if not reminder_ids:
+        return {'results': []}
+    if DIGEST_MODE or SES_TEMPLATE:
+        wake_ats = {key['reminder_id']: key['wake_at'] for key in keys if 'wake_at' in key}
+        return {'results': execute_grouped(reminder_ids, items, wake_ats)}
+    with ThreadPoolExecutor(max_workers=min(EXECUTE_BATCH_CONCURRENCY, len(reminder_ids))) as executor:
+        return {'results': list(executor.map(run, reminder_ids))}
+
+# Groups the reminders of a batch in front of the send functions
+# In DIGEST_MODE reminders due now are grouped by user_id and notify_by target, and a pending reminder of the batch
+# due within DIGEST_WINDOW_SECONDS joins its target's group early - otherwise every due reminder is its own group
+# Each group is sent as one message. With an SES_TEMPLATE the email messages sharing a from_address go out in
+# SendBulkTemplatedEmail calls of up to BULK_EMAIL_CHUNK destinations, with the status of each destination mapped
+# back onto its group. If the template is missing they fall back to one SendEmail each
+# Every reminder of a sent group has its send recorded as if sent on its own - the results give the caller each
+# reminder's next check, reminders that failed to send keep their current time to be retried
+# wake_ats - {reminder_id: wake_at} for reminders waiting on a retry check, they count as due at wake_at
+def execute_grouped(reminder_ids, items, wake_ats=None):
+    results = {}
+    groups = OrderedDict()
+    early = {}
+    group_key = digest_key if DIGEST_MODE else reminder_group_key
+    now = datetime.utcnow()
+    horizon = now + timedelta(seconds=DIGEST_WINDOW_SECONDS)
+
+    def check(reminder_id):
+        if reminder_id not in items:
+            return {'to_execute': 'false', 'error': 'Reminder not found'}
+        result = check_reminder(reminder_id, items[reminder_id])
+        wake_at = (wake_ats or {}).get(reminder_id)
+        if result is None and wake_at is not None and isostr_to_datetime(wake_at) > now:
+            return {'to_execute': 'true', 'reminder_id': reminder_id, 'notify_date_time': wake_at}
+        return result
+
+    def failed(group, error):
+        #Leave the reminders to be retried at their current time
+        return [{'reminder_id': item['reminder_id'], 'to_execute': 'true',
+                 'notify_date_time': item['notify_date_time'], 'error': error} for item in group]
+
+    def recorded(group):
+        try:
+            return [dict(record_send(item), reminder_id=item['reminder_id']) for item in group]
+        except ClientError as e:
+            logging.error(e.response['Error']['Message'])
+            return failed(group, e.response['Error']['Message'])
+
+    def send(group):
+        try:
+            send_digest(group)
+        except SendDeferred as e:
+            return [deferred(item, e) for item in group]
+        except ClientError as e:
+            logging.error(e.response['Error']['Message'])
+            return failed(group, e.response['Error']['Message'])
+        return recorded(group)
+
+    def send_bulk(chunk):
+        try:
+            errors = send_bulk_email(chunk)
+        except SendDeferred as e:
+            return [deferred(item, e) for group in chunk for item in group]
+        except ClientError as e:
+            logging.error(e.response['Error']['Message'])
+            if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                return [result for group in chunk for result in failed(group, e.response['Error']['Message'])]
+            return [result for group in chunk for result in send(group)]
+        sent = []
+        for group, error in zip(chunk, errors):
+            sent.extend(failed(group, error) if error else recorded(group))
+        return sent
+
+    with ThreadPoolExecutor(max_workers=min(EXECUTE_BATCH_CONCURRENCY, len(reminder_ids))) as executor:
+        for reminder_id, result in zip(reminder_ids, executor.map(check, reminder_ids)):
+            if result is None:
+                groups.setdefault(group_key(items[reminder_id]), []).append(items[reminder_id])
+                continue
+            results[reminder_id] = dict(result, reminder_id=reminder_id)
+            #Waiting for its notify_date_time - only a first send is pulled forward, a retry waits for its own check
+            if DIGEST_MODE and result['to_execute'] == 'true' and not_yet_sent(items[reminder_id]) \
+                    and isostr_to_datetime(result['notify_date_time']) <= horizon:
+                early.setdefault(digest_key(items[reminder_id]), []).append(items[reminder_id])
+        for key, group in groups.items():
+            group.extend(early.get(key, []))
+
+        tasks = []
+        by_source = OrderedDict()
+        for group in groups.values():
+            if SES_TEMPLATE and group[0]['notify_by']['type'] != 'SMS':
+                by_source.setdefault(group[0]['notify_by']['from_address'], []).append(group)
+            else:
+                tasks.append((send, group))
+        for source_groups in by_source.values():
+            for start in range(0, len(source_groups), BULK_EMAIL_CHUNK):
+                tasks.append((send_bulk, source_groups[start:start + BULK_EMAIL_CHUNK]))
+
+        for sent in executor.map(lambda task: task[0](task[1]), tasks):
+            for result in sent:
+                results[result['reminder_id']] = result
+    return [results[reminder_id] for reminder_id in reminder_ids]
+
+def not_yet_sent(item):
+    return int(item.get('retry_count', 0)) == 0 and 'last_sent_at' not in item
+
+# Reminders sharing a digest key can be sent as one message
+def digest_key(item):
+    notify_by = item['notify_by']
+    if notify_by['type'] == 'SMS':
+        return (item['user_id'], 'SMS', notify_by['phone_number'])
+    return (item['user_id'], notify_by['type'], notify_by['to_address'], notify_by['from_address'])
+
+def reminder_group_key(item):
+    return (item['reminder_id'],)
+
+# The reminder to send for a group of reminders with the same digest key, oldest first, and its subject
+def digest_message(group):
+    if len(group) == 1:
+        return group[0], None
+    group = sorted(group, key=due_at)
+    message = '\n'.join('- ' + item['remind_msg'] for item in group)
+    return dict(group[0], remind_msg=message), 'You have {count} reminders'.format(count=len(group))
+
+def send_digest(group):
+    item, subject = digest_message(group)
+    return send_notification(item, subject)
+
+# One SendBulkTemplatedEmail call for email groups sharing a from_address
+# Returns the error of each group's destination, None when it was sent
+def send_bulk_email(chunk):
+    destinations = []
+    for group in chunk:
+        item, subject = digest_message(group)
+        destinations.append({
+            'Destination': {'ToAddresses': [item['notify_by']['to_address']]},
+            'ReplacementTemplateData': json.dumps({'subject': subject or item['remind_msg'], 'remind_msg': item['remind_msg']})
+        })
+    #Every destination counts against the SES send rate
+    response = ses_limiter.call(lambda: ses.send_bulk_templated_email(
+        Source=chunk[0][0]['notify_by']['from_address'],
+        Template=SES_TEMPLATE,
+        DefaultTemplateData=json.dumps({'subject': '', 'remind_msg': ''}),
+        Destinations=destinations
+    ), tokens=len(destinations))
+    logging.info(response)
+    return [None if status['Status'] == 'Success' else status.get('Error') or status['Status'] for status in response['Status']]
+
+# Decide what to do with a fetched reminder - shared by execute_reminder and execute_reminders_batch
+def process_reminder(reminder_id, item):
+    result = check_reminder(reminder_id, item)
+    if result is not None:
+        return result
+
+    #else send notification based on notify_by and return (dont update state)
     try:
-        response = table.query(
-        KeyConditionExpression=Key('reminder_id').eq(data['reminder_id'])
-    )
-    except ClientError as e:
-        print(e.response['Error']['Message'])
-        logging.info(e.response['Error']['Message'])
-    else:
-        item = response['Items'][0]
-        logging.info("GetItem succeeded:")
-        print("GetItem succeeded:")
-        logging.info(item)
-
-        #if state of reminder is not pending return to_execute as false
-        if item['state'] != 'Pending':
-            logging.info('Reminder:{reminderId} is not pending'.format(reminderId=data['reminder_id']))
-            print('Reminder:{reminderId} is not pending'.format(reminderId=data['reminder_id']))
-            return {
-                'to_execute':'false'
-            }
-
-        #else if retry_count > max_retry_count then mark state as Unacknowledged and return to_execute as false
-        app_params_list = ssm.get_parameters_by_path(Path=param_path,Recursive=False)['Parameters']
-        logging.debug(app_params_list)
-        delay_params_dict = {param['Name'] : param for param in app_params_list}
-    
-        max_retry_count = int(delay_params_dict[param_path+"/max_retry_count"]['Value'])
-        print(max_retry_count)
-        if item['retry_count'] > max_retry_count:
-            logging.info('Reminder:{reminderId} has exceeded max retry counts'.format(reminderId=data['reminder_id']))
-            print('Reminder:{reminderId} has exceeded max retry counts'.format(reminderId=data['reminder_id']))
-            #mark state as Unacknowledged
-            result = table.update_item(
-            Key={
-                'reminder_id': data['reminder_id']
-            },
-            UpdateExpression="SET state= :state, updated_at= :updated_at",
-            ExpressionAttributeValues={
-                    ':state' : 'Unacknowledged',
-                    ':updated_at':timestamp
-                }
-            )
-
-            # return to_execute as false
-            return {
-                'to_execute':'false'
-            }
-
-        #else if notify_date_time is in the future return with to_execute as true + reminder_id + notify_date_time
-        date_ts = isostr_to_datetime(item['notify_date_time'])
-        if  date_ts > datetime.utcnow():
-            logging.info('Reminder:{reminderId} is scheduled for the future - skipping`  '.format(reminderId=data['reminder_id']))
-            return {
-                'to_execute':'true',
-                'reminder_id':item['reminder_id'],
-                'notify_date_time':item['notify_date_time']
-            }
-
-        #else send notification based on notify_by and return (dont update state)
-        if item['notify_by']['type'] == 'SMS' :
-            send_sms(item)
-        else:
-            send_email(item)
-        
-        #set a check notification status point 5 mins in the future for acknowledgment
-        #FIXME remove hard coding
-        time_In_Future_By_5_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 5))
+        send_notification(item)
+    except SendDeferred as e:
+        return deferred(item, e)
+    return record_send(item)
+
+# Sending was rate limited - check again once the channel has capacity, the send is not counted
+def deferred(item, e):
+    logging.info('Reminder:{reminderId} deferred - {reason}'.format(reminderId=item['reminder_id'], reason=e))
+    return {
+        'to_execute':'true',
+        'reminder_id':item['reminder_id'],
+        'notify_date_time':datetime_to_isostr(datetime.utcnow() + timedelta(seconds=e.delay_seconds))
+    }
+
+# The execute_reminder result for a reminder that must not be sent now, or None when it is due
+def check_reminder(reminder_id, item):
+    timestamp = int(time.time() * 1000)
+
+    #if state of reminder is not pending return to_execute as false
+    if item['state'] != 'Pending':
+        logging.info('Reminder:{reminderId} is not pending'.format(reminderId=reminder_id))
+        return {
+            'to_execute':'false'
+        }
 
+    #else if retry_count > max_retry_count then mark state as Unacknowledged and return to_execute as false
+    max_retry_count = config.get_int("max_retry_count")
+    logging.debug("max_retry_count: %s", max_retry_count)
+    if item['retry_count'] > max_retry_count:
+        logging.info('Reminder:{reminderId} has exceeded max retry counts'.format(reminderId=reminder_id))
+        #mark state as Unacknowledged - it expires FINISHED_REMINDER_TTL_SECONDS later
+        updates = {
+            'state': 'Unacknowledged',
+            'updated_at': timestamp
+        }
+        updates.update(finished_updates(timestamp // 1000))
+        reminders.update({'reminder_id': reminder_id, 'user_id': item['user_id']}, updates)
+
+        # return to_execute as false
+        return {
+            'to_execute':'false'
+        }
+
+    #else if notify_date_time is in the future return with to_execute as true + reminder_id + notify_date_time
+    if due_at(item) > time.time():
+        logging.info('Reminder:{reminderId} is scheduled for the future - skipping`  '.format(reminderId=reminder_id))
         return {
-                'to_execute':'true',
-                'reminder_id':item['reminder_id'],
-                'notify_date_time':time_In_Future_By_5_mins
-            }
+            'to_execute':'true',
+            'reminder_id':item['reminder_id'],
+            'notify_date_time':item['notify_date_time']
+        }
+    return None
+
+# Epoch seconds the reminder is due at - reminders written before due_at was added only have notify_date_time
+def due_at(item):
+    if 'due_at' in item:
+        return item['due_at']
+    return isostr_to_epoch(item['notify_date_time'])
+
+def send_notification(item, subject=None):
+    if item['notify_by']['type'] == 'SMS' :
+        return send_sms(item)
+    return send_email(item, subject)
+
+# Counts the send and returns the execute_reminder result with the next check for an acknowledgment
+def record_send(item):
+    timestamp = int(time.time() * 1000)
+    #count the send atomically - concurrent executions of the reminder can not lose an increment
+    #a reminder deleted since it was read is not written back with only these attributes, there is nothing to check
+    try:
+        sent = reminders.update({'reminder_id': item['reminder_id'], 'user_id': item['user_id']}, {
+            'last_sent_at': timestamp,
+            'updated_at': timestamp
+        }, increments={'retry_count': 1}, must_exist=True, return_values='UPDATED_NEW')
+    except ReminderNotFound:
+        logging.info('Reminder:{reminderId} was deleted while sending'.format(reminderId=item['reminder_id']))
+        return {'reminder_id': item['reminder_id'], 'to_execute': 'false', 'error': 'Reminder not found'}
+
+    #check for the acknowledgment when the retry policy says
+    policy = policy_from_params(config.params())
+    next_check = datetime.utcnow() + timedelta(seconds=policy.delay_seconds(int(sent['retry_count'])))
+
+    return {
+            'to_execute':'true',
+            'reminder_id':item['reminder_id'],
+            'notify_date_time':datetime_to_isostr(next_check)
+        }
 
 def send_sms(item):
     #Send SMS
-    response = sns.publish(PhoneNumber = item['notify_by']['phone_number'], Message=item['remind_msg'])
+    response = sns_limiter.call(lambda: sns.publish(PhoneNumber = item['notify_by']['phone_number'], Message=item['remind_msg']))
     logging.info(response)
-    return {
-        'statusCode': 200,
-        'body': json.dumps(response)
-    }
+    return json_response(response)
 
 
-def send_email(item):
+def send_email(item, subject=None):
     #Send Email
     
     #Provide the contents of the email.
-    response = ses.send_email(
+    response = ses_limiter.call(lambda: ses.send_email(
         Destination={
             'ToAddresses': [
                 item['notify_by']['to_address'],
@@ -190,13 +422,10 @@ def send_email(item):
             },
             'Subject': {
                 'Charset': CHARSET,
-                'Data': item['remind_msg'],
+                'Data': subject or item['remind_msg'],
             },
         },
         Source=item['notify_by']['from_address']
-    )
+    ))
     logging.info(response)
-    return {
-        'statusCode': 200,
-        'body': json.dumps(response)
-    }
\ No newline at end of file
+    return json_response(response)
\ No newline at end of file
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# How long a key is remembered once its request completed - DynamoDB TTL deletes the record some time after expires_at
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+# How long a claim holds the key before a retry can take it over - at least the function timeout, so a request that
+# timed out or failed to store its response only blocks its key for that long
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '30'))
+# Completed responses kept in a warm container so repeats skip DynamoDB
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1000'))
+# Attempts at storing a response before giving up on it - the request already ran so it is returned either way
+IDEMPOTENCY_COMPLETE_ATTEMPTS = int(os.environ.get('IDEMPOTENCY_COMPLETE_ATTEMPTS', '3'))
+
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_COMPLETED = 'completed'
+
+# The key was already used for a different request body
+class IdempotencyKeyMismatch(Exception):
+    pass
+
+# Another request with the key has claimed it and not finished yet
+class IdempotencyInProgress(Exception):
+    pass
+
+def idempotency_key(event):
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == IDEMPOTENCY_HEADER.lower():
+            return value
+    return None
+
+def request_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Runs a request at most once per key
+# The first request claims the key with a conditional put of an in_progress record, runs and stores its
+# response on the record. Repeats get the stored response back - from the in-container LRU when this container
+# served it, otherwise from the record. A request that fails releases the key so the client can retry it
+# The in_progress record expires after lease_seconds and the completed one after ttl_seconds
+class IdempotencyStore(object):
+    def __init__(self, table, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, cache_size=IDEMPOTENCY_CACHE_SIZE, clock=time.time,
+            lease_seconds=IDEMPOTENCY_LEASE_SECONDS, complete_attempts=IDEMPOTENCY_COMPLETE_ATTEMPTS):
+        self.table = table
+        self.complete_attempts = complete_attempts
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.cache_size = cache_size
+        self.clock = clock
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # run - called without arguments, returns the JSON serializable response
+    def run(self, key, request_hash, run):
+        cached = self._cached(key)
+        if cached is not None:
+            return self._replay(key, request_hash, cached)
+        existing = self._claim(key, request_hash)
+        if existing is not None:
+            if existing['status'] != STATUS_COMPLETED:
+                raise IdempotencyInProgress(key)
+            return self._replay(key, request_hash, self._remember(key, existing['request_hash'], json.loads(existing['response']),
+                int(existing['expires_at'])))
+        try:
+            response = run()
+        except Exception:
+            self._release(key)
+            raise
+        expires_at = int(self.clock()) + self.ttl_seconds
+        self._complete(key, response, expires_at)
+        self._remember(key, request_hash, response, expires_at)
+        return response
+
+    # Stores the response on the claimed record
+    # The request already ran, so failing here would turn its response into an error the client retries - the
+    # failure is logged instead and the key stays claimed until its lease ends, repeats in this container are
+    # still served from the cache
+    def _complete(self, key, response, expires_at):
+        for attempt in range(1, self.complete_attempts + 1):
+            try:
+                self.table.update_item(
+                    Key={'idempotency_key': key},
+                    UpdateExpression="SET #status= :status, response= :response, expires_at= :expires_at",
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={':status': STATUS_COMPLETED, ':response': json.dumps(response), ':expires_at': expires_at}
+                )
+                return
+            except (ClientError, BotoCoreError) as e:
+                logger.warning("Storing the response for idempotency key %s failed on attempt %d: %s", key, attempt, e)
+        logger.error("Could not store the response for idempotency key %s", key)
+
+    def _replay(self, key, request_hash, cached):
+        if cached[0] != request_hash:
+            raise IdempotencyKeyMismatch(key)
+        logger.info("Replaying response for idempotency key %s", key)
+        return cached[1]
+
+    # None when the key was claimed, else the record that already holds it
+    def _claim(self, key, request_hash):
+        now = int(self.clock())
+        try:
+            self.table.put_item(
+                Item={
+                    'idempotency_key': key,
+                    'status': STATUS_IN_PROGRESS,
+                    'request_hash': request_hash,
+                    'expires_at': now + self.lease_seconds
+                },
+                #TTL deletion lags so an expired record - or the lease of a request that never completed - can be taken over
+                ConditionExpression=Attr('idempotency_key').not_exists() | Attr('expires_at').lt(now)
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        existing = self.table.get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item')
+        if existing is None:
+            #Released between the put and the get
+            raise IdempotencyInProgress(key)
+        return existing
+
+    def _release(self, key):
+        try:
+            self.table.delete_item(Key={'idempotency_key': key})
+        except ClientError as e:
+            logger.error(e.response['Error']['Message'])
+
+    def _cached(self, key):
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                return None
+            if cached[2] < self.clock():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return cached
+
+    def _remember(self, key, request_hash, response, expires_at):
+        entry = (request_hash, response, expires_at)
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Per invocation AWS call metrics written as one CloudWatch Embedded Metric Format (EMF) log line
+# botocore hooks time every call made through the aws_clients session from before-parameter-build (the start of
+# the client call, also emitted when a Stubber answers it) to after-call, and needs-retry counts throttled attempts
+# Handlers wrapped with @instrumented add their duration and whether the container was cold, then flush
+# everything when they return - latencies over EMF_MAX_VALUES per operation continue on further lines
+# Metric names are <service>.<Operation>.<Metric> e.g. dynamodb.Query.Latency so one line holds every call
+# Application counters added with count() (e.g. ReminderCache.Hits) are flushed on the same line
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', os.environ.get('APP_NAME', 'ReminderApp'))
+
+THROTTLING_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'RequestThrottled', 'LimitExceededException',
+    'SlowDown', 'BandwidthLimitExceeded', 'PriorRequestNotComplete'
+])
+
+_START = 'instrumentation_start'
+
+_lock = threading.Lock()
+_calls = {}
+_counts = {}
+_invocations = 0
+_active = 0
+
+class CallStats(object):
+    __slots__ = ('latencies', 'retries', 'throttles', 'errors')
+
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+
+def _stats(event_name):
+    parts = event_name.split('.')
+    key = (parts[1], parts[2])
+    stats = _calls.get(key)
+    if stats is None:
+        stats = _calls[key] = CallStats()
+    return stats
+
+# Adds to a counter of the current invocation
+def count(name, value=1):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counts[name] = _counts.get(name, 0) + value
+
+def before_parameter_build(context=None, **kwargs):
+    if context is not None:
+        context[_START] = time.perf_counter()
+
+def after_call(event_name, context=None, parsed=None, **kwargs):
+    start = (context or {}).get(_START)
+    metadata = (parsed or {}).get('ResponseMetadata', {})
+    with _lock:
+        stats = _stats(event_name)
+        if start is not None:
+            stats.latencies.append((time.perf_counter() - start) * 1000)
+        stats.retries += metadata.get('RetryAttempts', 0)
+        if parsed and 'Error' in parsed:
+            stats.errors += 1
+
+def after_call_error(event_name, context=None, **kwargs):
+    start = (context or {}).get(_START)
+    with _lock:
+        stats = _stats(event_name)
+        if start is not None:
+            stats.latencies.append((time.perf_counter() - start) * 1000)
+        stats.errors += 1
+
+def needs_retry(event_name, response=None, **kwargs):
+    if response is None:
+        return None
+    code = response[1].get('Error', {}).get('Code')
+    if code in THROTTLING_CODES:
+        with _lock:
+            _stats(event_name).throttles += 1
+    #Never changes botocore's retry decision
+    return None
+
+# Hook into every client created from a boto3 session - called by aws_clients when it creates its session
+def register(events):
+    if not METRICS_ENABLED:
+        return
+    events.register('before-parameter-build', before_parameter_build, unique_id='instrumentation-before-parameter-build')
+    events.register('after-call', after_call, unique_id='instrumentation-after-call')
+    events.register('after-call-error', after_call_error, unique_id='instrumentation-after-call-error')
+    events.register('needs-retry', needs_retry, unique_id='instrumentation-needs-retry')
+
+# EMF takes at most this many values for one metric in a document
+EMF_MAX_VALUES = 100
+
+def _latencies(stats, start):
+    return [round(latency, 3) for latency in stats.latencies[start:start + EMF_MAX_VALUES]]
+
+def _emf(document, metrics, timestamp_ms):
+    document['_aws'] = {
+        'Timestamp': timestamp_ms,
+        'CloudWatchMetrics': [{'Namespace': METRICS_NAMESPACE, 'Dimensions': [['Handler']], 'Metrics': metrics}]
+    }
+    return document
+
+# The EMF documents for one invocation - one, plus one per further EMF_MAX_VALUES latencies of the operation called
+# the most (a sweep or a batch) holding only the Latency values that did not fit in the previous ones
+def metrics_documents(handler_name, duration_ms, cold_start, calls, timestamp_ms, counts=None):
+    metrics = [{'Name': 'Duration', 'Unit': 'Milliseconds'}, {'Name': 'ColdStart', 'Unit': 'Count'}]
+    document = {'Handler': handler_name, 'Duration': round(duration_ms, 3), 'ColdStart': 1 if cold_start else 0}
+    for (service, operation), stats in sorted(calls.items()):
+        prefix = '{service}.{operation}.'.format(service=service, operation=operation)
+        document[prefix + 'Latency'] = _latencies(stats, 0)
+        document[prefix + 'Calls'] = len(stats.latencies)
+        document[prefix + 'Retries'] = stats.retries
+        document[prefix + 'Throttles'] = stats.throttles
+        document[prefix + 'Errors'] = stats.errors
+        metrics.append({'Name': prefix + 'Latency', 'Unit': 'Milliseconds'})
+        metrics.extend({'Name': prefix + name, 'Unit': 'Count'} for name in ('Calls', 'Retries', 'Throttles', 'Errors'))
+    for name, value in sorted((counts or {}).items()):
+        document[name] = value
+        metrics.append({'Name': name, 'Unit': 'Count'})
+    documents = [_emf(document, metrics, timestamp_ms)]
+
+    most = max([len(stats.latencies) for stats in calls.values()] or [0])
+    for start in range(EMF_MAX_VALUES, most, EMF_MAX_VALUES):
+        document = {'Handler': handler_name}
+        metrics = []
+        for (service, operation), stats in sorted(calls.items()):
+            if len(stats.latencies) > start:
+                name = '{service}.{operation}.Latency'.format(service=service, operation=operation)
+                document[name] = _latencies(stats, start)
+                metrics.append({'Name': name, 'Unit': 'Milliseconds'})
+        documents.append(_emf(document, metrics, timestamp_ms))
+    return documents
+
+# Wraps a Lambda entry point to flush its metrics when it returns or raises
+# Entry points called from inside another one (e.g. execute_reminder from the sweep) add to the outer invocation
+def instrumented(handler):
+    if not METRICS_ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _invocations, _active
+        with _lock:
+            outermost = _active == 0
+            _active += 1
+            if outermost:
+                _calls.clear()
+                _counts.clear()
+                cold_start = _invocations == 0
+                _invocations += 1
+        start = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            with _lock:
+                _active -= 1
+                calls = dict(_calls) if outermost else None
+                counts = dict(_counts) if outermost else None
+                if outermost:
+                    _calls.clear()
+                    _counts.clear()
+            if outermost:
+                duration_ms = (time.perf_counter() - start) * 1000
+                documents = metrics_documents(handler.__name__, duration_ms, cold_start, calls, int(time.time() * 1000), counts)
+                sys.stdout.write(''.join(json.dumps(document, separators=(',', ':')) + '\n' for document in documents))
+    return wrapper
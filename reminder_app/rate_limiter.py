@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from botocore.exceptions import ClientError
+try:
+    from reminder_app.instrumentation import THROTTLING_CODES
+except ImportError:
+    from instrumentation import THROTTLING_CODES
+
+logger = logging.getLogger(__name__)
+
+# Client side rate limiting of notification sends, one limiter per channel (ses, sns) in a warm container
+# A token bucket refilled at the channel's send rate spaces sends out. A throttle from the service halves the
+# rate and every send that goes through adds back 1/rate per second - AIMD, so after a throttle the rate
+# climbs by about one send per second each second until the next throttle or the configured maximum
+# Sends that would have to wait longer than max_wait_seconds are not made - SendDeferred tells the caller
+# when to try again so the reminder is rescheduled instead of failing
+DEFAULT_MAX_WAIT_SECONDS = 0.5
+# Deferral after a throttle, doubled for every throttle in a row
+THROTTLE_DEFER_SECONDS = 2
+THROTTLE_DEFER_MAX_SECONDS = 60
+# Fraction of the rate kept after a throttle, and the floor it never goes under
+DECREASE_FACTOR = 0.5
+MIN_RATE = 0.1
+
+# The send was not made - retry it after delay_seconds
+class SendDeferred(Exception):
+    def __init__(self, channel, delay_seconds):
+        super(SendDeferred, self).__init__('{channel} send deferred for {delay:.2f}s'.format(channel=channel, delay=delay_seconds))
+        self.channel = channel
+        self.delay_seconds = delay_seconds
+
+class RateLimiter(object):
+    # max_rate - sends per second, or a function returning it called on first use (e.g. to read the SES quota)
+    def __init__(self, channel, max_rate, max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.channel = channel
+        self._max_rate = max_rate
+        self.max_wait_seconds = max_wait_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = None
+        self.tokens = 0.0
+        self.throttles = 0
+        self._updated_at = None
+        self._lock = threading.Lock()
+
+    # Back to the full rate and a full bucket
+    def reset(self):
+        with self._lock:
+            self.rate = None
+            self.throttles = 0
+
+    @property
+    def max_rate(self):
+        if callable(self._max_rate):
+            self._max_rate = float(self._max_rate())
+        return self._max_rate
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate is None:
+            self.rate = self.max_rate
+            #Start with one second worth of sends
+            self.tokens = max(1.0, self.rate)
+        else:
+            #Holds at least one send when throttles have taken the rate under one per second
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    # Takes tokens for a send, waiting up to max_wait_seconds for them
+    # A send can take more tokens than the bucket holds (e.g. a bulk email) - the bucket goes negative and later
+    # sends wait until it has refilled. Raises SendDeferred when the wait would be longer
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= tokens
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if wait > self.max_wait_seconds:
+                raise SendDeferred(self.channel, wait)
+            self.sleep(wait)
+
+    def succeeded(self):
+        with self._lock:
+            self.throttles = 0
+            if self.rate is not None:
+                self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    # Returns how long to defer the send that was throttled
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.throttles += 1
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            #Let the service recover before anything else is sent
+            self.tokens = min(self.tokens, 0.0)
+            delay = min(THROTTLE_DEFER_MAX_SECONDS, THROTTLE_DEFER_SECONDS * 2 ** (self.throttles - 1))
+        logger.warning("%s throttled - send rate lowered to %.2f/s", self.channel, self.rate)
+        return delay
+
+    # Calls send once tokens are available - a throttled send raises SendDeferred, other errors are raised as is
+    def call(self, send, tokens=1):
+        self.acquire(tokens)
+        try:
+            response = send()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_CODES:
+                raise
+            raise SendDeferred(self.channel, self.throttled())
+        self.succeeded()
+        return response
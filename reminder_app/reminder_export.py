@@ -0,0 +1,86 @@
+import csv
+import io
+import os
+try:
+    from reminder_app.archive_store import S3_MIN_PART_BYTES
+    from reminder_app.serialization import dumps_bytes
+except ImportError:
+    from archive_store import S3_MIN_PART_BYTES
+    from serialization import dumps_bytes
+
+# Exports up to this size are returned in the response, larger ones are written to the export store
+# (API Gateway responses are limited to 6MB and can not be streamed)
+EXPORT_INLINE_MAX_BYTES = int(os.environ.get('EXPORT_INLINE_MAX_BYTES', str(1024 * 1024)))
+# Size of the parts a large export is uploaded in - never under S3_MIN_PART_BYTES
+EXPORT_PART_BYTES = max(S3_MIN_PART_BYTES, int(os.environ.get('EXPORT_PART_BYTES', str(S3_MIN_PART_BYTES))))
+
+# CSV columns, notify_by flattened - attributes a reminder does not have are left empty
+CSV_COLUMNS = ['reminder_id', 'user_id', 'state', 'notify_date_time', 'due_at', 'remind_msg', 'retry_count',
+    'notify_by.type', 'notify_by.phone_number', 'notify_by.to_address', 'notify_by.from_address', 'updated_at', 'last_sent_at']
+
+def ndjson_line(item):
+    return dumps_bytes(item) + b'\n'
+
+def csv_line(values):
+    line = io.StringIO()
+    csv.writer(line).writerow(values)
+    return line.getvalue().encode('utf-8')
+
+def csv_row(item):
+    values = []
+    for column in CSV_COLUMNS:
+        value = item
+        for name in column.split('.'):
+            value = value.get(name) if isinstance(value, dict) else None
+        values.append('' if value is None else str(value))
+    return csv_line(values)
+
+# format: (Content-Type, file extension, header, encoding of one reminder)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson', b'', ndjson_line),
+    'csv': ('text/csv', 'csv', csv_line(CSV_COLUMNS), csv_row)
+}
+
+# The export is over EXPORT_INLINE_MAX_BYTES and there is no store to write it to
+class ExportTooLarge(Exception):
+    pass
+
+# Collects an export in memory until it is over inline_max_bytes, then moves it to store.writer(key) and uploads
+# it in parts of part_bytes - memory stays under inline_max_bytes + part_bytes whatever the size of the export
+class ExportSpool(object):
+    def __init__(self, store, key, inline_max_bytes=EXPORT_INLINE_MAX_BYTES, part_bytes=EXPORT_PART_BYTES):
+        self.store = store
+        self.key = key
+        self.inline_max_bytes = inline_max_bytes
+        self.part_bytes = part_bytes
+        self.size = 0
+        self.writer = None
+        self._buffer = io.BytesIO()
+
+    def write(self, data):
+        self._buffer.write(data)
+        self.size += len(data)
+        if self.writer is None and self.size > self.inline_max_bytes:
+            if self.store is None:
+                raise ExportTooLarge(self.key)
+            self.writer = self.store.writer(self.key)
+        if self.writer is not None and self._buffer.tell() >= self.part_bytes:
+            self._flush()
+
+    def _flush(self):
+        self.writer.write(self._buffer.getvalue())
+        self._buffer = io.BytesIO()
+
+    # The whole export when it fits inline, else None once it has been stored under key
+    def close(self):
+        if self.writer is None:
+            return self._buffer.getvalue()
+        if self._buffer.tell():
+            self._flush()
+        self.writer.close()
+        return None
+
+    # Discards a stored export that could not be finished
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
@@ -0,0 +1,638 @@
+import copy
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+try:
+    from reminder_app import instrumentation
+    from reminder_app.scheduler import DUE_BUCKET_INDEX
+except ImportError:
+    import instrumentation
+    from scheduler import DUE_BUCKET_INDEX
+
+logger = logging.getLogger(__name__)
+
+USER_ID_INDEX = 'UserIdIndex'
+#Reminder keys of a user by the numeric due_at (epoch seconds of notify_date_time)
+USER_DUE_AT_INDEX = 'UserDueAtIndex'
+
+# States a reminder is never sent again in
+FINISHED_STATES = ('Acknowledged', 'Unacknowledged')
+# Seconds a finished reminder is kept before DynamoDB TTL deletes it (from its expires_at) - 0 keeps them
+FINISHED_REMINDER_TTL_SECONDS = int(os.environ.get('FINISHED_REMINDER_TTL_SECONDS', '2592000'))
+
+BATCH_WRITE_CHUNK = 25
+BATCH_GET_CHUNK = 100
+BATCH_MAX_ATTEMPTS = 5
+
+# Reminders cached per warm container by CachedReminderRepository - a size of 0 turns the cache off
+REMINDER_CACHE_SIZE = int(os.environ.get('REMINDER_CACHE_SIZE', '1000'))
+REMINDER_CACHE_TTL_SECONDS = float(os.environ.get('REMINDER_CACHE_TTL_SECONDS', '30'))
+
+# Attribute names that are DynamoDB reserved words and the placeholders used for them in expressions
+ATTRIBUTE_ALIASES = {'state': '#st'}
+
+# Raised when a write conditioned on the reminder existing finds no reminder
+class ReminderNotFound(Exception):
+    pass
+
+# Raised when a write conditioned on attribute values finds the reminder changed (or gone)
+class ReminderChanged(ReminderNotFound):
+    pass
+
+# Persistence operations on reminders
+# A key is {'reminder_id': ..., 'user_id': ...} - the table's hash and range key
+# Items and values are plain python values as returned by the boto3 DynamoDB resource (numbers are Decimal)
+class ReminderRepository(object):
+    # Reminder by id, or None. user_id is optional as reminder ids are unique on their own
+    # consistent - read the table strongly consistent
+    def get(self, reminder_id, user_id=None, consistent=False):
+        raise NotImplementedError
+
+    # (reminder or None, True when it was served from a cache instead of the table)
+    def lookup(self, reminder_id, user_id=None, consistent=False):
+        return self.get(reminder_id, user_id, consistent), False
+
+    def put(self, item):
+        raise NotImplementedError
+
+    # updates - {attribute: value} to SET, remove - attributes to REMOVE
+    # increments - {attribute: number} to ADD atomically, a missing attribute counts as 0
+    # must_exist - raise ReminderNotFound instead of creating the reminder when it is missing
+    # return_values - 'ALL_NEW' / 'ALL_OLD' / 'UPDATED_NEW' to get attributes back, otherwise None is returned
+    # conditions - {attribute: value} the reminder must still have, raise ReminderChanged otherwise
+    def update(self, key, updates=None, remove=None, must_exist=False, return_values=None, increments=None, conditions=None):
+        raise NotImplementedError
+
+    # Delete a reminder, return_values - 'ALL_OLD' to get the deleted reminder back
+    def delete(self, key, must_exist=False, return_values=None):
+        raise NotImplementedError
+
+    # One page of a user's reminder keys from UserIdIndex - returns (keys, last_evaluated_key or None)
+    # due_from / due_to - epoch seconds, only reminders with a due_at in the range (inclusive) from UserDueAtIndex
+    # in due_at order, their keys include due_at
+    def query_by_user(self, user_id, limit=None, exclusive_start_key=None, due_from=None, due_to=None):
+        raise NotImplementedError
+
+    # Yields the keys and wake_at of every reminder in a due bucket of DueBucketIndex
+    def query_due_bucket(self, bucket):
+        raise NotImplementedError
+
+    # Returns the set of reminder ids that could not be written
+    def batch_put(self, items):
+        raise NotImplementedError
+
+    # Returns {reminder_id: item} for the keys that exist
+    def batch_get(self, keys):
+        raise NotImplementedError
+
+    # Returns the set of reminder ids that could not be deleted
+    def batch_delete(self, keys):
+        raise NotImplementedError
+
+    # One page of segment (0 based) of a parallel scan of every reminder - returns (items, last_evaluated_key or None)
+    # attributes - names to return instead of whole reminders
+    # states / updated_before - only return reminders in one of the states / with an updated_at (ms) before it
+    # As with a DynamoDB filter, limit counts the reminders read before they are filtered
+    def scan(self, segment, total_segments, attributes=None, limit=None, exclusive_start_key=None, states=None, updated_before=None):
+        raise NotImplementedError
+
+def reminder_key(item):
+    return {'reminder_id': item['reminder_id'], 'user_id': item['user_id']}
+
+# Attributes setting the TTL of a reminder that finished at finished_at (epoch seconds) - none when they are kept
+def finished_updates(finished_at):
+    if FINISHED_REMINDER_TTL_SECONDS <= 0:
+        return {}
+    return {'expires_at': int(finished_at) + FINISHED_REMINDER_TTL_SECONDS}
+
+def update_expression(updates=None, remove=None, increments=None):
+    names = {}
+    parts = []
+    values = {}
+    if updates:
+        assignments = []
+        for name, value in updates.items():
+            alias = ATTRIBUTE_ALIASES.get(name)
+            if alias is not None:
+                names[alias] = name
+            assignments.append('{name}= :{placeholder}'.format(name=alias or name, placeholder=name))
+            values[':' + name] = value
+        parts.append('SET ' + ', '.join(assignments))
+    if remove:
+        removals = []
+        for name in remove:
+            alias = ATTRIBUTE_ALIASES.get(name)
+            if alias is not None:
+                names[alias] = name
+            removals.append(alias or name)
+        parts.append('REMOVE ' + ', '.join(removals))
+    if increments:
+        additions = []
+        for name, value in increments.items():
+            alias = ATTRIBUTE_ALIASES.get(name)
+            if alias is not None:
+                names[alias] = name
+            additions.append('{name} :{placeholder}'.format(name=alias or name, placeholder=name))
+            values[':' + name] = value
+        parts.append('ADD ' + ', '.join(additions))
+    return ' '.join(parts), values, names
+
+class DynamoDBReminderRepository(ReminderRepository):
+    # table and dynamodb - boto3 Table and DynamoDB resource, usually aws_clients proxies
+    def __init__(self, table, dynamodb, max_attempts=BATCH_MAX_ATTEMPTS):
+        self.table = table
+        self.dynamodb = dynamodb
+        self.max_attempts = max_attempts
+
+    def get(self, reminder_id, user_id=None, consistent=False):
+        kwargs = {'ConsistentRead': True} if consistent else {}
+        if user_id is not None:
+            return self.table.get_item(Key={'reminder_id': reminder_id, 'user_id': user_id}, **kwargs).get('Item')
+        response = self.table.query(
+            KeyConditionExpression=Key('reminder_id').eq(reminder_id),
+            **kwargs
+        )
+        return response['Items'][0] if response['Items'] else None
+
+    def put(self, item):
+        self.table.put_item(Item=item)
+
+    def update(self, key, updates=None, remove=None, must_exist=False, return_values=None, increments=None, conditions=None):
+        expression, values, names = update_expression(updates, remove, increments)
+        kwargs = {'Key': key, 'UpdateExpression': expression}
+        if values:
+            kwargs['ExpressionAttributeValues'] = values
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        return self._write(self.table.update_item, kwargs, must_exist, return_values, conditions)
+
+    def delete(self, key, must_exist=False, return_values=None):
+        return self._write(self.table.delete_item, {'Key': key}, must_exist, return_values)
+
+    def _write(self, operation, kwargs, must_exist, return_values, conditions=None):
+        condition = Attr('reminder_id').exists() if must_exist else None
+        for name, value in (conditions or {}).items():
+            condition = Attr(name).eq(value) if condition is None else condition & Attr(name).eq(value)
+        if condition is not None:
+            kwargs['ConditionExpression'] = condition
+        if return_values:
+            kwargs['ReturnValues'] = return_values
+        try:
+            response = operation(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise (ReminderChanged if conditions else ReminderNotFound)(kwargs['Key']['reminder_id'])
+            raise
+        return response.get('Attributes')
+
+    def query_by_user(self, user_id, limit=None, exclusive_start_key=None, due_from=None, due_to=None):
+        kwargs = {
+            'IndexName': USER_ID_INDEX,
+            'KeyConditionExpression': Key('user_id').eq(user_id)
+        }
+        if due_from is not None or due_to is not None:
+            kwargs['IndexName'] = USER_DUE_AT_INDEX
+            if due_to is None:
+                kwargs['KeyConditionExpression'] &= Key('due_at').gte(due_from)
+            elif due_from is None:
+                kwargs['KeyConditionExpression'] &= Key('due_at').lte(due_to)
+            else:
+                kwargs['KeyConditionExpression'] &= Key('due_at').between(due_from, due_to)
+        if limit is not None:
+            kwargs['Limit'] = limit
+        if exclusive_start_key is not None:
+            kwargs['ExclusiveStartKey'] = exclusive_start_key
+        response = self.table.query(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    def query_due_bucket(self, bucket):
+        kwargs = {
+            'IndexName': DUE_BUCKET_INDEX,
+            'KeyConditionExpression': Key('due_bucket').eq(bucket)
+        }
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response['Items']:
+                yield item
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # BatchWriteItem 25 at a time retrying UnprocessedItems with exponential backoff
+    def batch_put(self, items):
+        unprocessed_ids = set()
+        table_name = self.table.name
+        for start in range(0, len(items), BATCH_WRITE_CHUNK):
+            requests = [{'PutRequest': {'Item': item}} for item in items[start:start + BATCH_WRITE_CHUNK]]
+            attempt = 0
+            while requests:
+                try:
+                    response = self.dynamodb.batch_write_item(RequestItems={table_name: requests})
+                except ClientError as e:
+                    logger.error(e.response['Error']['Message'])
+                    break
+                requests = response.get('UnprocessedItems', {}).get(table_name, [])
+                attempt += 1
+                if not requests or attempt >= self.max_attempts:
+                    break
+                time.sleep(backoff(attempt))
+            unprocessed_ids.update(request['PutRequest']['Item']['reminder_id'] for request in requests)
+        return unprocessed_ids
+
+    # BatchWriteItem delete requests 25 at a time retrying UnprocessedItems with exponential backoff
+    def batch_delete(self, keys):
+        unprocessed_ids = set()
+        table_name = self.table.name
+        for start in range(0, len(keys), BATCH_WRITE_CHUNK):
+            requests = [{'DeleteRequest': {'Key': reminder_key(key)}} for key in keys[start:start + BATCH_WRITE_CHUNK]]
+            attempt = 0
+            while requests:
+                try:
+                    response = self.dynamodb.batch_write_item(RequestItems={table_name: requests})
+                except ClientError as e:
+                    logger.error(e.response['Error']['Message'])
+                    break
+                requests = response.get('UnprocessedItems', {}).get(table_name, [])
+                attempt += 1
+                if not requests or attempt >= self.max_attempts:
+                    break
+                time.sleep(backoff(attempt))
+            unprocessed_ids.update(request['DeleteRequest']['Key']['reminder_id'] for request in requests)
+        return unprocessed_ids
+
+    # BatchGetItem 100 at a time retrying UnprocessedKeys with exponential backoff
+    def batch_get(self, keys):
+        found = {}
+        table_name = self.table.name
+        for start in range(0, len(keys), BATCH_GET_CHUNK):
+            pending = [reminder_key(key) for key in keys[start:start + BATCH_GET_CHUNK]]
+            attempt = 0
+            while pending:
+                response = self.dynamodb.batch_get_item(RequestItems={table_name: {'Keys': pending}})
+                for item in response['Responses'].get(table_name, []):
+                    found[item['reminder_id']] = item
+                pending = response.get('UnprocessedKeys', {}).get(table_name, {}).get('Keys', [])
+                attempt += 1
+                if pending and attempt >= self.max_attempts:
+                    raise Exception("Couldn't fetch {count} reminders".format(count=len(pending)))
+                if pending:
+                    time.sleep(backoff(attempt))
+        return found
+
+    def scan(self, segment, total_segments, attributes=None, limit=None, exclusive_start_key=None, states=None, updated_before=None):
+        kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+        if attributes:
+            names = {ATTRIBUTE_ALIASES[name]: name for name in attributes if name in ATTRIBUTE_ALIASES}
+            kwargs['ProjectionExpression'] = ', '.join(ATTRIBUTE_ALIASES.get(name, name) for name in attributes)
+            if names:
+                kwargs['ExpressionAttributeNames'] = names
+        conditions = []
+        if states:
+            conditions.append(Attr('state').is_in(list(states)))
+        if updated_before is not None:
+            conditions.append(Attr('updated_at').lt(updated_before))
+        if conditions:
+            kwargs['FilterExpression'] = conditions[0] if len(conditions) == 1 else conditions[0] & conditions[1]
+        if limit is not None:
+            kwargs['Limit'] = limit
+        if exclusive_start_key is not None:
+            kwargs['ExclusiveStartKey'] = exclusive_start_key
+        response = self.table.scan(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+# Scans every segment of a parallel scan on its own thread, calling process(segment, items, last_evaluated_key)
+# with each page - only one page per segment is held at a time whatever the size of the table
+# start_keys - {segment: exclusive_start_key} to resume segments from, segments mapped to None are skipped
+# stop - called before every page, segments stop scanning once it returns True
+# states / updated_before - filters as for scan
+# The first error is raised once the other segments have finished
+def parallel_scan(repository, total_segments, process, attributes=None, page_size=None, start_keys=None, stop=None,
+        states=None, updated_before=None):
+    start_keys = start_keys or {}
+
+    def scan_segment(segment):
+        exclusive_start_key = start_keys.get(segment)
+        if segment in start_keys and exclusive_start_key is None:
+            return
+        while stop is None or not stop():
+            items, exclusive_start_key = repository.scan(segment, total_segments, attributes, page_size, exclusive_start_key,
+                states, updated_before)
+            process(segment, items, exclusive_start_key)
+            if exclusive_start_key is None:
+                return
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        futures = [executor.submit(scan_segment, segment) for segment in range(total_segments)]
+    for future in futures:
+        future.result()
+
+# Yields all of a user's reminders in UserIdIndex order, one index page at a time hydrated with one BatchGetItem
+# Only a page of reminders is held at a time - reminders deleted between the query and the read are skipped
+# due_from - only reminders due from then (epoch seconds) in due order, from UserDueAtIndex
+def iter_user_reminders(repository, user_id, page_size=BATCH_GET_CHUNK, due_from=None):
+    exclusive_start_key = None
+    while True:
+        keys, exclusive_start_key = repository.query_by_user(user_id, page_size, exclusive_start_key, due_from)
+        found = repository.batch_get(keys) if keys else {}
+        for key in keys:
+            if key['reminder_id'] in found:
+                yield found[key['reminder_id']]
+        if exclusive_start_key is None:
+            return
+
+def backoff(attempt):
+    return min(0.05 * (2 ** attempt), 1.0)
+
+# Reminders kept in a dict with the same semantics as the DynamoDB table
+# Values go through the boto3 serializer on the way in and out so types match what DynamoDB returns
+# UserIdIndex returns keys only and DueBucketIndex keys plus wake_at, as projected in template.yaml
+class InMemoryReminderRepository(ReminderRepository):
+    def __init__(self, items=None):
+        self._items = {}
+        self._lock = threading.RLock()
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        for item in items or []:
+            self.put(item)
+
+    def _store(self, item):
+        return {name: self._serializer.serialize(value) for name, value in item.items()}
+
+    def _load(self, stored):
+        return {name: self._deserializer.deserialize(value) for name, value in stored.items()}
+
+    def get(self, reminder_id, user_id=None, consistent=False):
+        with self._lock:
+            for (item_reminder_id, item_user_id), stored in self._items.items():
+                if item_reminder_id == reminder_id and (user_id is None or item_user_id == user_id):
+                    return self._load(stored)
+        return None
+
+    def put(self, item):
+        with self._lock:
+            self._items[(item['reminder_id'], item['user_id'])] = self._store(item)
+
+    def update(self, key, updates=None, remove=None, must_exist=False, return_values=None, increments=None, conditions=None):
+        with self._lock:
+            item_key = (key['reminder_id'], key['user_id'])
+            stored = self._items.get(item_key)
+            if conditions and any(stored is None or stored.get(name) != self._serializer.serialize(value)
+                    for name, value in conditions.items()):
+                raise ReminderChanged(key['reminder_id'])
+            if stored is None and must_exist:
+                raise ReminderNotFound(key['reminder_id'])
+            old = copy.deepcopy(stored) if stored is not None else None
+            stored = dict(stored) if stored is not None else self._store(key)
+            stored.update(self._store(updates or {}))
+            for name in remove or []:
+                stored.pop(name, None)
+            for name, value in (increments or {}).items():
+                current = self._deserializer.deserialize(stored[name]) if name in stored else 0
+                stored[name] = self._serializer.serialize(current + value)
+            self._items[item_key] = stored
+            if return_values == 'ALL_NEW':
+                return self._load(stored)
+            if return_values == 'UPDATED_NEW':
+                changed = set(updates or {}) | set(increments or {})
+                return self._load({name: value for name, value in stored.items() if name in changed})
+            if return_values == 'ALL_OLD' and old is not None:
+                return self._load(old)
+            return None
+
+    def delete(self, key, must_exist=False, return_values=None):
+        with self._lock:
+            stored = self._items.pop((key['reminder_id'], key['user_id']), None)
+        if stored is None and must_exist:
+            raise ReminderNotFound(key['reminder_id'])
+        if return_values == 'ALL_OLD' and stored is not None:
+            return self._load(stored)
+        return None
+
+    def query_by_user(self, user_id, limit=None, exclusive_start_key=None, due_from=None, due_to=None):
+        with self._lock:
+            keys = [{'reminder_id': reminder_id, 'user_id': item_user_id} for (reminder_id, item_user_id) in self._items if item_user_id == user_id]
+            order = lambda key: key['reminder_id']
+            if due_from is not None or due_to is not None:
+                #UserDueAtIndex is sparse and sorted on due_at
+                due_ats = {key['reminder_id']: self._items[(key['reminder_id'], user_id)].get('due_at') for key in keys}
+                keys = [dict(key, due_at=self._deserializer.deserialize(due_ats[key['reminder_id']]))
+                    for key in keys if due_ats[key['reminder_id']] is not None]
+                keys = [key for key in keys if (due_from is None or key['due_at'] >= due_from) and (due_to is None or key['due_at'] <= due_to)]
+                order = lambda key: (key['due_at'], key['reminder_id'])
+            keys.sort(key=order)
+        if exclusive_start_key is not None:
+            #The start key may have been deleted since it was returned - the page starts after where it was
+            keys = [key for key in keys if order(key) > order(exclusive_start_key)]
+        return self._page(keys, limit)
+
+    def _page(self, items, limit):
+        if limit is not None and len(items) >= limit:
+            items = items[:limit]
+            #The table key, and due_at when paging UserDueAtIndex
+            return items, {name: value for name, value in items[-1].items() if name in ('reminder_id', 'user_id', 'due_at')}
+        return items, None
+
+    def query_due_bucket(self, bucket):
+        with self._lock:
+            items = [self._load(stored) for stored in self._items.values()]
+        for item in items:
+            if item.get('due_bucket') == bucket:
+                projected = reminder_key(item)
+                projected['due_bucket'] = item['due_bucket']
+                if 'wake_at' in item:
+                    projected['wake_at'] = item['wake_at']
+                yield projected
+
+    def batch_put(self, items):
+        for item in items:
+            self.put(item)
+        return set()
+
+    def batch_get(self, keys):
+        found = {}
+        for key in keys:
+            item = self.get(key['reminder_id'], key['user_id'])
+            if item is not None:
+                found[item['reminder_id']] = item
+        return found
+
+    def batch_delete(self, keys):
+        for key in keys:
+            self.delete(key)
+        return set()
+
+    def scan(self, segment, total_segments, attributes=None, limit=None, exclusive_start_key=None, states=None, updated_before=None):
+        with self._lock:
+            items = [self._load(stored) for (reminder_id, user_id), stored in sorted(self._items.items())
+                if zlib.crc32(reminder_id.encode('utf-8')) % total_segments == segment]
+        if exclusive_start_key is not None:
+            #The start key may have been deleted since it was returned
+            items = [item for item in items if (item['reminder_id'], item['user_id']) > (exclusive_start_key['reminder_id'], exclusive_start_key['user_id'])]
+        items, last_evaluated_key = self._page(items, limit)
+        items = [item for item in items if (not states or item.get('state') in states)
+            and (updated_before is None or item.get('updated_at', 0) < updated_before)]
+        if attributes:
+            items = [{name: value for name, value in item.items() if name in attributes} for item in items]
+        if last_evaluated_key is not None:
+            last_evaluated_key = reminder_key(last_evaluated_key)
+        return items, last_evaluated_key
+
+# Read-through LRU of reminders by reminder_id in front of another repository, kept for the life of a warm container
+# Entries expire after ttl_seconds. Writes made through the cache replace the reminder's entry with a marker holding
+# the updated_at written, so the container reads its own writes - a read returning an older reminder (an eventually
+# consistent read that has not caught up) is repeated strongly consistent. Writes made by other containers are seen
+# once the entry expires, or at once with consistent=True which reads strongly consistent and refreshes the entry
+# A read that overlaps a write of the same reminder does not cache what it read, and a read never replaces a cached
+# reminder with one that has an older updated_at
+# Hits, misses, evictions and expirations are counted in stats() and in the invocation's metrics
+class CachedReminderRepository(ReminderRepository):
+    def __init__(self, repository, max_size=REMINDER_CACHE_SIZE, ttl_seconds=REMINDER_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.repository = repository
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        #reminder_id -> (reminder or None after a write, expires_at, updated_at of the last write or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        #Writes seen so far, and the last one of each reminder written while reads were in flight
+        self._writes = 0
+        self._written_at = {}
+        self._reads = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_reads = 0
+
+    def get(self, reminder_id, user_id=None, consistent=False):
+        return self.lookup(reminder_id, user_id, consistent)[0]
+
+    def lookup(self, reminder_id, user_id=None, consistent=False):
+        if not consistent:
+            found, item = self._cached(reminder_id, user_id)
+            if found:
+                return item, True
+        with self._lock:
+            writes = self._writes
+            written = self._entries.get(reminder_id, (None, None, None))[2]
+            self._reads += 1
+        item = None
+        try:
+            item = self.repository.get(reminder_id, user_id, consistent=consistent)
+            if not consistent and written is not None and item is not None and item.get('updated_at', 0) < written:
+                with self._lock:
+                    self.stale_reads += 1
+                instrumentation.count('ReminderCache.StaleReads')
+                item = self.repository.get(reminder_id, user_id, consistent=True)
+        finally:
+            with self._lock:
+                self._reads -= 1
+                if item is not None and self._written_at.get(reminder_id, 0) <= writes:
+                    self._remember(item)
+                if self._reads == 0:
+                    self._written_at.clear()
+        return copy.deepcopy(item), False
+
+    def put(self, item):
+        self._write({item['reminder_id']: item.get('updated_at')}, lambda: self.repository.put(item))
+
+    def update(self, key, updates=None, remove=None, must_exist=False, return_values=None, increments=None, conditions=None):
+        return self._write({key['reminder_id']: (updates or {}).get('updated_at')},
+            lambda: self.repository.update(key, updates, remove, must_exist, return_values, increments, conditions))
+
+    def delete(self, key, must_exist=False, return_values=None):
+        #Any copy still read from the table is older than the delete
+        return self._write({key['reminder_id']: float('inf')}, lambda: self.repository.delete(key, must_exist, return_values))
+
+    def query_by_user(self, user_id, limit=None, exclusive_start_key=None, due_from=None, due_to=None):
+        return self.repository.query_by_user(user_id, limit, exclusive_start_key, due_from, due_to)
+
+    def query_due_bucket(self, bucket):
+        return self.repository.query_due_bucket(bucket)
+
+    def batch_put(self, items):
+        return self._write({item['reminder_id']: item.get('updated_at') for item in items}, lambda: self.repository.batch_put(items))
+
+    def batch_get(self, keys):
+        return self.repository.batch_get(keys)
+
+    def batch_delete(self, keys):
+        return self._write({key['reminder_id']: float('inf') for key in keys}, lambda: self.repository.batch_delete(keys))
+
+    def scan(self, segment, total_segments, attributes=None, limit=None, exclusive_start_key=None, states=None, updated_before=None):
+        return self.repository.scan(segment, total_segments, attributes, limit, exclusive_start_key, states, updated_before)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations,
+                    'stale_reads': self.stale_reads, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # (True, reminder) on a hit
+    def _cached(self, reminder_id, user_id):
+        with self._lock:
+            entry = self._entries.get(reminder_id)
+            if entry is not None and entry[1] <= self.clock():
+                del self._entries[reminder_id]
+                self.expirations += 1
+                instrumentation.count('ReminderCache.Expirations')
+                entry = None
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                instrumentation.count('ReminderCache.Misses')
+                return False, None
+            self._entries.move_to_end(reminder_id)
+            self.hits += 1
+        instrumentation.count('ReminderCache.Hits')
+        item = entry[0]
+        #Reminder ids are unique so the reminder of another user does not exist
+        if user_id is not None and item['user_id'] != user_id:
+            return True, None
+        return True, copy.deepcopy(item)
+
+    # Called holding the lock
+    def _remember(self, item):
+        reminder_id = item['reminder_id']
+        entry = self._entries.get(reminder_id)
+        if entry is not None and entry[0] is not None and entry[0].get('updated_at', 0) > item.get('updated_at', 0):
+            return
+        self._store(reminder_id, (copy.deepcopy(item), self.clock() + self.ttl_seconds, None))
+
+    def _store(self, reminder_id, entry):
+        if self.max_size <= 0:
+            return
+        self._entries[reminder_id] = entry
+        self._entries.move_to_end(reminder_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            instrumentation.count('ReminderCache.Evictions')
+
+    # written - {reminder_id: updated_at written or None}
+    # The reminders are dropped before and after the write so a read that started before it finished is not cached
+    def _write(self, written, write):
+        self._invalidate(written, None)
+        try:
+            return write()
+        finally:
+            self._invalidate(written, self.clock() + self.ttl_seconds)
+
+    def _invalidate(self, written, expires_at):
+        with self._lock:
+            self._writes += 1
+            for reminder_id, updated_at in written.items():
+                self._entries.pop(reminder_id, None)
+                if expires_at is not None and updated_at is not None:
+                    self._store(reminder_id, (None, expires_at, updated_at))
+                if self._reads:
+                    self._written_at[reminder_id] = self._writes
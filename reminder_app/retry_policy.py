@@ -0,0 +1,91 @@
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+# How long execute_reminder waits after sending a reminder before checking whether it was acknowledged
+# The policy is read from the SSM app parameters (see ConfigProvider) so it can be changed without a deploy
+# retry_policy - fixed (default), exponential or jittered
+# retry_interval_seconds - wait after the first send, and after every send for fixed (default 300)
+# retry_multiplier - growth of the wait per send for exponential and jittered (default 2)
+# retry_max_interval_seconds - cap on the wait for exponential and jittered (default 3600)
+# max_retry_count still decides how many times a reminder is resent before it is marked Unacknowledged
+POLICY_FIXED = 'fixed'
+POLICY_EXPONENTIAL = 'exponential'
+POLICY_JITTERED = 'jittered'
+
+DEFAULT_INTERVAL_SECONDS = 300
+DEFAULT_MULTIPLIER = 2
+DEFAULT_MAX_INTERVAL_SECONDS = 3600
+
+class RetryPolicy(object):
+    name = None
+
+    # Seconds to wait after the attempt-th send of a reminder (1 for the first send)
+    def delay_seconds(self, attempt):
+        raise NotImplementedError
+
+class FixedRetryPolicy(RetryPolicy):
+    name = POLICY_FIXED
+
+    def __init__(self, interval_seconds=DEFAULT_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+
+    def delay_seconds(self, attempt):
+        return self.interval_seconds
+
+class ExponentialRetryPolicy(RetryPolicy):
+    name = POLICY_EXPONENTIAL
+
+    def __init__(self, interval_seconds=DEFAULT_INTERVAL_SECONDS, multiplier=DEFAULT_MULTIPLIER,
+            max_interval_seconds=DEFAULT_MAX_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.multiplier = multiplier
+        self.max_interval_seconds = max_interval_seconds
+
+    def delay_seconds(self, attempt):
+        return min(self.interval_seconds * self.multiplier ** (max(attempt, 1) - 1), self.max_interval_seconds)
+
+# Exponential with "equal jitter" - half the wait is kept and the other half is random
+# Reminders sent together (e.g. by one sweep) are spread out on their retries while the user still gets at
+# least half the exponential wait to acknowledge - full jitter could resend almost immediately
+class JitteredRetryPolicy(ExponentialRetryPolicy):
+    name = POLICY_JITTERED
+
+    def __init__(self, interval_seconds=DEFAULT_INTERVAL_SECONDS, multiplier=DEFAULT_MULTIPLIER,
+            max_interval_seconds=DEFAULT_MAX_INTERVAL_SECONDS, random=random.random):
+        super(JitteredRetryPolicy, self).__init__(interval_seconds, multiplier, max_interval_seconds)
+        self.random = random
+
+    def delay_seconds(self, attempt):
+        delay = super(JitteredRetryPolicy, self).delay_seconds(attempt)
+        return delay / 2.0 + self.random() * delay / 2.0
+
+POLICIES = {
+    POLICY_FIXED: FixedRetryPolicy,
+    POLICY_EXPONENTIAL: ExponentialRetryPolicy,
+    POLICY_JITTERED: JitteredRetryPolicy
+}
+
+# params - the app parameters by short name as returned by ConfigProvider.params()
+# A bad value is logged and replaced by its default so reminders keep being retried
+def policy_from_params(params):
+    name = params.get('retry_policy', POLICY_FIXED)
+    if name not in POLICIES:
+        logger.error("Unknown retry_policy %s - using %s", name, POLICY_FIXED)
+        name = POLICY_FIXED
+    interval_seconds = _number(params, 'retry_interval_seconds', DEFAULT_INTERVAL_SECONDS)
+    if name == POLICY_FIXED:
+        return FixedRetryPolicy(interval_seconds)
+    return POLICIES[name](interval_seconds, _number(params, 'retry_multiplier', DEFAULT_MULTIPLIER),
+        _number(params, 'retry_max_interval_seconds', DEFAULT_MAX_INTERVAL_SECONDS))
+
+def _number(params, name, default):
+    try:
+        value = float(params.get(name, default))
+    except ValueError:
+        value = -1
+    if value <= 0:
+        logger.error("Invalid %s %s - using %s", name, params.get(name), default)
+        return default
+    return value
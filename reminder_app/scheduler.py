@@ -0,0 +1,33 @@
+import calendar
+import os
+
+# How reminders are woken up when they fall due
+# stepfunctions - one ReminderStateMachine execution per reminder (default)
+# sweep - reminders are indexed by due_bucket and a periodic sweep executes every due bucket
+SCHEDULER_MODE_STEP_FUNCTIONS = 'stepfunctions'
+SCHEDULER_MODE_SWEEP = 'sweep'
+SCHEDULER_MODE = os.environ.get('SCHEDULER_MODE', SCHEDULER_MODE_STEP_FUNCTIONS)
+
+# Width of a due_bucket in seconds and how many past buckets a sweep revisits when it has no low water mark
+SWEEP_BUCKET_SECONDS = int(os.environ.get('SWEEP_BUCKET_SECONDS', '300'))
+SWEEP_LOOKBACK_BUCKETS = int(os.environ.get('SWEEP_LOOKBACK_BUCKETS', '12'))
+
+DUE_BUCKET_INDEX = 'DueBucketIndex'
+
+def sweep_mode():
+    return SCHEDULER_MODE == SCHEDULER_MODE_SWEEP
+
+# date - naive UTC datetime
+def bucket_for(date):
+    epoch = calendar.timegm(date.utctimetuple())
+    return epoch - epoch % SWEEP_BUCKET_SECONDS
+
+# Buckets to query for a sweep running at now - oldest first
+# low_water_mark - the oldest bucket a previous sweep did not finish, every bucket from it on is due
+def due_buckets(now, low_water_mark=None):
+    current = bucket_for(now)
+    if low_water_mark is None:
+        first = current - SWEEP_LOOKBACK_BUCKETS * SWEEP_BUCKET_SECONDS
+    else:
+        first = min(low_water_mark, current)
+    return list(range(first, current + 1, SWEEP_BUCKET_SECONDS))
@@ -0,0 +1,97 @@
+import base64
+import decimal
+import json
+import logging
+import os
+from boto3.dynamodb.types import Binary
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# JSON written by the handlers - API response bodies, export lines and archive chunks
+# Items read through the DynamoDB resource hold Decimal numbers, sets and Binary. The encoder converts them with
+# one lookup on their type when it meets them - everything else is encoded natively by the backend
+# Output is compact and UTF-8 (not ASCII escaped) whichever backend is used
+
+# auto - orjson when it is installed (add it to requirements.txt), json - always the standard library
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+# Integral numbers as int (retry_count, due_at, updated_at...), others as float
+def decimal_number(value):
+    number = int(value)
+    return number if number == value else float(value)
+
+def binary_base64(value):
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+# DynamoDB sets (SS, NS, BS) as sorted lists so the same item always gives the same JSON
+def set_list(values):
+    return sorted(CONVERTERS.get(type(value), plain)(value) for value in values)
+
+def plain(value):
+    return value
+
+CONVERTERS = {
+    decimal.Decimal: decimal_number,
+    set: set_list,
+    frozenset: set_list,
+    Binary: binary_base64,
+    bytes: binary_base64,
+    bytearray: binary_base64
+}
+
+def convert(value):
+    try:
+        converter = CONVERTERS[type(value)]
+    except KeyError:
+        raise TypeError("Object of type {name} is not JSON serializable".format(name=type(value).__name__))
+    return converter(value)
+
+_encoder = json.JSONEncoder(default=convert, separators=(',', ':'), ensure_ascii=False)
+
+def _stdlib_dumps(value):
+    return _encoder.encode(value)
+
+def _stdlib_dumps_bytes(value):
+    return _encoder.encode(value).encode('utf-8')
+
+def _orjson_dumps_bytes(value):
+    try:
+        return orjson.dumps(value, default=convert, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        #Integers over 64 bits and lone surrogates - the standard library takes them, or raises the same TypeError
+        return _stdlib_dumps_bytes(value)
+
+def _orjson_dumps(value):
+    return _orjson_dumps_bytes(value).decode('utf-8')
+
+#Each backend produces its own type directly - str for json, bytes for orjson
+if orjson is not None and JSON_BACKEND != 'json':
+    BACKEND = 'orjson'
+    dumps = _orjson_dumps
+    dumps_bytes = _orjson_dumps_bytes
+else:
+    if JSON_BACKEND == 'orjson':
+        logger.warning("JSON_BACKEND is orjson but it is not installed - using json")
+    BACKEND = 'json'
+    dumps = _stdlib_dumps
+    dumps_bytes = _stdlib_dumps_bytes
+
+# API Gateway proxy response with a JSON body
+def json_response(body, status_code=200):
+    return {
+        "statusCode": status_code,
+        "body": dumps(body)
+    }
+
+# Response that is always the same, built once - body is sent as is when it is a string, as JSON otherwise
+# Returns a function giving a copy of it, so a caller adding headers does not change the next response
+def static_response(status_code, body):
+    envelope = {
+        "statusCode": status_code,
+        "body": body if isinstance(body, str) else dumps(body)
+    }
+    return lambda: dict(envelope)
@@ -0,0 +1,147 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+try:
+    from reminder_app import aws_clients
+    from reminder_app.reminder_repository import iter_user_reminders
+    from reminder_app.instrumentation import instrumented
+except ImportError:
+    import aws_clients
+    from reminder_repository import iter_user_reminders
+    from instrumentation import instrumented
+
+#Clients are created on first use - see aws_clients
+summary_table = aws_clients.lazy_table('{stack_name}-ReminderSummaryTable'.format(stack_name=os.environ['STACK_NAME']), region_name='us-east-1')
+
+#Users summarised concurrently for one batch of stream records
+SUMMARY_CONCURRENCY = int(os.environ.get('SUMMARY_CONCURRENCY', '10'))
+#Attempts at writing a user's summary when another batch wrote it in between
+SUMMARY_MAX_ATTEMPTS = 5
+#Reminders of a user read per page when looking for the next one due
+NEXT_DUE_PAGE_SIZE = 25
+#Counts are top level attributes count_<state> - ADD can not create an attribute inside a map that does not exist yet
+COUNT_PREFIX = 'count_'
+
+deserializer = TypeDeserializer()
+
+# Triggered by the RemindersTable stream (NEW_AND_OLD_IMAGES)
+# Keeps one small summary item per user - {user_id, count_<state>: n, total, updated_at, sequence_number}
+# Each record adds +1 to the count of the state in its new image and -1 to the one in its old image, so a user's
+# summary is one UpdateItem of ADD deltas per batch whatever the number of reminders they have
+# sequence_number is the SequenceNumber of the last record applied to the summary. Records up to it are skipped and
+# the update is conditional on it, so a batch retried after some of its users were written does not count their
+# changes again. Shards of one partition are read in order - with several partitions a record of one shard that is
+# behind the last one applied from another is skipped too
+# Users that could not be written are reported as batch item failures - the batch is retried from their first record
+@instrumented
+def update_summaries(event, context):
+    changes = coalesce(event['Records'])
+    if not changes:
+        return {'records': 0, 'users': 0, 'batchItemFailures': []}
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_CONCURRENCY, len(changes))) as executor:
+        futures = [(user_id, executor.submit(apply_changes, user_id, changes[user_id])) for user_id in changes]
+        for user_id, future in futures:
+            try:
+                future.result()
+            except Exception:
+                logging.exception("Couldn't update the summary of {user_id}".format(user_id=user_id))
+                failed.append(changes[user_id][0]['sequence_number'])
+    #Lambda retries from the earliest record reported
+    failures = [{'itemIdentifier': str(min(failed))}] if failed else []
+    return {'records': len(event['Records']), 'users': len(changes), 'batchItemFailures': failures}
+
+def image_of(dynamodb, name):
+    image = dynamodb.get(name)
+    return {key: deserializer.deserialize(value) for key, value in image.items()} if image else None
+
+# {user_id: [{'sequence_number': n, 'counts': {state: delta}, 'total': delta, 'updated_at': ms}]} in stream order
+# INSERT has only a new image, REMOVE (deletes and TTL expiry) only an old one
+def coalesce(records):
+    changes = OrderedDict()
+    for record in records:
+        dynamodb = record['dynamodb']
+        old = image_of(dynamodb, 'OldImage')
+        new = image_of(dynamodb, 'NewImage')
+        keys = image_of(dynamodb, 'Keys')
+        counts = OrderedDict()
+        for image, delta in ((old, -1), (new, 1)):
+            if image is not None and image.get('state'):
+                counts[image['state']] = counts.get(image['state'], 0) + delta
+        changes.setdefault(keys['user_id'], []).append({
+            'sequence_number': int(dynamodb['SequenceNumber']),
+            'counts': counts,
+            'total': (1 if new is not None else 0) - (1 if old is not None else 0),
+            'updated_at': int((new or {}).get('updated_at') or dynamodb.get('ApproximateCreationDateTime', 0) * 1000)
+        })
+    return changes
+
+# Adds the records not applied yet with one UpdateItem, conditional on the sequence_number they were picked against
+# - retried when another batch of the user got there first
+def apply_changes(user_id, records):
+    for attempt in range(SUMMARY_MAX_ATTEMPTS):
+        summary = summary_table.get_item(Key={'user_id': user_id}, ProjectionExpression='sequence_number',
+            ConsistentRead=True).get('Item') or {}
+        applied = summary.get('sequence_number')
+        pending = [record for record in records if applied is None or record['sequence_number'] > applied]
+        if not pending:
+            return None
+        try:
+            return summary_table.update_item(Key={'user_id': user_id}, **update_arguments(pending, applied))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logging.info("Summary of {user_id} changed while updating - retrying".format(user_id=user_id))
+    raise Exception("Couldn't update the summary of {user_id}".format(user_id=user_id))
+
+def update_arguments(records, applied):
+    counts = {}
+    for record in records:
+        for state, delta in record['counts'].items():
+            counts[state] = counts.get(state, 0) + delta
+    names = {'#total': 'total', '#updated_at': 'updated_at', '#sequence_number': 'sequence_number'}
+    values = {
+        ':total': sum(record['total'] for record in records),
+        ':updated_at': max(record['updated_at'] for record in records),
+        ':sequence_number': records[-1]['sequence_number']
+    }
+    adds = ['#total :total']
+    for index, (state, delta) in enumerate(sorted(counts.items())):
+        if delta:
+            names['#c{0}'.format(index)] = COUNT_PREFIX + state
+            values[':c{0}'.format(index)] = delta
+            adds.append('#c{0} :c{0}'.format(index))
+    if applied is None:
+        condition = 'attribute_not_exists(#sequence_number)'
+    else:
+        condition = '#sequence_number = :applied'
+        values[':applied'] = applied
+    return {
+        'UpdateExpression': 'ADD {adds} SET #updated_at = :updated_at, #sequence_number = :sequence_number'.format(adds=', '.join(adds)),
+        'ConditionExpression': condition,
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+# The summary returned by the API - {user_id, counts: {state: n}, total, next_notify_date_time, updated_at}
+# next_notify_date_time is the first Pending reminder due from now, read from UserDueAtIndex of the reminders
+# repository as it can not be kept by deltas - usually the first page of NEXT_DUE_PAGE_SIZE reminders
+def get_summary(user_id, repository):
+    summary = summary_table.get_item(Key={'user_id': user_id}).get('Item') or {}
+    counts = {name[len(COUNT_PREFIX):]: value for name, value in summary.items() if name.startswith(COUNT_PREFIX) and value}
+    next_notify_date_time = None
+    if summary.get('total'):
+        pending = (item for item in iter_user_reminders(repository, user_id, NEXT_DUE_PAGE_SIZE, due_from=int(time.time()))
+            if item.get('state') == 'Pending')
+        next_notify_date_time = next(pending, {}).get('notify_date_time')
+    return {
+        'user_id': user_id,
+        'counts': counts,
+        'total': summary.get('total', 0),
+        'next_notify_date_time': next_notify_date_time,
+        'updated_at': summary.get('updated_at')
+    }
@@ -0,0 +1,192 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+try:
+    from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
+    from reminder_app.execute_reminder_handler import execute_reminder, execute_reminders_batch, reminders, ssm, param_path, \
+        DIGEST_MODE, DIGEST_WINDOW_SECONDS, SES_TEMPLATE
+    from reminder_app.reminder_repository import ReminderNotFound, reminder_key
+    from reminder_app.scheduler import bucket_for, due_buckets
+    from reminder_app.instrumentation import instrumented
+except ImportError:
+    from date_utils import isostr_to_datetime, datetime_to_isostr
+    from execute_reminder_handler import execute_reminder, execute_reminders_batch, reminders, ssm, param_path, \
+        DIGEST_MODE, DIGEST_WINDOW_SECONDS, SES_TEMPLATE
+    from reminder_repository import ReminderNotFound, reminder_key
+    from scheduler import bucket_for, due_buckets
+    from instrumentation import instrumented
+
+# Number of reminders executed concurrently by one sweep
+SWEEP_CONCURRENCY = int(os.environ.get('SWEEP_CONCURRENCY', '10'))
+# Reminders of a bucket passed to one execute_reminders_batch call in DIGEST_MODE or with an SES_TEMPLATE
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', '100'))
+# No bucket or group of reminders is started once a sweep has run this long - keep it under the schedule interval
+# so a sweep is done before the next one starts. What is left is swept by the next one
+SWEEP_MAX_SECONDS = float(os.environ.get('SWEEP_MAX_SECONDS', '45'))
+
+# SSM parameter holding the oldest bucket a sweep did not finish - below the app's config path so the config
+# provider (Recursive=False) does not read it
+SWEEP_LOW_WATER_MARK_PARAM = param_path + '/sweep/low_water_mark'
+
+# Triggered every minute by a schedule when SCHEDULER_MODE is sweep
+# Queries every due bucket and runs the execute_reminder logic for each reminder in it
+# Reminders whose wake_at is still in the future are left alone until a later sweep
+# The reminder is then moved to the bucket of its next wake up, or taken out of the index when done
+# This gives the same results as the step function looping wait_to_execute -> executeNotifyLambda
+# In DIGEST_MODE or with an SES_TEMPLATE the due reminders of a bucket go through execute_reminders_batch together,
+# SWEEP_BATCH_SIZE at a time in user order, so a user's reminders are sent as one message and emails in bulk.
+# In DIGEST_MODE waiting reminders of the bucket due within the digest window are offered to join them
+# Sweeps never overlap - the function runs with a reserved concurrency of 1 and stops after SWEEP_MAX_SECONDS
+# Sweeps start from the low water mark, so buckets left behind by a stopped, failed or missed sweep are still swept
+# however old they are. Reminders that fail are moved to the current bucket to be retried by the next sweep - the
+# mark then moves past their bucket
+@instrumented
+def sweep_reminders(event, context):
+    now = datetime.utcnow()
+    deadline = time.monotonic() + SWEEP_MAX_SECONDS
+    summary = {'buckets': 0, 'waiting': 0, 'executed': 0, 'rescheduled': 0, 'completed': 0, 'failed': 0, 'stopped': False}
+    horizon = now + timedelta(seconds=DIGEST_WINDOW_SECONDS)
+    grouped = DIGEST_MODE or bool(SES_TEMPLATE)
+    current = bucket_for(now)
+    low_water_mark = load_low_water_mark()
+    #Oldest bucket not finished by this sweep
+    unfinished = None
+    #A reminder moved into a later bucket is only executed once per sweep
+    seen = set()
+    with ThreadPoolExecutor(max_workers=SWEEP_CONCURRENCY) as executor:
+        for bucket in due_buckets(now, low_water_mark):
+            if time.monotonic() > deadline:
+                summary['stopped'] = True
+                unfinished = bucket if unfinished is None else unfinished
+                break
+            summary['buckets'] += 1
+            batch = []
+            for keys in reminders.query_due_bucket(bucket):
+                if keys['reminder_id'] in seen:
+                    continue
+                seen.add(keys['reminder_id'])
+                if 'wake_at' in keys and isostr_to_datetime(keys['wake_at']) > now:
+                    if DIGEST_MODE and isostr_to_datetime(keys['wake_at']) <= horizon:
+                        batch.append(keys)
+                    else:
+                        summary['waiting'] += 1
+                else:
+                    batch.append(keys)
+            if grouped:
+                batch.sort(key=lambda keys: keys['user_id'])
+                size, sweep = SWEEP_BATCH_SIZE, sweep_together
+            else:
+                size, sweep = SWEEP_CONCURRENCY, lambda chunk: executor.map(sweep_reminder, chunk)
+            finished = True
+            for start in range(0, len(batch), size):
+                if time.monotonic() > deadline:
+                    summary['stopped'] = True
+                    finished = False
+                    break
+                chunk = batch[start:start + size]
+                for keys, outcome in zip(chunk, sweep(chunk)):
+                    if outcome != 'waiting':
+                        summary['executed'] += 1
+                    summary[outcome] += 1
+                    if outcome == 'failed' and bucket != current:
+                        finished = retry_in_bucket(keys, now) and finished
+            if not finished and unfinished is None:
+                unfinished = bucket
+    next_mark = current if unfinished is None else unfinished
+    if next_mark != low_water_mark:
+        save_low_water_mark(next_mark)
+    logging.info(summary)
+    return summary
+
+def load_low_water_mark():
+    try:
+        return int(ssm.get_parameter(Name=SWEEP_LOW_WATER_MARK_PARAM)['Parameter']['Value'])
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ParameterNotFound':
+            logging.exception("Couldn't read the sweep low water mark - sweeping the last buckets only")
+        return None
+
+def save_low_water_mark(bucket):
+    try:
+        ssm.put_parameter(Name=SWEEP_LOW_WATER_MARK_PARAM, Value=str(bucket), Type='String', Overwrite=True)
+    except ClientError:
+        logging.exception("Couldn't save the sweep low water mark")
+
+# Moves a reminder that failed to the current bucket - False when it could not be moved and stays where it is
+def retry_in_bucket(keys, now):
+    try:
+        set_wake_at(keys, datetime_to_isostr(now))
+        return True
+    except ReminderNotFound:
+        return True
+    except ClientError:
+        logging.exception("Couldn't move reminder {reminder_id} to the current bucket".format(reminder_id=keys['reminder_id']))
+        return False
+
+def sweep_reminder(keys):
+    try:
+        result = execute_reminder({'reminder_id': keys['reminder_id']}, None)
+        if result is None:
+            return 'failed'
+        if result['to_execute'] == 'true':
+            set_wake_at(keys, result['notify_date_time'])
+            return 'rescheduled'
+        clear_due_bucket(keys)
+        return 'completed'
+    except ReminderNotFound:
+        #Reminder was deleted after the bucket was queried
+        return 'completed'
+    except (ClientError, KeyError):
+        logging.exception("Sweep failed for reminder {reminder_id}".format(reminder_id=keys['reminder_id']))
+        return 'failed'
+
+def sweep_together(batch):
+    try:
+        results = execute_reminders_batch({'reminders': [batch_key(keys) for keys in batch]}, None)['results']
+    except (ClientError, KeyError):
+        logging.exception("Sweep failed for {count} reminders".format(count=len(batch)))
+        return ['failed'] * len(batch)
+    return [apply_result(keys, result) for keys, result in zip(batch, results)]
+
+# The reminder's wake_at keeps it from being sent before its retry check when offered to a digest
+def batch_key(keys):
+    key = reminder_key(keys)
+    if 'wake_at' in keys:
+        key['wake_at'] = keys['wake_at']
+    return key
+
+def apply_result(keys, result):
+    if result.get('error') == 'Reminder not found':
+        #Reminder was deleted after the bucket was queried
+        return 'completed'
+    if 'error' in result:
+        return 'failed'
+    if result['to_execute'] == 'true' and result['notify_date_time'] == keys.get('wake_at'):
+        #Offered to a digest that it did not join
+        return 'waiting'
+    try:
+        if result['to_execute'] == 'true':
+            set_wake_at(keys, result['notify_date_time'])
+            return 'rescheduled'
+        clear_due_bucket(keys)
+        return 'completed'
+    except ReminderNotFound:
+        #Reminder was deleted during the sweep
+        return 'completed'
+    except ClientError:
+        logging.exception("Sweep failed for reminder {reminder_id}".format(reminder_id=keys['reminder_id']))
+        return 'failed'
+
+# Same as the step function waiting on the notify_date_time returned by execute_reminder
+# Both raise ReminderNotFound for a reminder deleted during the sweep rather than write it back with only these attributes
+def set_wake_at(keys, wake_at):
+    reminders.update(reminder_key(keys), {
+        'due_bucket': bucket_for(isostr_to_datetime(wake_at)),
+        'wake_at': wake_at
+    }, must_exist=True)
+
+def clear_due_bucket(keys):
+    reminders.update(reminder_key(keys), remove=['due_bucket', 'wake_at'], must_exist=True)
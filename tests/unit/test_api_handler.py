@@ -2,11 +2,14 @@ import json
 import pytest
 import boto3
 from botocore.stub import Stubber, ANY
+from botocore.exceptions import ClientError
 from pytest_mock import mocker
 from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timedelta 
-from reminder_app.api_reminder_handler import create_reminder, dynamodb, sfn, ssm, update_reminder, delete_reminder, ack_reminder, list_reminders
-from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
+from reminder_app.api_reminder_handler import create_reminder, dynamodb, sfn, ssm, config, update_reminder, delete_reminder, ack_reminder, list_reminders, create_reminders_batch, get_reminder_summary, idempotency_store, reminders, export_reminders
+from reminder_app.archive_store import LocalArchiveStore
+from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr, isostr_to_epoch
+from reminder_app.idempotency import IdempotencyStore, IdempotencyInProgress, request_hash
 
 @pytest.fixture(autouse=True)
 def dynamodb_stub():
@@ -14,6 +17,16 @@ def dynamodb_stub():
         yield stubber
         stubber.assert_no_pending_responses()
 
+@pytest.fixture(autouse=True)
+def config_cache():
+    config.invalidate()
+    yield config
+
+@pytest.fixture(autouse=True)
+def reminder_cache():
+    reminders.clear()
+    yield reminders
+
 def tests_create_reminder(dynamodb_stub):
     stubber1 = Stubber(ssm)
     stubber1.add_response('get_parameters_by_path',
@@ -53,6 +66,7 @@ def tests_create_reminder(dynamodb_stub):
                             'to_address': 'shail@gmail.com',
                             'type': 'Email'},
                             'notify_date_time': ANY,
+                            'due_at': isostr_to_epoch(time_In_Future_By_10_mins),
                     'remind_msg': 'Pay your taxes',
                      'reminder_id': ANY,
                      'retry_count': 0,
@@ -68,6 +82,28 @@ def tests_create_reminder(dynamodb_stub):
         response = create_reminder({u'body': reminder2create.replace('{0}',time_In_Future_By_10_mins)}, 'context')  
     assert response == {'body': ANY, 'statusCode': 200}
 
+def tests_create_reminder_not_an_object(dynamodb_stub):
+    for body in ('[]', '"reminder"', 'null'):
+        event = {u'body': body, u'headers': {'idempotency-key': 'abc'}}
+        assert create_reminder(event, 'context')['statusCode'] == 400
+    dynamodb_stub.assert_no_pending_responses()
+
+def tests_create_reminder_failed_write_starts_no_execution(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/min_delay_param","Value": "300"},{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    #No start_execution is stubbed - calling it would fail the test with another error
+    stubber_sfn = Stubber(sfn)
+    dynamodb_stub.add_client_error('put_item', service_error_code='ProvisionedThroughputExceededException', http_status_code=400)
+
+    reminder = {"user_id":"1", "notify_date_time":datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10)),
+        "remind_msg":"Pay your taxes", "notify_by":{"type":"SMS", "phone_number":"+1-123-456-7890"}}
+    with stubber_ssm, stubber_sfn:
+        with pytest.raises(ClientError):
+            create_reminder({u'body': json.dumps(reminder)}, 'context')
+
 def tests_update_reminder(dynamodb_stub):
     stubber2 = Stubber(ssm)
     stubber2.add_response('get_parameters_by_path',
@@ -76,6 +112,12 @@ def tests_update_reminder(dynamodb_stub):
         {'Path': '/test-app/test', 'Recursive': False})
     stubber2.activate()
 
+    #The step function is replaced by one waking at the new time
+    stubber_sfn = Stubber(sfn)
+    stubber_sfn.add_response('start_execution',
+        {'executionArn': 'NEW_ARN','startDate': datetime.utcnow()},
+        {'stateMachineArn':'test-stepfunction-arn', 'name' : ANY, 'input': ANY})
+
     time_In_Future_By_10_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
 
     print("Scheduling for ",time_In_Future_By_10_mins)
@@ -97,25 +139,35 @@ def tests_update_reminder(dynamodb_stub):
     expectedParams = { 
         u'Key': {'reminder_id': '2', 'user_id': '1'},
         u'TableName': u'test-stack-RemindersTable',
-        u'UpdateExpression': u'SET notify_date_time= :notify_date_time, updated_at= :updated_at, remind_msg= :remind_msg',
+        u'UpdateExpression': u'SET notify_date_time= :notify_date_time, due_at= :due_at, updated_at= :updated_at, remind_msg= :remind_msg, execution_arn= :execution_arn',
         u'ExpressionAttributeValues': {
             u':notify_date_time': ANY, 
+            u':due_at': isostr_to_epoch(time_In_Future_By_10_mins),
             u':remind_msg': u'Pay your taxes in the morning',
-            U':updated_at' : ANY
-            }
+            U':updated_at' : ANY,
+            u':execution_arn': u'NEW_ARN'
+            },
+        u'ConditionExpression': Attr('reminder_id').exists(),
+        u'ReturnValues': u'ALL_OLD'
         }
     
-    stubbed_response = {U'Attributes' :{ u'string': {"S": "string"}}}
+    stubbed_response = {U'Attributes' :{ u'string': {"S": "string"}, u'execution_arn': {"S": "OLD_ARN"}}}
         
     dynamodb_stub.add_response('update_item', stubbed_response, expectedParams)
+    stubber_sfn.add_response('stop_execution', {'stopDate': datetime.utcnow()}, {'executionArn': 'OLD_ARN', 'cause': 'Reminder rescheduled'})
 
     reminderIdParam = {
         "reminder_id":"2",
     }
 
-    with stubber2:
+    with stubber2, stubber_sfn:
         response = update_reminder({u'pathParameters': reminderIdParam,u'body': reminder2update.replace('{0}',time_In_Future_By_10_mins)}, 'context')  
-    assert response == {'body': '{"Attributes": {"string": "string"}}', 'statusCode': 200}
+        stubber_sfn.assert_no_pending_responses()
+    assert response['statusCode'] == 200
+    attributes = json.loads(response['body'])['Attributes']
+    assert attributes['string'] == 'string'
+    assert attributes['execution_arn'] == 'NEW_ARN'
+    assert attributes['remind_msg'] == 'Pay your taxes in the morning'
 
 # pathParameters is a dictionary
 def tests_delete_reminder(dynamodb_stub):
@@ -126,7 +178,8 @@ def tests_delete_reminder(dynamodb_stub):
 
     #Add delete item response
     dynamodb_stub.add_response('delete_item', {}, 
-    {'Key': {'reminder_id': '3', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable'})
+    {'Key': {'reminder_id': '3', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable',
+    'ConditionExpression': Attr('reminder_id').exists(), 'ReturnValues': 'ALL_OLD'})
     reminder2delete = {
         "reminder_id":"3",
     }
@@ -146,10 +199,13 @@ def tests_ack_reminder(dynamodb_stub):
 
     expectedParams = {
             'ExpressionAttributeNames': {'#st': 'state'},
-            'ExpressionAttributeValues': {':state': 'Acknowledged', ':updated_at': ANY, ':to_execute': 'false'},
+            'ExpressionAttributeValues': {':state': 'Acknowledged', ':updated_at': ANY, ':to_execute': 'false', ':expires_at': ANY},
             'Key': {'reminder_id': '3', 'user_id': '1'},
             'TableName': 'test-stack-RemindersTable',
-            'UpdateExpression': 'SET #st= :state, updated_at= :updated_at, to_execute= :to_execute'
+            #Finished reminders are deleted by DynamoDB TTL
+            'UpdateExpression': 'SET #st= :state, updated_at= :updated_at, to_execute= :to_execute, expires_at= :expires_at',
+            'ConditionExpression': Attr('reminder_id').exists(),
+            'ReturnValues': 'ALL_NEW'
            }
     
     dynamodb_stub.add_response('update_item', {}, expectedParams)
@@ -157,6 +213,80 @@ def tests_ack_reminder(dynamodb_stub):
     response = ack_reminder({u'pathParameters': reminder2ack}, 'context')  
     assert response == {'body': '{}', 'statusCode': 200}
 
+# With user_id supplied update, delete and ack are a single conditional write - no query is stubbed
+def tests_update_reminder_failed_write_stops_new_execution(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/min_delay_param","Value": "300"},{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    stubber_sfn = Stubber(sfn)
+    stubber_sfn.add_response('start_execution', {'executionArn': 'NEW_ARN','startDate': datetime.utcnow()})
+    stubber_sfn.add_response('stop_execution', {'stopDate': datetime.utcnow()}, {'executionArn': 'NEW_ARN', 'cause': 'Reminder not updated'})
+    dynamodb_stub.add_client_error('update_item', service_error_code='ProvisionedThroughputExceededException', http_status_code=400)
+
+    time_In_Future_By_10_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
+    reminder2update = {"user_id":"1", "notify_date_time":time_In_Future_By_10_mins, "remind_msg":"Pay your taxes"}
+    with stubber_ssm, stubber_sfn:
+        with pytest.raises(ClientError):
+            update_reminder({u'pathParameters': {"reminder_id":"2"}, u'body': json.dumps(reminder2update)}, 'context')
+        stubber_sfn.assert_no_pending_responses()
+
+def tests_update_reminder_single_write(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/min_delay_param","Value": "300"},{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    stubber_sfn = Stubber(sfn)
+    stubber_sfn.add_response('start_execution', {'executionArn': 'NEW_ARN','startDate': datetime.utcnow()})
+
+    time_In_Future_By_10_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
+    reminder2update = {"user_id":"1", "notify_date_time":time_In_Future_By_10_mins, "remind_msg":"Pay your taxes"}
+
+    dynamodb_stub.add_response('update_item',
+        {U'Attributes': {'reminder_id': {"S":"2"}, 'user_id': {"S":"1"}, 'retry_count': {"N":"0"}}},
+        {'Key': {'reminder_id': '2', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable',
+        'UpdateExpression': ANY, 'ExpressionAttributeValues': ANY,
+        'ConditionExpression': Attr('reminder_id').exists(), 'ReturnValues': 'ALL_OLD'})
+
+    with stubber_ssm, stubber_sfn:
+        response = update_reminder({u'pathParameters': {"reminder_id":"2"}, u'body': json.dumps(reminder2update)}, 'context')
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['Attributes']['retry_count'] == 0
+
+def tests_delete_reminder_single_write(dynamodb_stub):
+    dynamodb_stub.add_response('delete_item', {U'Attributes': {'reminder_id': {"S":"3"}, 'user_id': {"S":"1"}}},
+        {'Key': {'reminder_id': '3', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable',
+        'ConditionExpression': Attr('reminder_id').exists(), 'ReturnValues': 'ALL_OLD'})
+
+    response = delete_reminder({u'pathParameters': {"reminder_id":"3"}, u'queryStringParameters': {"user_id":"1"}}, 'context')
+    assert response == {'body': '{"Attributes":{"reminder_id":"3","user_id":"1"}}', 'statusCode': 200}
+
+def tests_ack_reminder_single_write(dynamodb_stub):
+    dynamodb_stub.add_response('update_item', {U'Attributes': {'reminder_id': {"S":"3"}, 'state': {"S":"Acknowledged"}}},
+        {'Key': {'reminder_id': '3', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable',
+        'UpdateExpression': 'SET #st= :state, updated_at= :updated_at, to_execute= :to_execute, expires_at= :expires_at',
+        'ExpressionAttributeNames': {'#st': 'state'}, 'ExpressionAttributeValues': ANY,
+        'ConditionExpression': Attr('reminder_id').exists(), 'ReturnValues': 'ALL_NEW'})
+
+    response = ack_reminder({u'pathParameters': {"reminder_id":"3"}, u'queryStringParameters': {"user_id":"1"}}, 'context')
+    assert response == {'body': '{"Attributes":{"reminder_id":"3","state":"Acknowledged"}}', 'statusCode': 200}
+
+def tests_ack_reminder_not_found(dynamodb_stub):
+    dynamodb_stub.add_client_error('update_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+
+    response = ack_reminder({u'pathParameters': {"reminder_id":"4"}, u'queryStringParameters': {"user_id":"1"}}, 'context')
+    assert response == {'body': 'Reminder not found', 'statusCode': 404}
+
+def tests_delete_reminder_not_found(dynamodb_stub):
+    dynamodb_stub.add_client_error('delete_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+
+    response = delete_reminder({u'pathParameters': {"reminder_id":"4"}, u'queryStringParameters': {"user_id":"1"}}, 'context')
+    assert response == {'body': 'Reminder not found', 'statusCode': 404}
+
 def tests_list_reminders(dynamodb_stub):
     user2list = {"pathParameters":{"user_id":"123"}}
 
@@ -173,10 +303,309 @@ def tests_list_reminders(dynamodb_stub):
     
     expectedParams = {
         'IndexName': 'UserIdIndex',
-        'KeyConditionExpression': Key('user_id').eq('123'), 'TableName': 'test-stack-RemindersTable'}
+        'KeyConditionExpression': Key('user_id').eq('123'), 'TableName': 'test-stack-RemindersTable', 'Limit': 50}
     
     dynamodb_stub.add_response('query', {U'Items':reminders2fetch}, expectedParams)
 
+    #Items come back from BatchGetItem in any order
+    hydrated = [
+        {"user_id":{"S":"123"}, "reminder_id":{"S":"2"}, "remind_msg":{"S":"Pay your taxes"}, "retry_count":{"N":"1"}},
+        {"user_id":{"S":"123"}, "reminder_id":{"S":"1"}, "remind_msg":{"S":"File your taxes"}, "retry_count":{"N":"0"}},
+    ]
+    expectedBatchParams = {'RequestItems': {'test-stack-RemindersTable': {'Keys': [
+        {'reminder_id': '1', 'user_id': '123'}, {'reminder_id': '2', 'user_id': '123'}]}}}
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': hydrated}}, expectedBatchParams)
+
     response = list_reminders(user2list, 'context')  
 
-    assert response == {'body': '[{"user_id": "123", "reminder_id": "1"}, {"user_id": "123", "reminder_id": "2"}]', 'statusCode': 200}
+    assert response == {'body': '[{"user_id":"123","reminder_id":"1","remind_msg":"File your taxes","retry_count":0},'
+        '{"user_id":"123","reminder_id":"2","remind_msg":"Pay your taxes","retry_count":1}]', 'statusCode': 200}
+
+def tests_list_reminders_paginated(dynamodb_stub):
+    last_key = lambda: {"user_id":{"S":"123"}, "reminder_id":{"S":"1"}}
+    dynamodb_stub.add_response('query', {U'Items':[last_key()], U'LastEvaluatedKey': last_key()},
+        {'IndexName': 'UserIdIndex', 'KeyConditionExpression': Key('user_id').eq('123'),
+        'TableName': 'test-stack-RemindersTable', 'Limit': 1})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [last_key()]}},
+        {'RequestItems': ANY})
+
+    response = list_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"limit":"1"}}, 'context')
+    assert response['body'] == '[{"user_id":"123","reminder_id":"1"}]'
+    cursor = response['headers']['X-Next-Cursor']
+
+    dynamodb_stub.add_response('query', {U'Items':[]},
+        {'IndexName': 'UserIdIndex', 'KeyConditionExpression': Key('user_id').eq('123'),
+        'TableName': 'test-stack-RemindersTable', 'Limit': 1, 'ExclusiveStartKey': {'user_id': '123', 'reminder_id': '1'}})
+
+    response = list_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"limit":"1", "cursor": cursor}}, 'context')
+    assert response == {'body': '[]', 'statusCode': 200}
+
+    #A cursor can not be replayed against another user's listing
+    response = list_reminders({"pathParameters":{"user_id":"456"}, "queryStringParameters":{"cursor": cursor}}, 'context')
+    assert response['statusCode'] == 400
+
+def tests_list_reminders_due_range(dynamodb_stub):
+    last_key = lambda: {"user_id":{"S":"123"}, "reminder_id":{"S":"1"}, "due_at":{"N":"1577880000"}}
+    dynamodb_stub.add_response('query', {U'Items':[last_key()], U'LastEvaluatedKey': last_key()},
+        {'IndexName': 'UserDueAtIndex',
+        'KeyConditionExpression': Key('user_id').eq('123') & Key('due_at').between(1577880000, 1577883600),
+        'TableName': 'test-stack-RemindersTable', 'Limit': 1})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [last_key()]}},
+        {'RequestItems': {'test-stack-RemindersTable': {'Keys': [{'reminder_id': '1', 'user_id': '123'}]}}})
+
+    due_range = {"due_from": "2020-01-01T12:00:00.000000Z", "due_to": "2020-01-01T13:00:00.000000Z"}
+    response = list_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":dict(due_range, limit="1")}, 'context')
+    assert response['body'] == '[{"user_id":"123","reminder_id":"1","due_at":1577880000}]'
+    cursor = response['headers']['X-Next-Cursor']
+
+    #The cursor of a due range listing does not continue a full listing
+    response = list_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"cursor": cursor}}, 'context')
+    assert response['statusCode'] == 400
+    response = list_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"due_from": "tomorrow"}}, 'context')
+    assert response == {'body': 'Invalid due_from or due_to', 'statusCode': 400}
+
+def stub_export_pages(dynamodb_stub, pages=2):
+    #Two UserIdIndex pages, each hydrated with its own BatchGetItem - reminder 2 was deleted in between
+    page = lambda ids: [{"user_id":{"S":"123"}, "reminder_id":{"S":reminder_id}} for reminder_id in ids]
+    dynamodb_stub.add_response('query', {U'Items':page(['1', '2']), U'LastEvaluatedKey': page(['2'])[0]},
+        {'IndexName': 'UserIdIndex', 'KeyConditionExpression': Key('user_id').eq('123'),
+        'TableName': 'test-stack-RemindersTable', 'Limit': 100})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        {"user_id":{"S":"123"}, "reminder_id":{"S":"1"}, "state":{"S":"Acknowledged"}, "remind_msg":{"S":"File, your taxes"},
+        "retry_count":{"N":"0"}, "notify_by":{"M":{"type":{"S":"SMS"}, "phone_number":{"S":"+15555550100"}}}}]}},
+        {'RequestItems': {'test-stack-RemindersTable': {'Keys': [{'reminder_id': '1', 'user_id': '123'}, {'reminder_id': '2', 'user_id': '123'}]}}})
+    if pages == 1:
+        return
+    dynamodb_stub.add_response('query', {U'Items':page(['3'])},
+        {'IndexName': 'UserIdIndex', 'KeyConditionExpression': Key('user_id').eq('123'),
+        'TableName': 'test-stack-RemindersTable', 'Limit': 100, 'ExclusiveStartKey': {'user_id': '123', 'reminder_id': '2'}})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        {"user_id":{"S":"123"}, "reminder_id":{"S":"3"}, "state":{"S":"Pending"}, "remind_msg":{"S":"Pay your taxes"},
+        "retry_count":{"N":"1"}}]}},
+        {'RequestItems': {'test-stack-RemindersTable': {'Keys': [{'reminder_id': '3', 'user_id': '123'}]}}})
+
+def tests_export_reminders(dynamodb_stub):
+    stub_export_pages(dynamodb_stub)
+    response = export_reminders({"pathParameters":{"user_id":"123"}}, 'context')
+    assert response['statusCode'] == 200
+    assert response['headers']['Content-Type'] == 'application/x-ndjson'
+    assert response['headers']['Content-Disposition'].startswith('attachment; filename="123-')
+    assert [json.loads(line)['reminder_id'] for line in response['body'].splitlines()] == ['1', '3']
+    assert json.loads(response['body'].splitlines()[0])['notify_by'] == {'type': 'SMS', 'phone_number': '+15555550100'}
+
+    stub_export_pages(dynamodb_stub)
+    response = export_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"format":"csv"}}, 'context')
+    assert response['headers']['Content-Type'] == 'text/csv'
+    assert response['body'].splitlines() == [
+        'reminder_id,user_id,state,notify_date_time,due_at,remind_msg,retry_count,notify_by.type,notify_by.phone_number,'
+            'notify_by.to_address,notify_by.from_address,updated_at,last_sent_at',
+        '1,123,Acknowledged,,,"File, your taxes",0,SMS,+15555550100,,,,',
+        '3,123,Pending,,,Pay your taxes,1,,,,,,']
+
+    response = export_reminders({"pathParameters":{"user_id":"123"}, "queryStringParameters":{"format":"xml"}}, 'context')
+    assert response == {'statusCode': 400, 'body': 'format should be one of csv, ndjson'}
+
+def tests_export_reminders_over_inline_limit(dynamodb_stub, monkeypatch, tmp_path):
+    monkeypatch.setattr('reminder_app.api_reminder_handler.EXPORT_INLINE_MAX_BYTES', 100)
+    monkeypatch.setattr('reminder_app.api_reminder_handler.export_store', LocalArchiveStore(str(tmp_path)))
+    stub_export_pages(dynamodb_stub)
+    response = export_reminders({"pathParameters":{"user_id":"123"}}, 'context')
+    assert response['statusCode'] == 303
+    url = response['headers']['Location']
+    assert json.loads(response['body'])['url'] == url and url.startswith('file://' + str(tmp_path))
+    with open(url[len('file://'):]) as f:
+        assert [json.loads(line)['reminder_id'] for line in f] == ['1', '3']
+
+    #Without an export store a large export is refused as soon as it is over the limit rather than held in memory
+    monkeypatch.setattr('reminder_app.api_reminder_handler.export_store', None)
+    stub_export_pages(dynamodb_stub, pages=1)
+    response = export_reminders({"pathParameters":{"user_id":"123"}}, 'context')
+    assert response == {'statusCode': 413, 'body': 'Export too large'}
+
+def tests_create_reminders_batch(dynamodb_stub, mocker):
+    mocker.patch('reminder_app.api_reminder_handler.time.sleep')
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/min_delay_param","Value": "300"},{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    stubber_sfn = Stubber(sfn)
+    for i in range(28):
+        stubber_sfn.add_response('start_execution',
+            {'executionArn': 'SOME_ARN','startDate': datetime.utcnow()},
+            {'stateMachineArn':'test-stepfunction-arn', 'name' : ANY, 'input': ANY})
+
+    time_In_Future_By_10_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
+    reminder = {
+        "user_id":"1",
+        "notify_date_time":time_In_Future_By_10_mins,
+        "remind_msg":"Pay your taxes",
+        "notify_by":{"type":"SMS", "phone_number":"+1-123-456-7890"}
+    }
+    reminders2create = [dict(reminder) for i in range(30)]
+    #One reminder is missing its message and one is in the past
+    del reminders2create[3]['remind_msg']
+    reminders2create[7]['notify_date_time'] = datetime_to_isostr(datetime.utcnow() - timedelta(minutes = 10))
+
+    #First chunk of 25 has one unprocessed item which is retried, second chunk has the remaining 3
+    unprocessed = {'test-stack-RemindersTable': [{'PutRequest': {'Item': {'reminder_id': {'S': 'x'}, 'user_id': {'S': '1'}}}}]}
+    dynamodb_stub.add_response('batch_write_item', {'UnprocessedItems': unprocessed}, {'RequestItems': ANY})
+    dynamodb_stub.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': ANY})
+    dynamodb_stub.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': ANY})
+
+    with stubber_ssm, stubber_sfn:
+        response = create_reminders_batch({u'body': json.dumps(reminders2create)}, 'context')
+        stubber_ssm.assert_no_pending_responses()
+        stubber_sfn.assert_no_pending_responses()
+    assert response['statusCode'] == 200
+    results = json.loads(response['body'])
+    assert [result['index'] for result in results] == list(range(30))
+    assert [result['index'] for result in results if result['status'] == 'invalid'] == [3, 7]
+    assert len([result for result in results if result['status'] == 'created']) == 28
+
+def tests_create_reminders_batch_too_many(dynamodb_stub):
+    response = create_reminders_batch({u'body': json.dumps([{}] * 1001)}, 'context')
+    assert response['statusCode'] == 400
+
+def tests_get_reminder_summary(dynamodb_stub):
+    expectedParams = {'TableName': 'test-stack-ReminderSummaryTable', 'Key': {'user_id': '1'}}
+    summary = {
+        'user_id': {'S': '1'},
+        'count_Pending': {'N': '2'},
+        'count_Acknowledged': {'N': '1'},
+        #A state no reminder is in any more
+        'count_Unacknowledged': {'N': '0'},
+        'total': {'N': '3'},
+        'updated_at': {'N': '1577880000000'}
+    }
+    dynamodb_stub.add_response('get_item', {'Item': summary}, expectedParams)
+    #The next reminder due is the first pending one of UserDueAtIndex from now
+    keys = [{'user_id': {'S': '1'}, 'reminder_id': {'S': reminder_id}} for reminder_id in ('a', 'b')]
+    dynamodb_stub.add_response('query', {'Items': keys}, {'TableName': 'test-stack-RemindersTable',
+        'IndexName': 'UserDueAtIndex', 'KeyConditionExpression': ANY, 'Limit': 25})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        dict(keys[0], state={'S': 'Acknowledged'}, notify_date_time={'S': '2020-01-01T11:00:00.000000Z'}),
+        dict(keys[1], state={'S': 'Pending'}, notify_date_time={'S': '2020-01-01T12:00:00.000000Z'})
+    ]}}, {'RequestItems': {'test-stack-RemindersTable': {'Keys': [{'reminder_id': 'a', 'user_id': '1'}, {'reminder_id': 'b', 'user_id': '1'}]}}})
+    dynamodb_stub.add_response('get_item', {}, dict(expectedParams, Key={'user_id': '2'}))
+
+    response = get_reminder_summary({'pathParameters': {'user_id': '1'}}, 'context')
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'user_id': '1', 'counts': {'Pending': 2, 'Acknowledged': 1}, 'total': 3,
+        'next_notify_date_time': '2020-01-01T12:00:00.000000Z', 'updated_at': 1577880000000}
+
+    #A user without reminders has an empty summary, without looking for their next reminder
+    response = get_reminder_summary({'pathParameters': {'user_id': '2'}}, 'context')
+    assert json.loads(response['body']) == {'user_id': '2', 'counts': {}, 'total': 0, 'next_notify_date_time': None,
+        'updated_at': None}
+
+def tests_create_reminder_idempotency_key(dynamodb_stub):
+    idempotency_store.clear_cache()
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/min_delay_param","Value": "300"},{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    stubber_sfn = Stubber(sfn)
+    stubber_sfn.add_response('start_execution',
+        {'executionArn': 'SOME_ARN','startDate': datetime.utcnow()},
+        {'stateMachineArn':'test-stepfunction-arn', 'name' : ANY, 'input': ANY})
+
+    reminder = {
+        "user_id":"1",
+        "notify_date_time":datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10)),
+        "remind_msg":"Pay your taxes",
+        "notify_by":{"type":"SMS", "phone_number":"+1-123-456-7890"}
+    }
+    event = {u'body': json.dumps(reminder), u'headers': {'idempotency-key': 'abc'}}
+
+    #Claim the key, create the reminder then store the response on the record
+    dynamodb_stub.add_response('put_item', {}, {'TableName': 'test-stack-IdempotencyTable', 'Item': ANY, 'ConditionExpression': ANY})
+    dynamodb_stub.add_response('put_item', {}, {'TableName': 'test-stack-RemindersTable', 'Item': ANY})
+    dynamodb_stub.add_response('update_item', {}, {
+        'TableName': 'test-stack-IdempotencyTable',
+        'Key': {'idempotency_key': '1#abc'},
+        'UpdateExpression': 'SET #status= :status, response= :response, expires_at= :expires_at',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {':status': 'completed', ':response': ANY, ':expires_at': ANY}
+    })
+
+    with stubber_ssm, stubber_sfn:
+        first = create_reminder(event, 'context')
+        #Served from the container's cache - no further DynamoDB or Step Functions calls are stubbed
+        assert create_reminder(event, 'context') == first
+        stubber_sfn.assert_no_pending_responses()
+    assert first['statusCode'] == 200
+
+    #Another container finds the completed record
+    idempotency_store.clear_cache()
+    dynamodb_stub.add_client_error('put_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+    dynamodb_stub.add_response('get_item', {'Item': {
+        'idempotency_key': {'S': '1#abc'},
+        'status': {'S': 'completed'},
+        'request_hash': {'S': request_hash(reminder)},
+        'response': {'S': json.dumps(first)},
+        'expires_at': {'N': '9999999999'}
+    }}, {'TableName': 'test-stack-IdempotencyTable', 'Key': {'idempotency_key': '1#abc'}, 'ConsistentRead': True})
+    assert create_reminder(event, 'context') == first
+
+    #The same key with a different reminder is rejected
+    changed = dict(event, body=json.dumps(dict(reminder, remind_msg='Pay your bills')))
+    assert create_reminder(changed, 'context')['statusCode'] == 422
+
+def tests_idempotency_claim_is_a_short_lease(dynamodb_stub):
+    store = IdempotencyStore(idempotency_store.table, ttl_seconds=86400, lease_seconds=30, clock=lambda: 1000)
+    claim = {'TableName': 'test-stack-IdempotencyTable', 'ConditionExpression': ANY,
+        'Item': {'idempotency_key': 'k', 'status': 'in_progress', 'request_hash': 'h', 'expires_at': 1030}}
+
+    #A request that timed out holds the key until its lease ends
+    dynamodb_stub.add_client_error('put_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+    dynamodb_stub.add_response('get_item', {'Item': {'idempotency_key': {'S': 'k'}, 'status': {'S': 'in_progress'},
+        'request_hash': {'S': 'h'}, 'expires_at': {'N': '1010'}}})
+    with pytest.raises(IdempotencyInProgress):
+        store.run('k', 'h', lambda: {'statusCode': 200})
+
+    #The full TTL is only set once the response is stored
+    dynamodb_stub.add_response('put_item', {}, claim)
+    dynamodb_stub.add_response('update_item', {}, {
+        'TableName': 'test-stack-IdempotencyTable',
+        'Key': {'idempotency_key': 'k'},
+        'UpdateExpression': 'SET #status= :status, response= :response, expires_at= :expires_at',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {':status': 'completed', ':response': ANY, ':expires_at': 87400}
+    })
+    assert store.run('k', 'h', lambda: {'statusCode': 200}) == {'statusCode': 200}
+
+def tests_idempotency_failed_completion_still_returns_response(dynamodb_stub):
+    store = IdempotencyStore(idempotency_store.table, lease_seconds=30, clock=lambda: 1000, complete_attempts=2)
+    runs = []
+    def run():
+        runs.append(1)
+        return {'statusCode': 200}
+
+    dynamodb_stub.add_response('put_item', {})
+    dynamodb_stub.add_client_error('update_item', service_error_code='ProvisionedThroughputExceededException', http_status_code=400)
+    dynamodb_stub.add_client_error('update_item', service_error_code='ProvisionedThroughputExceededException', http_status_code=400)
+    assert store.run('k', 'h', run) == {'statusCode': 200}
+    dynamodb_stub.assert_no_pending_responses()
+
+    #The response is still remembered so a repeat in this container does not run the request again
+    assert store.run('k', 'h', run) == {'statusCode': 200}
+    assert len(runs) == 1
+
+def tests_ack_and_delete_stop_execution(dynamodb_stub, monkeypatch):
+    stubber_sfn = Stubber(sfn)
+    dynamodb_stub.add_response('update_item', {U'Attributes': {'reminder_id': {"S":"3"}, 'execution_arn': {"S":"ARN_3"}}})
+    stubber_sfn.add_response('stop_execution', {'stopDate': datetime.utcnow()}, {'executionArn': 'ARN_3', 'cause': 'Reminder acknowledged'})
+
+    #Reminders created in bulk have no execution_arn - their first execution is stopped by name
+    monkeypatch.setenv('STEP_FUNCTION_ARN', 'arn:aws:states:us-east-1:123456789012:stateMachine:Reminder-StateMachine')
+    dynamodb_stub.add_response('delete_item', {U'Attributes': {'reminder_id': {"S":"4"}, 'user_id': {"S":"1"}}})
+    stubber_sfn.add_response('stop_execution', {'stopDate': datetime.utcnow()},
+        {'executionArn': 'arn:aws:states:us-east-1:123456789012:execution:Reminder-StateMachine:4_reminder_fn', 'cause': 'Reminder deleted'})
+
+    with stubber_sfn:
+        assert ack_reminder({u'pathParameters': {"reminder_id":"3"}, u'queryStringParameters': {"user_id":"1"}}, 'context')['statusCode'] == 200
+        assert delete_reminder({u'pathParameters': {"reminder_id":"4"}, u'queryStringParameters': {"user_id":"1"}}, 'context')['statusCode'] == 200
+        stubber_sfn.assert_no_pending_responses()
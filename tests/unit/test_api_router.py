@@ -0,0 +1,56 @@
+import os
+import pytest
+from botocore.stub import Stubber, ANY
+from reminder_app.api_reminder_handler import dynamodb, reminders
+from reminder_app.api_router import ROUTES, route
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'template.yaml')
+
+@pytest.fixture(autouse=True)
+def dynamodb_stub():
+    with Stubber(dynamodb.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+@pytest.fixture(autouse=True)
+def reminder_cache():
+    reminders.clear()
+    yield reminders
+
+def api_event(resource, method, path, query_string=None):
+    return {'resource': resource, 'httpMethod': method, 'pathParameters': path, 'queryStringParameters': query_string, 'body': None}
+
+def tests_route_dispatches_on_resource_and_method(dynamodb_stub):
+    dynamodb_stub.add_response('update_item', {U'Attributes': {'reminder_id': {"S":"3"}, 'state': {"S":"Acknowledged"}}},
+        {'Key': {'reminder_id': '3', 'user_id': '1'}, 'TableName': 'test-stack-RemindersTable', 'UpdateExpression': ANY,
+        'ExpressionAttributeNames': ANY, 'ExpressionAttributeValues': ANY, 'ConditionExpression': ANY, 'ReturnValues': 'ALL_NEW'})
+    response = route(api_event('/ack/{reminder_id}', 'GET', {'reminder_id': '3'}, {'user_id': '1'}), 'context')
+    assert response == {'body': '{"Attributes":{"reminder_id":"3","state":"Acknowledged"}}', 'statusCode': 200}
+
+def tests_route_unknown():
+    response = route(api_event('/ack/{reminder_id}', 'POST', {'reminder_id': '3'}), 'context')
+    assert response == {'statusCode': 405, 'headers': {'Allow': 'GET'}, 'body': 'Method not allowed'}
+    assert route(api_event('/hello', 'GET', None), 'context') == {'statusCode': 404, 'body': 'Route not found'}
+
+# Every API event of the function per route deployment has a route, and the single function serves all of them
+def tests_routes_match_template():
+    yaml = pytest.importorskip('yaml')
+    class TemplateLoader(yaml.SafeLoader):
+        pass
+    #CloudFormation short form functions (!Ref, !GetAtt...) are not needed here
+    TemplateLoader.add_multi_constructor('!', lambda loader, suffix, node: None)
+    with open(TEMPLATE) as f:
+        resources = yaml.load(f, Loader=TemplateLoader)['Resources']
+
+    def api_events(name):
+        events = resources[name]['Properties'].get('Events') or {}
+        return {(event['Properties']['Path'], event['Properties']['Method'].upper()): resources[name]['Properties']['Handler']
+            for event in events.values() if event['Type'] == 'Api'}
+
+    per_route = {}
+    for name, resource in resources.items():
+        if resource['Type'] == 'AWS::Serverless::Function' and name != 'ApiFunction':
+            per_route.update(api_events(name))
+    assert {key: 'api_reminder_handler.' + handler.__name__ for key, handler in ROUTES.items()} == per_route
+    assert set(api_events('ApiFunction')) == set(ROUTES)
+    assert set(api_events('ApiFunction').values()) == {'api_router.route'}
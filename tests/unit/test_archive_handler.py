@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import boto3
+import pytest
+from botocore.stub import Stubber
+from reminder_app.archive_reminder_handler import archive, load_checkpoint, ARCHIVE_AFTER_SECONDS, ARCHIVE_INTERVAL_SECONDS
+from reminder_app.archive_store import LocalArchiveStore, S3ArchiveStore
+from reminder_app.reminder_repository import InMemoryReminderRepository
+
+NOW_MS = 1600000000000
+OLD = NOW_MS - ARCHIVE_AFTER_SECONDS * 1000 - 1
+
+def make_reminder(reminder_id, state='Acknowledged', updated_at=OLD):
+    return {'reminder_id': reminder_id, 'user_id': '1', 'state': state, 'updated_at': updated_at, 'retry_count': 1}
+
+def archived(directory):
+    lines = []
+    for root, _, files in os.walk(os.path.join(directory, 'runs')):
+        for name in files:
+            with gzip.open(os.path.join(root, name), 'rt') as f:
+                lines.extend(json.loads(line) for line in f)
+    return sorted(item['reminder_id'] for item in lines)
+
+@pytest.fixture
+def table():
+    return InMemoryReminderRepository(
+        [make_reminder('acked-' + str(i)) for i in range(15)] +
+        [make_reminder('unacked-' + str(i), state='Unacknowledged') for i in range(5)] +
+        [make_reminder('recent', updated_at=NOW_MS), make_reminder('pending', state='Pending')])
+
+def tests_archive_moves_old_finished_reminders(table, tmp_path):
+    store = LocalArchiveStore(str(tmp_path))
+    summary = archive(table, store, NOW_MS, total_segments=3, page_size=4, chunk_items=5)
+    assert summary['complete'] and summary['archived'] == 20 and summary['not_deleted'] == 0
+    assert archived(str(tmp_path)) == sorted(['acked-' + str(i) for i in range(15)] + ['unacked-' + str(i) for i in range(5)])
+    assert sorted(key['reminder_id'] for key in table.query_by_user('1')[0]) == ['pending', 'recent']
+    first_run = load_checkpoint(store)
+    assert first_run['complete'] and first_run['run'] == summary['run']
+
+    #The next run waits for ARCHIVE_INTERVAL_SECONDS
+    assert archive(table, store, NOW_MS + 1000, total_segments=3)['archived'] == 0
+    table.put(make_reminder('later', updated_at=NOW_MS))
+    summary = archive(table, store, NOW_MS + ARCHIVE_AFTER_SECONDS * 1000 + ARCHIVE_INTERVAL_SECONDS * 1000, total_segments=3)
+    assert summary['archived'] == 2 and summary['complete'] and summary['run'] != first_run['run']
+
+def tests_archive_resumes_from_checkpoint(table, tmp_path):
+    store = LocalArchiveStore(str(tmp_path))
+    #Out of time after a few pages
+    pages = []
+    stop = lambda: pages.append(1) or len(pages) > 4
+    summary = archive(table, store, NOW_MS, stop=stop, total_segments=2, page_size=3, chunk_items=100)
+    assert not summary['complete']
+    #Reminders of the pages scanned so far are archived even though their chunk was not full
+    assert 0 < summary['archived'] < 20
+    assert len(archived(str(tmp_path))) == summary['archived']
+
+    resumed = archive(table, store, NOW_MS + 60000, total_segments=2, page_size=3, chunk_items=100)
+    assert resumed['complete'] and resumed['run'] == summary['run']
+    assert summary['archived'] + resumed['archived'] == 20
+    assert len(archived(str(tmp_path))) == 20
+
+def tests_archive_failed_delete_keeps_its_chunk(table, tmp_path):
+    class FailingOnce(InMemoryReminderRepository):
+        failures = 1
+
+        def batch_delete(self, keys):
+            if self.failures:
+                self.failures -= 1
+                raise Exception('BatchWriteItem failed')
+            return super(FailingOnce, self).batch_delete(keys)
+
+    reminders = FailingOnce([table.get(key['reminder_id']) for key in table.query_by_user('1')[0]])
+    store = LocalArchiveStore(str(tmp_path))
+    with pytest.raises(Exception):
+        archive(reminders, store, NOW_MS, total_segments=1, page_size=5, chunk_items=5)
+    #The checkpoint was saved before the delete - the next invocation continues after the stored chunk
+    assert load_checkpoint(store)['segments']['0']['chunks'] == 1
+    assert archive(reminders, store, NOW_MS + 60000, total_segments=1, page_size=5, chunk_items=5)['complete']
+    assert len(archived(str(tmp_path))) == 20
+    #The reminders of the first chunk are still in the table, to be archived again by a later run
+    assert len(reminders.query_by_user('1')[0]) == 7
+
+def tests_archive_failed_checkpoint_rewrites_its_chunk(table, tmp_path):
+    class FailingStore(LocalArchiveStore):
+        failures = 0
+
+        def put(self, key, body):
+            if key == 'checkpoint.json' and self.failures == 1:
+                self.failures -= 1
+                raise Exception('PutObject failed')
+            super(FailingStore, self).put(key, body)
+
+    store = FailingStore(str(tmp_path))
+    archive(table, store, NOW_MS, stop=lambda: True, total_segments=1)
+    #The checkpoint after the first chunk fails to save - nothing of the chunk has been deleted
+    store.failures = 1
+    with pytest.raises(Exception):
+        archive(table, store, NOW_MS + 60000, total_segments=1, page_size=5, chunk_items=5)
+    assert len(table.query_by_user('1')[0]) == 22
+    assert archive(table, store, NOW_MS + 120000, total_segments=1, page_size=5, chunk_items=5)['complete']
+    #The chunk was written again in place with the same reminders - every reminder is archived once
+    assert len(archived(str(tmp_path))) == 20
+    assert len(table.query_by_user('1')[0]) == 2
+
+def tests_s3_store():
+    s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    store = S3ArchiveStore(s3, 'archive-bucket', 'reminders/')
+    with Stubber(s3) as stubber:
+        stubber.add_response('put_object', {}, {'Bucket': 'archive-bucket', 'Key': 'reminders/checkpoint.json', 'Body': b'{}'})
+        stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+        store.put('checkpoint.json', b'{}')
+        assert store.get('checkpoint.json') is None
@@ -0,0 +1,34 @@
+from botocore.stub import Stubber
+from reminder_app import aws_clients
+
+def tests_lazy_client_created_on_first_use():
+    aws_clients.reset()
+    ssm = aws_clients.lazy_client('ssm', region_name='us-east-1')
+    assert aws_clients.created() == []
+
+    ssm.meta
+    assert aws_clients.created() == ['ssm']
+
+def tests_clients_are_shared():
+    aws_clients.reset()
+    first = aws_clients.lazy_client('sns', region_name='us-east-1')
+    second = aws_clients.lazy_client('sns', region_name='us-east-1')
+    assert first._resolve() is second._resolve()
+    assert aws_clients.client('sns', region_name='us-east-1') is first._resolve()
+    #One session backs every client
+    assert aws_clients.client('ses', region_name='us-east-1').meta.events is not None
+    assert len(aws_clients.created()) == 2
+
+def tests_stubber_wraps_lazy_client():
+    aws_clients.reset()
+    sns = aws_clients.lazy_client('sns', region_name='us-east-1')
+    with Stubber(sns) as stubber:
+        stubber.add_response('publish', {"MessageId": "SomeID"}, {'Message': 'Pay your taxes', 'PhoneNumber': '+1-123-456-7890'})
+        assert sns.publish(Message='Pay your taxes', PhoneNumber='+1-123-456-7890') == {"MessageId": "SomeID"}
+
+def tests_lazy_table():
+    aws_clients.reset()
+    table = aws_clients.lazy_table('test-stack-RemindersTable', region_name='us-east-1')
+    assert aws_clients.created() == []
+    assert table.name == 'test-stack-RemindersTable'
+    assert aws_clients.created() == ['dynamodb resource']
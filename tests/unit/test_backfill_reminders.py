@@ -0,0 +1,50 @@
+from reminder_app.backfill_reminders import backfill
+from reminder_app.reminder_repository import InMemoryReminderRepository, FINISHED_REMINDER_TTL_SECONDS
+
+def make_reminder(reminder_id, state='Pending', **attributes):
+    reminder = {
+        'reminder_id': reminder_id,
+        'user_id': '1',
+        'notify_date_time': '2020-01-01T12:00:00.000000Z',
+        'state': state,
+        'updated_at': 1577880000000
+    }
+    reminder.update(attributes)
+    return reminder
+
+# The reminder is changed by the API between the scan and the backfill's update
+class ConcurrentlyUpdated(InMemoryReminderRepository):
+    def scan(self, *args, **kwargs):
+        items, last_evaluated_key = super(ConcurrentlyUpdated, self).scan(*args, **kwargs)
+        for item in items:
+            if item['reminder_id'] == 'changed':
+                super(ConcurrentlyUpdated, self).update({'reminder_id': 'changed', 'user_id': '1'},
+                    {'notify_date_time': '2020-01-02T12:00:00.000000Z', 'due_at': 1577966400})
+        return items, last_evaluated_key
+
+def tests_backfill_adds_missing_attributes():
+    reminders = ConcurrentlyUpdated([
+        make_reminder('old'),
+        make_reminder('new', due_at=1577880000),
+        make_reminder('acked', state='Acknowledged'),
+        make_reminder('expiring', state='Unacknowledged', due_at=1577880000, expires_at=1),
+        make_reminder('changed'),
+        make_reminder('invalid', notify_date_time='tomorrow')
+    ] + [make_reminder(str(i), due_at=1577880000) for i in range(20)])
+
+    counts = backfill(reminders, total_segments=3, page_size=2)
+    assert counts == {'scanned': 26, 'updated': 2, 'changed': 1, 'invalid': 1}
+    assert reminders.get('old')['due_at'] == 1577880000
+    assert 'expires_at' not in reminders.get('old')
+    #The TTL runs from when the reminder finished
+    assert reminders.get('acked')['expires_at'] == 1577880000 + FINISHED_REMINDER_TTL_SECONDS
+    assert reminders.get('expiring')['expires_at'] == 1
+    assert reminders.get('changed')['due_at'] == 1577966400
+
+    #Nothing is left to do on a second run
+    assert backfill(reminders, total_segments=2)['updated'] == 0
+
+def tests_backfill_dry_run_does_not_write():
+    reminders = InMemoryReminderRepository([make_reminder('old')])
+    assert backfill(reminders, total_segments=1, dry_run=True)['updated'] == 1
+    assert 'due_at' not in reminders.get('old')
@@ -0,0 +1,36 @@
+from reminder_app import aws_clients
+from reminder_app.client_config import client_settings
+
+def tests_defaults():
+    settings = client_settings('ssm', environ={})
+    assert settings == {
+        'connect_timeout': 1.0,
+        'read_timeout': 2.0,
+        'retries': {'total_max_attempts': 3, 'mode': 'standard'},
+        'max_pool_connections': 25,
+        'tcp_keepalive': True,
+    }
+
+def tests_global_and_service_overrides():
+    environ = {
+        'CLIENT_READ_TIMEOUT': '1.5',
+        'CLIENT_RETRY_MODE': 'legacy',
+        'CLIENT_SSM_RETRY_MODE': 'adaptive',
+        'CLIENT_SES_READ_TIMEOUT': '4',
+        'CLIENT_STEPFUNCTIONS_MAX_ATTEMPTS': '2',
+    }
+    assert client_settings('ssm', environ)['read_timeout'] == 1.5
+    assert client_settings('ses', environ)['read_timeout'] == 4.0
+    assert client_settings('ses', environ)['retries'] == {'total_max_attempts': 3, 'mode': 'legacy'}
+    assert client_settings('ssm', environ)['retries'] == {'total_max_attempts': 3, 'mode': 'adaptive'}
+    assert client_settings('stepfunctions', environ)['retries'] == {'total_max_attempts': 2, 'mode': 'legacy'}
+
+def tests_registry_applies_config():
+    aws_clients.reset()
+    config = aws_clients.client('sns', region_name='us-east-1').meta.config
+    assert config.connect_timeout == 1.0
+    assert config.read_timeout == 2.0
+    assert config.retries == {'total_max_attempts': 3, 'mode': 'standard'}
+    assert config.tcp_keepalive is True
+    table = aws_clients.lazy_table('test-stack-RemindersTable', region_name='us-east-1')
+    assert table.meta.client.meta.config.max_pool_connections == 25
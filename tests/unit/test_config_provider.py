@@ -0,0 +1,82 @@
+import pytest
+import boto3
+from botocore.stub import Stubber
+from reminder_app.config_provider import ConfigProvider
+
+params_response = {"Parameters":
+    [{ "Name":"/test-app/test/min_delay_param","Value": "300"},
+     { "Name":"/test-app/test/max_delay_param","Value": "5000"},
+     { "Name":"/test-app/test/max_retry_count","Value": "3"}]}
+expectedParams = {'Path': '/test-app/test', 'Recursive': False}
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def ssm_stub():
+    ssm = boto3.client('ssm', region_name='us-east-1')
+    with Stubber(ssm) as stubber:
+        yield ssm, stubber
+        stubber.assert_no_pending_responses()
+
+def tests_loads_once_and_serves_hits(ssm_stub):
+    ssm, stubber = ssm_stub
+    stubber.add_response('get_parameters_by_path', params_response, expectedParams)
+    config = ConfigProvider(ssm, '/test-app/test', ttl_seconds=60, clock=FakeClock())
+
+    assert config.get_int('min_delay_param') == 300
+    assert config.get_int('max_delay_param') == 5000
+    assert config.get_int('max_retry_count') == 3
+    assert config.stats()['misses'] == 1
+    assert config.stats()['hits'] == 2
+
+def tests_follows_next_token(ssm_stub):
+    ssm, stubber = ssm_stub
+    stubber.add_response('get_parameters_by_path',
+        {"Parameters": [{ "Name":"/test-app/test/min_delay_param","Value": "300"}], "NextToken": "page2"},
+        expectedParams)
+    stubber.add_response('get_parameters_by_path',
+        {"Parameters": [{ "Name":"/test-app/test/max_delay_param","Value": "5000"}]},
+        {'Path': '/test-app/test', 'Recursive': False, 'NextToken': 'page2'})
+    config = ConfigProvider(ssm, '/test-app/test', clock=FakeClock())
+
+    assert config.params() == {'min_delay_param': '300', 'max_delay_param': '5000'}
+
+def tests_reloads_inline_after_ttl(ssm_stub):
+    ssm, stubber = ssm_stub
+    clock = FakeClock()
+    stubber.add_response('get_parameters_by_path', params_response, expectedParams)
+    stubber.add_response('get_parameters_by_path',
+        {"Parameters": [{ "Name":"/test-app/test/max_retry_count","Value": "5"}]}, expectedParams)
+    config = ConfigProvider(ssm, '/test-app/test', ttl_seconds=60, background_refresh=False, clock=clock)
+
+    assert config.get_int('max_retry_count') == 3
+    clock.now += 61
+    assert config.get_int('max_retry_count') == 5
+    assert config.stats()['misses'] == 2
+
+def tests_falls_back_to_last_good_values_on_error(ssm_stub):
+    ssm, stubber = ssm_stub
+    clock = FakeClock()
+    stubber.add_response('get_parameters_by_path', params_response, expectedParams)
+    stubber.add_client_error('get_parameters_by_path', service_error_code='ThrottlingException', http_status_code=400)
+    config = ConfigProvider(ssm, '/test-app/test', ttl_seconds=60, background_refresh=False, clock=clock)
+
+    assert config.get_int('max_retry_count') == 3
+    clock.now += 61
+    assert config.get_int('max_retry_count') == 3
+    assert config.stats()['errors'] == 1
+    # The failed reload counts as a refresh so SSM is not retried until the TTL passes again
+    assert config.get_int('max_retry_count') == 3
+    assert config.stats()['hits'] == 1
+
+def tests_raises_when_nothing_loaded_yet(ssm_stub):
+    ssm, stubber = ssm_stub
+    stubber.add_client_error('get_parameters_by_path', service_error_code='ThrottlingException', http_status_code=400)
+    config = ConfigProvider(ssm, '/test-app/test', clock=FakeClock())
+
+    with pytest.raises(Exception):
+        config.params()
@@ -0,0 +1,46 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr, isostr_to_epoch
+
+def tests_parse_utc():
+    assert isostr_to_datetime('2020-01-01T12:00:00.000000Z') == datetime(2020, 1, 1, 12, 0, 0)
+    assert isostr_to_datetime('2020-01-01T12:00:00.5Z') == datetime(2020, 1, 1, 12, 0, 0, 500000)
+    assert isostr_to_datetime('2020-01-01T12:00:00Z') == datetime(2020, 1, 1, 12, 0, 0)
+
+def tests_parse_applies_offset():
+    assert isostr_to_datetime('2020-01-01T17:30:00.000000+05:30') == datetime(2020, 1, 1, 12, 0, 0)
+    assert isostr_to_datetime('2020-01-01T23:00:00-0200') == datetime(2020, 1, 2, 1, 0, 0)
+
+def tests_parse_matches_strptime():
+    date_string = '2021-06-30T23:59:59.999999Z'
+    assert isostr_to_datetime(date_string) == datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%f%z').replace(tzinfo=None)
+
+@pytest.mark.parametrize('date_string', [
+    '2020-01-01T12:00:00',
+    '2020-01-01T12:00:00.Z',
+    '2020-13-01T12:00:00Z',
+    '2020-01-01T12:00:00+5',
+    '2020/01/01T12:00:00Z',
+    '2020-01-01T 1:00:00Z',
+])
+def tests_parse_rejects_invalid(date_string):
+    with pytest.raises(ValueError):
+        isostr_to_datetime(date_string)
+
+def tests_parse_is_memoized():
+    isostr_to_datetime.cache_clear()
+    isostr_to_datetime('2020-01-01T12:00:00.000000Z')
+    isostr_to_datetime('2020-01-01T12:00:00.000000Z')
+    assert isostr_to_datetime.cache_info().hits == 1
+
+def tests_format():
+    assert datetime_to_isostr(datetime(2020, 1, 1, 12, 0, 0, 5)) == '2020-01-01T12:00:00.000005Z'
+    assert datetime_to_isostr(datetime(2020, 1, 1, 12, 0, 0, tzinfo=timezone(timedelta(hours=2)))) == '2020-01-01T10:00:00.000000Z'
+
+def tests_round_trip():
+    now = datetime.utcnow()
+    assert isostr_to_datetime(datetime_to_isostr(now)) == now
+
+def tests_epoch():
+    assert isostr_to_epoch('2020-01-01T12:00:00.000000Z') == 1577880000
+    assert isostr_to_epoch('2020-01-01T17:30:00.999999+05:30') == 1577880000
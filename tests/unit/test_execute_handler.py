@@ -1,11 +1,12 @@
 import json
 import pytest
 import boto3
+from botocore.exceptions import ClientError
 from botocore.stub import Stubber, ANY
 from pytest_mock import mocker
 from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timedelta 
-from reminder_app.execute_reminder_handler import execute_reminder, ses, sns, ssm, dynamodb
+from reminder_app.execute_reminder_handler import execute_reminder, execute_reminders_batch, ses, sns, ssm, dynamodb, config, ses_limiter, sns_limiter, reminders
 from reminder_app.date_utils import isostr_to_datetime, datetime_to_isostr
 
 @pytest.fixture(autouse=True)
@@ -14,6 +15,22 @@ def dynamodb_stub():
         yield stubber
         stubber.assert_no_pending_responses()
 
+@pytest.fixture(autouse=True)
+def config_cache():
+    config.invalidate()
+    yield config
+
+@pytest.fixture(autouse=True)
+def reminder_cache():
+    reminders.clear()
+    yield reminders
+
+@pytest.fixture(autouse=True)
+def rate_limiters():
+    yield
+    ses_limiter.reset()
+    sns_limiter.reset()
+
 def tests_execute_reminder_send_email(dynamodb_stub):
     stubber_ssm = Stubber(ssm)
     stubber_ssm.add_response('get_parameters_by_path',
@@ -69,10 +86,22 @@ def tests_execute_reminder_send_email(dynamodb_stub):
                                     'Data': 'Pay your taxes'}},
                                         'Source': 'shail@example.com'}
 
+    dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '1'}, 'last_sent_at': {'N': '1'}, 'updated_at': {'N': '1'}}}, {
+        'TableName': 'test-stack-RemindersTable',
+        'Key': {'reminder_id': '1', 'user_id': '1'},
+        'UpdateExpression': 'SET last_sent_at= :last_sent_at, updated_at= :updated_at ADD retry_count :retry_count',
+        'ExpressionAttributeValues': {':last_sent_at': ANY, ':updated_at': ANY, ':retry_count': 1},
+        'ConditionExpression': Attr('reminder_id').exists(),
+        'ReturnValues': 'UPDATED_NEW'
+    })
+
     with stubber_ssm:
         with stubber_ses:
             response = execute_reminder(reminder_id2send, 'context')  
             assert response == {'to_execute': 'true','notify_date_time': ANY, 'reminder_id': '1'}
+    #Default fixed policy - checked again in 5 mins
+    wait = isostr_to_datetime(response['notify_date_time']) - datetime.utcnow()
+    assert timedelta(minutes=4) < wait <= timedelta(minutes=5)
 
 def tests_execute_reminder_send_sms(dynamodb_stub):
     stubber_ssm = Stubber(ssm)
@@ -114,11 +143,41 @@ def tests_execute_reminder_send_sms(dynamodb_stub):
         "reminder_id":"1"
     }
 
+    dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '3'}}})
+
     with stubber_ssm:
         with stubber_sns:
             response = execute_reminder(reminder_id2send, 'context')  
             assert response == {'to_execute': 'true','notify_date_time': ANY, 'reminder_id': '1'}
 
+def tests_execute_reminder_deleted_while_sending(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path', {"Parameters": [{ "Name":"/test-app/test/max_retry_count","Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_response('publish', {"MessageId": "SomeID"})
+    due = {"user_id":{"S": "1"}, "reminder_id":{"S" :"1"}, "state":{"S":"Pending"}, "retry_count":{"N":"0"},
+        "notify_date_time": {"S": datetime_to_isostr(datetime.utcnow() - timedelta(minutes = 10))}, "remind_msg":{"S":"Pay your taxes"},
+        "notify_by":{"M":{"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}}}
+    dynamodb_stub.add_response('query', {U'Items':[due]})
+    #The send is not recorded on a reminder that no longer exists - it would come back with only the send attributes
+    dynamodb_stub.add_client_error('update_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+
+    with stubber_ssm, stubber_sns:
+        response = execute_reminder({"reminder_id":"1"}, 'context')
+    assert response == {'reminder_id': '1', 'to_execute': 'false', 'error': 'Reminder not found'}
+
+def tests_execute_reminder_read_error_is_raised(dynamodb_stub):
+    due = {"user_id":{"S": "1"}, "reminder_id":{"S" :"1"}, "state":{"S":"Pending"}, "retry_count":{"N":"0"},
+        "notify_date_time": {"S": datetime_to_isostr(datetime.utcnow() - timedelta(minutes = 10))}, "remind_msg":{"S":"Pay your taxes"},
+        "notify_by":{"M":{"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}}}
+    dynamodb_stub.add_response('query', {U'Items':[due]})
+    reminders.get('1')
+    #The consistent re-read of the cached reminder fails - the state machine has to see it to retry
+    dynamodb_stub.add_client_error('get_item', service_error_code='AccessDeniedException', http_status_code=400)
+    with pytest.raises(ClientError):
+        execute_reminder({"reminder_id":"1"}, 'context')
+
 def tests_execute_reminder_not_pending(dynamodb_stub):
     time_In_Past_By_10_mins = datetime_to_isostr(datetime.now() - timedelta(minutes = 10))
 
@@ -183,12 +242,15 @@ def tests_execute_reminder_exceeded_max_retry_counts(dynamodb_stub):
     }
 
     expectedUpdateParams = { 
-        u'Key': {u'reminder_id': u'3'},
+        u'Key': {u'reminder_id': u'3', u'user_id': u'1'},
         u'TableName': u'test-stack-RemindersTable',
-        u'UpdateExpression': u'SET state= :state, updated_at= :updated_at',
+        u'UpdateExpression': u'SET #st= :state, updated_at= :updated_at, expires_at= :expires_at',
+        u'ExpressionAttributeNames': {u'#st': u'state'},
         u'ExpressionAttributeValues': {
             u':state': 'Unacknowledged', 
-            U':updated_at' : ANY
+            U':updated_at' : ANY,
+            #Deleted by DynamoDB TTL FINISHED_REMINDER_TTL_SECONDS later
+            U':expires_at' : ANY
             }
         }
     
@@ -238,4 +300,262 @@ def tests_execute_reminder_rescheduled(dynamodb_stub):
         response = execute_reminder(reminder_id2send, 'context')  
         assert response == {'to_execute': 'true','notify_date_time': ANY, 'reminder_id': '3'}
 
+def tests_execute_reminder_due_at_is_not_parsed(dynamodb_stub, mocker):
+    mocker.patch.object(config, 'get_int', return_value=3)
+    #due_at is read instead of notify_date_time - both say the same time for reminders written through the API
+    due_at = int((datetime.utcnow() + timedelta(minutes = 10) - datetime(1970, 1, 1)).total_seconds())
+    reminder2send = {
+        "user_id":{"S": "1"},
+        "reminder_id":{"S" :"3"},
+        "notify_date_time": {"S" : "not parsed"},
+        "due_at": {"N": str(due_at)},
+        "state":{"S":"Pending"},
+        "retry_count":{"N":"0"}
+    }
+    dynamodb_stub.add_response('query', {U'Items':[reminder2send]})
+
+    response = execute_reminder({"reminder_id":"3"}, 'context')
+    assert response == {'to_execute': 'true', 'notify_date_time': 'not parsed', 'reminder_id': '3'}
 
+def tests_execute_reminders_batch(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": 
+        [{ "Name":"/test-app/test/max_retry_count","Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    time_In_Past_By_10_mins = datetime_to_isostr(datetime.utcnow() - timedelta(minutes = 10))
+    time_In_Future_By_10_mins = datetime_to_isostr(datetime.utcnow() + timedelta(minutes = 10))
+
+    def reminder(reminder_id, notify_date_time, state, notify_by):
+        return {
+            "user_id":{"S": "1"},
+            "reminder_id":{"S": reminder_id},
+            "notify_date_time": {"S" : notify_date_time},
+            "remind_msg":{"S":"Pay your taxes"},
+            "state":{"S": state},
+            "retry_count":{"N":"0"},
+            "notify_by":{"M": notify_by}
+        }
+    sms = {"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}
+    email = {"type":{"S":"Email"}, "to_address": {"S":"shail@example.com"}, "from_address":{"S":"shail@example.com"}}
+
+    #Reminder 5 does not exist any more
+    expectedParams = {'RequestItems': {'test-stack-RemindersTable': {'Keys': [
+        {'reminder_id': str(i), 'user_id': '1'} for i in range(1, 6)]}}}
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        reminder('4', time_In_Past_By_10_mins, 'Acknowledged', sms),
+        reminder('1', time_In_Past_By_10_mins, 'Pending', sms),
+        reminder('2', time_In_Past_By_10_mins, 'Pending', email),
+        reminder('3', time_In_Future_By_10_mins, 'Pending', sms),
+    ]}}, expectedParams)
+
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_response('publish', {"MessageId": "SomeID"}, {'Message': 'Pay your taxes', 'PhoneNumber': "+1-123-456-7890"})
+    stubber_ses = Stubber(ses)
+    stubber_ses.add_response('send_email', {"MessageId": "SomeID"}, {'Destination': ANY, 'Message': ANY, 'Source': 'shail@example.com'})
+    #One send recorded per notified reminder - in whichever order the pool gets to them
+    for i in range(2):
+        dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '1'}}})
+
+    with stubber_ssm, stubber_sns, stubber_ses:
+        response = execute_reminders_batch({'reminders': [{'reminder_id': str(i), 'user_id': '1'} for i in range(1, 6)]}, 'context')
+        stubber_sns.assert_no_pending_responses()
+        stubber_ses.assert_no_pending_responses()
+
+    assert response == {'results': [
+        {'reminder_id': '1', 'to_execute': 'true', 'notify_date_time': ANY},
+        {'reminder_id': '2', 'to_execute': 'true', 'notify_date_time': ANY},
+        {'reminder_id': '3', 'to_execute': 'true', 'notify_date_time': time_In_Future_By_10_mins},
+        {'reminder_id': '4', 'to_execute': 'false'},
+        {'reminder_id': '5', 'to_execute': 'false', 'error': 'Reminder not found'},
+    ]}
+
+def tests_execute_reminder_retry_policy_from_config(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": [
+            {"Name": "/test-app/test/max_retry_count", "Value": "3"},
+            {"Name": "/test-app/test/retry_policy", "Value": "exponential"},
+            {"Name": "/test-app/test/retry_interval_seconds", "Value": "60"}
+        ]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_response('publish', {"MessageId": "SomeID"})
+
+    reminder2send = {
+        "user_id":{"S": "1"},
+        "reminder_id":{"S" :"1"},
+        "notify_date_time": {"S" : datetime_to_isostr(datetime.utcnow() - timedelta(minutes = 10))},
+        "remind_msg":{"S":"Pay your taxes"},
+        "state":{"S":"Pending"},
+        "retry_count":{"N":"2"},
+        "notify_by":{"M":{"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}}
+    }
+    dynamodb_stub.add_response('query', {'Items': [reminder2send]})
+    #Third send - 60s doubled twice
+    dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '3'}}})
+
+    with stubber_ssm, stubber_sns:
+        response = execute_reminder({"reminder_id": "1"}, 'context')
+    wait = isostr_to_datetime(response['notify_date_time']) - datetime.utcnow()
+    assert timedelta(minutes=3) < wait <= timedelta(minutes=4)
+
+def tests_execute_reminders_batch_digest(dynamodb_stub, mocker):
+    mocker.patch('reminder_app.execute_reminder_handler.DIGEST_MODE', True)
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": [{"Name": "/test-app/test/max_retry_count", "Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    now = datetime.utcnow()
+    def reminder(reminder_id, due, notify_by):
+        return {
+            "user_id":{"S": "1"},
+            "reminder_id":{"S": reminder_id},
+            "notify_date_time": {"S" : datetime_to_isostr(due)},
+            "remind_msg":{"S": "Reminder " + reminder_id},
+            "state":{"S": "Pending"},
+            "retry_count":{"N":"0"},
+            "notify_by":{"M": notify_by}
+        }
+    sms = {"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}
+    email = {"type":{"S":"Email"}, "to_address": {"S":"shail@example.com"}, "from_address":{"S":"shail@example.com"}}
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        reminder('1', now - timedelta(minutes = 1), email),
+        reminder('2', now - timedelta(minutes = 3), email),
+        #Due within the digest window - sent with 1 and 2
+        reminder('3', now + timedelta(minutes = 2), email),
+        reminder('4', now - timedelta(minutes = 1), sms),
+        #Due after the window
+        reminder('5', now + timedelta(minutes = 20), email),
+    ]}})
+    #Every reminder of a digest has its send recorded
+    for i in range(4):
+        dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '1'}}})
+
+    stubber_ses = Stubber(ses)
+    stubber_ses.add_response('send_email', {"MessageId": "SomeID"}, {
+        'Destination': {'ToAddresses': ['shail@example.com']},
+        'Message': {
+            'Body': {'Text': {'Charset': 'UTF-8', 'Data': '- Reminder 2\n- Reminder 1\n- Reminder 3'}},
+            'Subject': {'Charset': 'UTF-8', 'Data': 'You have 3 reminders'}},
+        'Source': 'shail@example.com'})
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_response('publish', {"MessageId": "SomeID"}, {'Message': 'Reminder 4', 'PhoneNumber': "+1-123-456-7890"})
+
+    with stubber_ssm, stubber_sns, stubber_ses:
+        response = execute_reminders_batch({'reminders': [{'reminder_id': str(i), 'user_id': '1'} for i in range(1, 6)]}, 'context')
+        stubber_sns.assert_no_pending_responses()
+        stubber_ses.assert_no_pending_responses()
+
+    results = response['results']
+    assert [result['reminder_id'] for result in results] == ['1', '2', '3', '4', '5']
+    #Sent reminders wait for their acknowledgement, 5 still waits for its own time
+    assert all(isostr_to_datetime(result['notify_date_time']) > now + timedelta(minutes = 4) for result in results[:4])
+    assert results[4]['notify_date_time'] == datetime_to_isostr(now + timedelta(minutes = 20))
+
+def bulk_reminder(reminder_id, notify_by, minutes_ago=1):
+    return {
+        "user_id":{"S": "1"},
+        "reminder_id":{"S": reminder_id},
+        "notify_date_time": {"S" : datetime_to_isostr(datetime.utcnow() - timedelta(minutes = minutes_ago))},
+        "remind_msg":{"S": "Reminder " + reminder_id},
+        "state":{"S": "Pending"},
+        "retry_count":{"N":"0"},
+        "notify_by":{"M": notify_by}
+    }
+
+def bulk_email(to_address, from_address):
+    return {"type":{"S":"Email"}, "to_address": {"S": to_address}, "from_address":{"S": from_address}}
+
+def bulk_destination(to_address, msg):
+    return {'Destination': {'ToAddresses': [to_address]},
+            'ReplacementTemplateData': json.dumps({'subject': msg, 'remind_msg': msg})}
+
+def tests_execute_reminders_batch_bulk_templated_email(dynamodb_stub, mocker):
+    mocker.patch('reminder_app.execute_reminder_handler.SES_TEMPLATE', 'test-template')
+    mocker.patch('reminder_app.execute_reminder_handler.BULK_EMAIL_CHUNK', 2)
+    #One task at a time so the stubbed calls are made in order
+    mocker.patch('reminder_app.execute_reminder_handler.EXECUTE_BATCH_CONCURRENCY', 1)
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": [{"Name": "/test-app/test/max_retry_count", "Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        bulk_reminder('1', bulk_email('a1@example.com', 'a@example.com')),
+        bulk_reminder('2', bulk_email('a2@example.com', 'a@example.com')),
+        bulk_reminder('3', bulk_email('a3@example.com', 'a@example.com')),
+        bulk_reminder('4', bulk_email('b1@example.com', 'b@example.com')),
+        bulk_reminder('5', {"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}}),
+    ]}})
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_response('publish', {"MessageId": "SomeID"}, {'Message': 'Reminder 5', 'PhoneNumber': "+1-123-456-7890"})
+    stubber_ses = Stubber(ses)
+    def bulk(source, destinations, statuses):
+        stubber_ses.add_response('send_bulk_templated_email', {'Status': statuses}, {
+            'Source': source,
+            'Template': 'test-template',
+            'DefaultTemplateData': json.dumps({'subject': '', 'remind_msg': ''}),
+            'Destinations': destinations
+        })
+    bulk('a@example.com',
+        [bulk_destination('a1@example.com', 'Reminder 1'), bulk_destination('a2@example.com', 'Reminder 2')],
+        [{'Status': 'Success', 'MessageId': '1'}, {'Status': 'MessageRejected', 'Error': 'Email address is not verified'}])
+    bulk('a@example.com', [bulk_destination('a3@example.com', 'Reminder 3')], [{'Status': 'Success', 'MessageId': '3'}])
+    bulk('b@example.com', [bulk_destination('b1@example.com', 'Reminder 4')], [{'Status': 'Success', 'MessageId': '4'}])
+    #Sends of 5, 1, 3 and 4 are recorded
+    for i in range(4):
+        dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '1'}}})
+
+    with stubber_ssm, stubber_sns, stubber_ses:
+        response = execute_reminders_batch({'reminders': [{'reminder_id': str(i), 'user_id': '1'} for i in range(1, 6)]}, 'context')
+        stubber_sns.assert_no_pending_responses()
+        stubber_ses.assert_no_pending_responses()
+
+    results = {result['reminder_id']: result for result in response['results']}
+    assert results['2']['error'] == 'Email address is not verified'
+    assert results['2']['to_execute'] == 'true'
+    assert all('error' not in results[reminder_id] for reminder_id in '1345')
+
+def tests_execute_reminders_batch_bulk_falls_back_without_template(dynamodb_stub, mocker):
+    mocker.patch('reminder_app.execute_reminder_handler.SES_TEMPLATE', 'test-template')
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": [{"Name": "/test-app/test/max_retry_count", "Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    dynamodb_stub.add_response('batch_get_item', {'Responses': {'test-stack-RemindersTable': [
+        bulk_reminder('1', bulk_email('a1@example.com', 'a@example.com'))]}})
+    dynamodb_stub.add_response('update_item', {'Attributes': {'retry_count': {'N': '1'}}})
+    stubber_ses = Stubber(ses)
+    stubber_ses.add_client_error('send_bulk_templated_email', service_error_code='TemplateDoesNotExist', http_status_code=400)
+    stubber_ses.add_response('send_email', {"MessageId": "SomeID"}, {
+        'Destination': {'ToAddresses': ['a1@example.com']},
+        'Message': {
+            'Body': {'Text': {'Charset': 'UTF-8', 'Data': 'Reminder 1'}},
+            'Subject': {'Charset': 'UTF-8', 'Data': 'Reminder 1'}},
+        'Source': 'a@example.com'})
+
+    with stubber_ssm, stubber_ses:
+        response = execute_reminders_batch({'reminders': [{'reminder_id': '1', 'user_id': '1'}]}, 'context')
+        stubber_ses.assert_no_pending_responses()
+    assert 'error' not in response['results'][0]
+
+def tests_execute_reminder_throttled_send_is_rescheduled(dynamodb_stub):
+    stubber_ssm = Stubber(ssm)
+    stubber_ssm.add_response('get_parameters_by_path',
+        {"Parameters": [{"Name": "/test-app/test/max_retry_count", "Value": "3"}]},
+        {'Path': '/test-app/test', 'Recursive': False})
+    stubber_sns = Stubber(sns)
+    stubber_sns.add_client_error('publish', service_error_code='Throttling', http_status_code=400)
+    dynamodb_stub.add_response('query', {'Items': [bulk_reminder('1', {"type":{"S":"SMS"}, "phone_number": {"S":"+1-123-456-7890"}})]})
+
+    #Not sent so not counted - no update_item
+    with stubber_ssm, stubber_sns:
+        response = execute_reminder({"reminder_id": "1"}, 'context')
+        stubber_sns.assert_no_pending_responses()
+    assert response['to_execute'] == 'true'
+    wait = isostr_to_datetime(response['notify_date_time']) - datetime.utcnow()
+    assert timedelta(seconds=1) < wait <= timedelta(seconds=2)
+    assert sns_limiter.rate == 10
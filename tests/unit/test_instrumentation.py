@@ -0,0 +1,97 @@
+import json
+import boto3
+import pytest
+from botocore.stub import Stubber
+from reminder_app import instrumentation
+
+@pytest.fixture
+def ssm():
+    session = boto3.session.Session(aws_access_key_id='test', aws_secret_access_key='test', region_name='us-east-1')
+    instrumentation.register(session.events)
+    client = session.client('ssm')
+    with Stubber(client) as stubber:
+        yield client, stubber
+
+def emitted(capsys):
+    lines = capsys.readouterr().out.strip().split('\n')
+    assert len(lines) == 1
+    return json.loads(lines[0])
+
+def tests_invocation_flushes_one_emf_line(ssm, capsys):
+    client, stubber = ssm
+    stubber.add_response('get_parameters_by_path', {'Parameters': []})
+    stubber.add_client_error('get_parameters_by_path', service_error_code='ThrottlingException', http_status_code=400)
+
+    @instrumentation.instrumented
+    def handler(event, context):
+        client.get_parameters_by_path(Path='/test-app/test')
+        with pytest.raises(Exception):
+            client.get_parameters_by_path(Path='/test-app/test')
+        return 'done'
+
+    assert handler({}, None) == 'done'
+    document = emitted(capsys)
+    assert document['Handler'] == 'handler'
+    assert document['ssm.GetParametersByPath.Calls'] == 2
+    assert document['ssm.GetParametersByPath.Errors'] == 1
+    assert len(document['ssm.GetParametersByPath.Latency']) == 2
+    directive = document['_aws']['CloudWatchMetrics'][0]
+    assert directive['Dimensions'] == [['Handler']]
+    #Every metric named in the directive is present in the document
+    assert all(metric['Name'] in document for metric in directive['Metrics'])
+
+def tests_nested_invocations_flush_once(ssm, capsys):
+    client, stubber = ssm
+    stubber.add_response('get_parameters_by_path', {'Parameters': []})
+
+    @instrumentation.instrumented
+    def inner(event, context):
+        client.get_parameters_by_path(Path='/test-app/test')
+
+    @instrumentation.instrumented
+    def outer(event, context):
+        inner(event, context)
+
+    outer({}, None)
+    document = emitted(capsys)
+    assert document['Handler'] == 'outer'
+    assert document['ColdStart'] == 0
+    assert document['ssm.GetParametersByPath.Calls'] == 1
+
+def tests_counts_are_flushed_with_the_invocation(capsys):
+    @instrumentation.instrumented
+    def handler(event, context):
+        instrumentation.count('ReminderCache.Hits')
+        instrumentation.count('ReminderCache.Hits', 2)
+
+    handler({}, None)
+    document = emitted(capsys)
+    assert document['ReminderCache.Hits'] == 3
+    assert {'Name': 'ReminderCache.Hits', 'Unit': 'Count'} in document['_aws']['CloudWatchMetrics'][0]['Metrics']
+    handler({}, None)
+    assert emitted(capsys)['ReminderCache.Hits'] == 3
+
+def tests_latencies_are_split_into_emf_documents_of_100_values():
+    many = instrumentation.CallStats()
+    many.latencies = [float(i) for i in range(250)]
+    few = instrumentation.CallStats()
+    few.latencies = [1.0]
+    documents = instrumentation.metrics_documents('sweep_reminders', 5.0, False,
+        {('dynamodb', 'UpdateItem'): many, ('dynamodb', 'Query'): few}, 1577880000000)
+    assert len(documents) == 3
+    assert documents[0]['dynamodb.UpdateItem.Calls'] == 250
+    assert [len(document['dynamodb.UpdateItem.Latency']) for document in documents] == [100, 100, 50]
+    assert sum((document['dynamodb.UpdateItem.Latency'] for document in documents), []) == many.latencies
+    #Later documents only hold the latencies that did not fit
+    assert 'dynamodb.Query.Latency' not in documents[1] and 'Duration' not in documents[1]
+    for document in documents:
+        metrics = document['_aws']['CloudWatchMetrics'][0]['Metrics']
+        assert all(metric['Name'] in document for metric in metrics)
+        assert all(len(value) <= 100 for value in document.values() if isinstance(value, list))
+
+def tests_throttled_attempts_are_counted():
+    instrumentation._calls.clear()
+    throttled = (None, {'Error': {'Code': 'ProvisionedThroughputExceededException'}})
+    assert instrumentation.needs_retry('needs-retry.dynamodb.Query', response=throttled) is None
+    instrumentation.needs_retry('needs-retry.dynamodb.Query', response=(None, {'Error': {'Code': 'ValidationException'}}))
+    assert instrumentation._calls[('dynamodb', 'Query')].throttles == 1
@@ -0,0 +1,85 @@
+import pytest
+from botocore.exceptions import ClientError
+from reminder_app.rate_limiter import RateLimiter, SendDeferred
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def limiter(max_rate=2, max_wait_seconds=0.5):
+    clock = FakeClock()
+    return RateLimiter('sns', max_rate, max_wait_seconds, clock=clock, sleep=clock.sleep), clock
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'Publish')
+
+def tests_sends_are_spaced_at_the_rate():
+    bucket, clock = limiter()
+    for i in range(4):
+        bucket.acquire()
+    #Two sends from the initial bucket then one every half second
+    assert clock.sleeps == [0.5, 0.5]
+
+def tests_long_waits_are_deferred():
+    bucket, clock = limiter()
+    #A bulk send can overdraw the bucket
+    bucket.acquire(5)
+    with pytest.raises(SendDeferred) as deferred:
+        bucket.acquire()
+    assert deferred.value.delay_seconds == 2.0
+    assert clock.sleeps == []
+    clock.now += 2
+    bucket.acquire()
+
+def tests_aimd():
+    bucket, clock = limiter(max_rate=8)
+    bucket.acquire()
+    assert bucket.throttled() == 2
+    assert bucket.rate == 4
+    assert bucket.throttled() == 4
+    assert bucket.rate == 2
+    bucket.succeeded()
+    assert bucket.rate == 2.5
+    for i in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 8
+    assert bucket.throttled() == 2
+
+def tests_call_defers_throttled_sends():
+    bucket, clock = limiter()
+    def throttled():
+        raise client_error('Throttling')
+    with pytest.raises(SendDeferred):
+        bucket.call(throttled)
+    assert bucket.rate == 1
+
+    def rejected():
+        raise client_error('MessageRejected')
+    clock.now += 10
+    with pytest.raises(ClientError):
+        bucket.call(rejected)
+    clock.now += 10
+    assert bucket.call(lambda: 'sent') == 'sent'
+    assert bucket.rate == 2
+
+def tests_slow_rates_still_send():
+    bucket, clock = limiter(max_rate=0.2, max_wait_seconds=10)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [5.0]
+
+def tests_discovered_rate_is_read_once():
+    reads = []
+    bucket = RateLimiter('ses', lambda: reads.append(1) or 14)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.rate == 14
+    assert reads == [1]
@@ -0,0 +1,38 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+from reminder_app.archive_store import S3ArchiveStore
+from reminder_app.reminder_export import ExportSpool, ExportTooLarge
+
+def tests_small_export_stays_in_memory():
+    spool = ExportSpool(None, 'exports/1.ndjson', inline_max_bytes=10, part_bytes=20)
+    spool.write(b'0123456789')
+    assert spool.close() == b'0123456789'
+    spool = ExportSpool(None, 'exports/1.ndjson', inline_max_bytes=10, part_bytes=20)
+    with pytest.raises(ExportTooLarge):
+        spool.write(b'0123456789a')
+
+def tests_large_export_is_uploaded_in_parts():
+    s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    store = S3ArchiveStore(s3, 'export-bucket', 'exports/')
+    upload = {'Bucket': 'export-bucket', 'Key': 'exports/1/export.ndjson', 'UploadId': 'upload-1'}
+    with Stubber(s3) as stubber:
+        stubber.add_response('create_multipart_upload', {'UploadId': 'upload-1'}, {'Bucket': 'export-bucket', 'Key': 'exports/1/export.ndjson'})
+        #Every part but the last is at least part_bytes
+        stubber.add_response('upload_part', {'ETag': '"1"'}, dict(upload, PartNumber=1, Body=b'a' * 8 + b'b' * 8))
+        stubber.add_response('upload_part', {'ETag': '"2"'}, dict(upload, PartNumber=2, Body=b'c' * 8))
+        stubber.add_response('complete_multipart_upload', {}, dict(upload, MultipartUpload={'Parts': [
+            {'ETag': '"1"', 'PartNumber': 1}, {'ETag': '"2"', 'PartNumber': 2}]}))
+        spool = ExportSpool(store, '1/export.ndjson', inline_max_bytes=10, part_bytes=16)
+        for data in (b'a' * 8, b'b' * 8, b'c' * 8):
+            spool.write(data)
+        assert spool.close() is None and spool.size == 24
+        stubber.assert_no_pending_responses()
+
+        #An export that fails part way leaves no object behind
+        stubber.add_response('create_multipart_upload', {'UploadId': 'upload-1'}, {'Bucket': 'export-bucket', 'Key': 'exports/1/export.ndjson'})
+        stubber.add_response('abort_multipart_upload', {}, upload)
+        spool = ExportSpool(store, '1/export.ndjson', inline_max_bytes=10, part_bytes=16)
+        spool.write(b'a' * 11)
+        spool.abort()
+        stubber.assert_no_pending_responses()
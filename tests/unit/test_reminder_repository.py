@@ -0,0 +1,328 @@
+import decimal
+import boto3
+import pytest
+from botocore.stub import Stubber
+from boto3.dynamodb.conditions import Attr
+import threading
+from reminder_app.reminder_repository import DynamoDBReminderRepository, InMemoryReminderRepository, CachedReminderRepository, \
+    ReminderNotFound, ReminderChanged, iter_user_reminders, update_expression
+
+def make_reminder(reminder_id, user_id='1', **attributes):
+    reminder = {
+        'reminder_id': reminder_id,
+        'user_id': user_id,
+        'notify_date_time': '2020-01-01T12:00:00.000000Z',
+        'remind_msg': 'Pay your taxes',
+        'state': 'Pending',
+        'retry_count': 0,
+        'notify_by': {'type': 'SMS', 'phone_number': '+1-123-456-7890'}
+    }
+    reminder.update(attributes)
+    return reminder
+
+# Records the reads that reach the table; eventual reads return stale until the stale copy is cleared
+class RecordingRepository(InMemoryReminderRepository):
+    def __init__(self, items=()):
+        super(RecordingRepository, self).__init__(items)
+        self.reads = []
+        self.stale = {}
+
+    def get(self, reminder_id, user_id=None, consistent=False):
+        self.reads.append((reminder_id, consistent))
+        if not consistent and reminder_id in self.stale:
+            return dict(self.stale[reminder_id])
+        return super(RecordingRepository, self).get(reminder_id, user_id, consistent)
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def dynamodb_repository():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    with Stubber(dynamodb.meta.client) as stubber:
+        yield DynamoDBReminderRepository(dynamodb.Table('test-stack-RemindersTable'), dynamodb), stubber
+        stubber.assert_no_pending_responses()
+
+def tests_update_expression_aliases_reserved_words():
+    expression, values, names = update_expression({'state': 'Acknowledged', 'updated_at': 1}, ['wake_at'])
+    assert expression == 'SET #st= :state, updated_at= :updated_at REMOVE wake_at'
+    assert values == {':state': 'Acknowledged', ':updated_at': 1}
+    assert names == {'#st': 'state'}
+
+def tests_update_expression_adds_increments():
+    expression, values, names = update_expression({'last_sent_at': 1}, increments={'retry_count': 1})
+    assert expression == 'SET last_sent_at= :last_sent_at ADD retry_count :retry_count'
+    assert values == {':last_sent_at': 1, ':retry_count': 1}
+    assert names == {}
+
+def tests_in_memory_increments():
+    reminders = InMemoryReminderRepository([make_reminder('1')])
+    key = {'reminder_id': '1', 'user_id': '1'}
+    reminders.update(key, increments={'retry_count': 1})
+    updated = reminders.update(key, {'last_sent_at': 5}, increments={'retry_count': 1, 'sends': 1}, return_values='UPDATED_NEW')
+    assert updated == {'last_sent_at': 5, 'retry_count': 2, 'sends': 1}
+
+def tests_in_memory_returns_numbers_as_decimal():
+    reminders = InMemoryReminderRepository([make_reminder('1')])
+    item = reminders.get('1')
+    assert item['retry_count'] == 0
+    assert isinstance(item['retry_count'], decimal.Decimal)
+    #Callers can not change the stored reminder through a returned item
+    item['state'] = 'Acknowledged'
+    assert reminders.get('1')['state'] == 'Pending'
+
+def tests_in_memory_conditional_writes():
+    reminders = InMemoryReminderRepository([make_reminder('1')])
+    with pytest.raises(ReminderNotFound):
+        reminders.update({'reminder_id': '2', 'user_id': '1'}, {'state': 'Acknowledged'}, must_exist=True)
+    with pytest.raises(ReminderNotFound):
+        reminders.delete({'reminder_id': '1', 'user_id': '2'}, must_exist=True)
+    assert reminders.get('2') is None
+
+    new = reminders.update({'reminder_id': '1', 'user_id': '1'}, {'state': 'Acknowledged'}, remove=['retry_count'],
+        must_exist=True, return_values='ALL_NEW')
+    assert new['state'] == 'Acknowledged' and 'retry_count' not in new
+    old = reminders.delete({'reminder_id': '1', 'user_id': '1'}, must_exist=True, return_values='ALL_OLD')
+    assert old == new
+    assert reminders.get('1') is None
+
+def tests_in_memory_user_index_pages_keys_only():
+    reminders = InMemoryReminderRepository([make_reminder(str(i), user_id='1' if i % 2 else '2') for i in range(7)])
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2)
+    assert keys == [{'reminder_id': '1', 'user_id': '1'}, {'reminder_id': '3', 'user_id': '1'}]
+    assert last_evaluated_key == {'reminder_id': '3', 'user_id': '1'}
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2, exclusive_start_key=last_evaluated_key)
+    assert [key['reminder_id'] for key in keys] == ['5']
+    assert last_evaluated_key is None
+    assert reminders.batch_get(keys) == {'5': reminders.get('5')}
+
+def tests_in_memory_user_due_range_in_due_order():
+    reminders = InMemoryReminderRepository([make_reminder('1', due_at=300), make_reminder('2', due_at=100),
+        make_reminder('3', due_at=200), make_reminder('4')])
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2, due_from=100)
+    assert keys == [{'reminder_id': '2', 'user_id': '1', 'due_at': 100}, {'reminder_id': '3', 'user_id': '1', 'due_at': 200}]
+    assert reminders.query_by_user('1', exclusive_start_key=last_evaluated_key, due_to=250) == ([], None)
+
+def tests_in_memory_pages_continue_after_deleted_start_key():
+    reminders = InMemoryReminderRepository([make_reminder(str(i), due_at=100 * (5 - i)) for i in range(5)])
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2)
+    assert [key['reminder_id'] for key in keys] == ['0', '1']
+    #As DynamoDB, the next page starts after the cursor item even once it is deleted
+    reminders.delete({'reminder_id': '1', 'user_id': '1'})
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2, exclusive_start_key=last_evaluated_key)
+    assert [key['reminder_id'] for key in keys] == ['2', '3']
+
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2, due_from=0)
+    assert [key['reminder_id'] for key in keys] == ['4', '3']
+    reminders.delete({'reminder_id': '3', 'user_id': '1'})
+    keys, last_evaluated_key = reminders.query_by_user('1', limit=2, exclusive_start_key=last_evaluated_key, due_from=0)
+    assert [key['reminder_id'] for key in keys] == ['2', '0']
+
+def tests_in_memory_conditions():
+    reminders = InMemoryReminderRepository([make_reminder('1')])
+    with pytest.raises(ReminderChanged):
+        reminders.update({'reminder_id': '1', 'user_id': '1'}, {'due_at': 1}, conditions={'state': 'Acknowledged'})
+    reminders.update({'reminder_id': '1', 'user_id': '1'}, {'due_at': 1}, conditions={'state': 'Pending'})
+    assert reminders.get('1')['due_at'] == 1
+
+def tests_in_memory_scan_segments():
+    reminders = InMemoryReminderRepository([make_reminder(str(i)) for i in range(10)])
+    found = []
+    for segment in range(3):
+        last_evaluated_key = None
+        while True:
+            items, last_evaluated_key = reminders.scan(segment, 3, ['reminder_id', 'state'], 2, last_evaluated_key)
+            found.extend(items)
+            if last_evaluated_key is None:
+                break
+    assert sorted(item['reminder_id'] for item in found) == [str(i) for i in range(10)]
+    assert found[0] == {'reminder_id': found[0]['reminder_id'], 'state': 'Pending'}
+
+def tests_in_memory_due_bucket_projection():
+    reminders = InMemoryReminderRepository([make_reminder('1', due_bucket=300, wake_at='2020-01-01T12:00:00.000000Z'), make_reminder('2')])
+    assert list(reminders.query_due_bucket(300)) == [
+        {'reminder_id': '1', 'user_id': '1', 'due_bucket': 300, 'wake_at': '2020-01-01T12:00:00.000000Z'}]
+
+def tests_dynamodb_conditional_update(dynamodb_repository):
+    reminders, stubber = dynamodb_repository
+    stubber.add_response('update_item', {'Attributes': {'reminder_id': {'S': '1'}, 'state': {'S': 'Acknowledged'}}}, {
+        'TableName': 'test-stack-RemindersTable',
+        'Key': {'reminder_id': '1', 'user_id': '1'},
+        'UpdateExpression': 'SET #st= :state',
+        'ExpressionAttributeValues': {':state': 'Acknowledged'},
+        'ExpressionAttributeNames': {'#st': 'state'},
+        'ConditionExpression': Attr('reminder_id').exists(),
+        'ReturnValues': 'ALL_NEW'
+    })
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+
+    assert reminders.update({'reminder_id': '1', 'user_id': '1'}, {'state': 'Acknowledged'},
+        must_exist=True, return_values='ALL_NEW') == {'reminder_id': '1', 'state': 'Acknowledged'}
+    with pytest.raises(ReminderNotFound):
+        reminders.update({'reminder_id': '2', 'user_id': '1'}, {'state': 'Acknowledged'}, must_exist=True)
+
+def tests_dynamodb_conditions(dynamodb_repository):
+    reminders, stubber = dynamodb_repository
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException', http_status_code=400,
+        expected_params={
+            'TableName': 'test-stack-RemindersTable',
+            'Key': {'reminder_id': '1', 'user_id': '1'},
+            'UpdateExpression': 'SET due_at= :due_at',
+            'ExpressionAttributeValues': {':due_at': 1},
+            'ConditionExpression': Attr('notify_date_time').eq('2020-01-01T12:00:00.000000Z') & Attr('state').eq('Pending')
+        })
+
+    with pytest.raises(ReminderChanged):
+        reminders.update({'reminder_id': '1', 'user_id': '1'}, {'due_at': 1},
+            conditions={'notify_date_time': '2020-01-01T12:00:00.000000Z', 'state': 'Pending'})
+
+def tests_dynamodb_scan_segment(dynamodb_repository):
+    reminders, stubber = dynamodb_repository
+    stubber.add_response('scan', {
+        'Items': [{'reminder_id': {'S': '1'}, 'state': {'S': 'Pending'}}],
+        'LastEvaluatedKey': {'reminder_id': {'S': '1'}, 'user_id': {'S': '1'}}
+    }, {
+        'TableName': 'test-stack-RemindersTable',
+        'Segment': 2,
+        'TotalSegments': 4,
+        'ProjectionExpression': 'reminder_id, #st',
+        'ExpressionAttributeNames': {'#st': 'state'},
+        'Limit': 10
+    })
+
+    assert reminders.scan(2, 4, ['reminder_id', 'state'], 10) == (
+        [{'reminder_id': '1', 'state': 'Pending'}], {'reminder_id': '1', 'user_id': '1'})
+
+def tests_dynamodb_scan_filters(dynamodb_repository):
+    reminders, stubber = dynamodb_repository
+    stubber.add_response('scan', {'Items': []}, {
+        'TableName': 'test-stack-RemindersTable',
+        'Segment': 0,
+        'TotalSegments': 1,
+        'ProjectionExpression': 'reminder_id, #st',
+        'ExpressionAttributeNames': {'#st': 'state'},
+        'FilterExpression': Attr('state').is_in(['Acknowledged', 'Unacknowledged']) & Attr('updated_at').lt(5)
+    })
+
+    assert reminders.scan(0, 1, ['reminder_id', 'state'], states=('Acknowledged', 'Unacknowledged'), updated_before=5) == ([], None)
+
+def tests_dynamodb_batch_delete_retries_unprocessed(dynamodb_repository, mocker):
+    mocker.patch('reminder_app.reminder_repository.time.sleep')
+    reminders, stubber = dynamodb_repository
+    delete = lambda reminder_id: {'DeleteRequest': {'Key': {'reminder_id': {'S': reminder_id}, 'user_id': {'S': '1'}}}}
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {'test-stack-RemindersTable': [delete('2')]}})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': {'test-stack-RemindersTable': [
+        {'DeleteRequest': {'Key': {'reminder_id': '2', 'user_id': '1'}}}]}})
+
+    assert reminders.batch_delete([{'reminder_id': '1', 'user_id': '1'}, {'reminder_id': '2', 'user_id': '1'}]) == set()
+
+def tests_dynamodb_user_index_page(dynamodb_repository):
+    reminders, stubber = dynamodb_repository
+    stubber.add_response('query', {
+        'Items': [{'reminder_id': {'S': '1'}, 'user_id': {'S': '1'}}],
+        'LastEvaluatedKey': {'reminder_id': {'S': '1'}, 'user_id': {'S': '1'}}
+    })
+    stubber.add_response('query', {'Items': []})
+
+    assert reminders.query_by_user('1', limit=1) == ([{'reminder_id': '1', 'user_id': '1'}], {'reminder_id': '1', 'user_id': '1'})
+    assert reminders.query_by_user('1', limit=1, exclusive_start_key={'reminder_id': '1', 'user_id': '1'}) == ([], None)
+
+def tests_cache_hits_expires_and_evicts():
+    table = RecordingRepository([make_reminder(str(i), updated_at=1) for i in range(3)])
+    clock = Clock()
+    reminders = CachedReminderRepository(table, max_size=2, ttl_seconds=30, clock=clock)
+    assert reminders.lookup('0') == (table.get('0'), False)
+    assert reminders.lookup('0') == (table.get('0'), True)
+    #Callers can not change the cached reminder through a returned item
+    reminders.get('0')['state'] = 'Acknowledged'
+    assert reminders.get('0')['state'] == 'Pending'
+    #Reminder ids are unique, another user's reminder is not there
+    assert reminders.get('0', user_id='2') is None
+    reminders.get('1')
+    reminders.get('2')
+    assert reminders.stats() == {'hits': 4, 'misses': 3, 'evictions': 1, 'expirations': 0, 'stale_reads': 0, 'size': 2}
+    clock.now = 31
+    table.reads = []
+    reminders.get('2')
+    assert table.reads == [('2', False)]
+    assert reminders.stats()['expirations'] == 1
+
+def tests_cache_consistent_reads_bypass_it():
+    table = RecordingRepository([make_reminder('1', updated_at=1)])
+    reminders = CachedReminderRepository(table, clock=Clock())
+    reminders.get('1')
+    reminders.get('1', consistent=True)
+    assert table.reads == [('1', False), ('1', True)]
+    assert reminders.stats()['hits'] == 0
+
+def tests_cache_rereads_consistently_after_own_write():
+    table = RecordingRepository([make_reminder('1', updated_at=1)])
+    reminders = CachedReminderRepository(table, clock=Clock())
+    reminders.get('1')
+    table.stale['1'] = table.get('1')
+    reminders.update({'reminder_id': '1', 'user_id': '1'}, {'state': 'Acknowledged', 'updated_at': 2})
+    table.reads = []
+    #The eventual read still returns the reminder from before the write
+    assert reminders.get('1')['state'] == 'Acknowledged'
+    assert table.reads == [('1', False), ('1', True)]
+    assert reminders.stats()['stale_reads'] == 1
+    assert reminders.lookup('1') == (table.get('1', consistent=True), True)
+
+def tests_cache_drops_deleted_reminders():
+    table = RecordingRepository([make_reminder('1', updated_at=1)])
+    reminders = CachedReminderRepository(table, clock=Clock())
+    reminders.get('1')
+    table.stale['1'] = table.get('1')
+    reminders.delete({'reminder_id': '1', 'user_id': '1'})
+    assert reminders.get('1') is None
+    assert reminders.stats()['size'] == 1
+
+def tests_cache_keeps_newer_reminder():
+    table = RecordingRepository([make_reminder('1', updated_at=2)])
+    reminders = CachedReminderRepository(table, clock=Clock())
+    reminders.get('1', consistent=True)
+    #An older copy read afterwards (e.g. a slow read that started first) does not replace the cached reminder
+    table.get = lambda reminder_id, user_id=None, consistent=False: make_reminder('1', updated_at=1)
+    assert reminders.get('1', consistent=True)['updated_at'] == 1
+    assert reminders.lookup('1')[0]['updated_at'] == 2
+
+def tests_cache_does_not_keep_read_overlapping_a_write():
+    class BlockingRepository(RecordingRepository):
+        def get(self, reminder_id, user_id=None, consistent=False):
+            item = super(BlockingRepository, self).get(reminder_id, user_id, consistent)
+            reading.set()
+            written.wait(5)
+            return item
+
+    table = BlockingRepository([make_reminder('1', updated_at=1)])
+    reminders = CachedReminderRepository(table, clock=Clock())
+    reading = threading.Event()
+    written = threading.Event()
+    reader = threading.Thread(target=reminders.get, args=('1',))
+    reader.start()
+    reading.wait(5)
+    #Written through another container - the reader's copy may be from before the write
+    InMemoryReminderRepository.update(table, {'reminder_id': '1', 'user_id': '1'}, {'state': 'Acknowledged', 'updated_at': 2})
+    reminders.update({'reminder_id': '1', 'user_id': '1'}, {'updated_at': 2})
+    written.set()
+    reader.join(5)
+    table.reads = []
+    assert reminders.get('1')['state'] == 'Acknowledged'
+    assert table.reads == [('1', False)]
+
+def tests_iter_user_reminders():
+    table = RecordingRepository([make_reminder(str(i)) for i in range(5)] + [make_reminder('other', user_id='2')])
+    batches = []
+    batch_get = table.batch_get
+    table.batch_get = lambda keys: batches.append(len(keys)) or batch_get(keys)
+    reminders = iter_user_reminders(table, '1', page_size=2)
+    #Nothing is read until the first reminder is asked for
+    assert batches == []
+    assert next(reminders)['reminder_id'] == '0'
+    assert batches == [2]
+    assert [item['reminder_id'] for item in reminders] == ['1', '2', '3', '4']
+    assert batches == [2, 2, 1]
@@ -0,0 +1,32 @@
+import pytest
+from reminder_app.retry_policy import FixedRetryPolicy, ExponentialRetryPolicy, JitteredRetryPolicy, policy_from_params
+from benchmarks.simulate_retry_policies import simulate
+
+def tests_schedules():
+    assert [FixedRetryPolicy(300).delay_seconds(attempt) for attempt in (1, 2, 3)] == [300, 300, 300]
+    assert [ExponentialRetryPolicy(60, 2, 200).delay_seconds(attempt) for attempt in (1, 2, 3, 4)] == [60, 120, 200, 200]
+    assert JitteredRetryPolicy(60, 2, 200, random=lambda: 0).delay_seconds(2) == 60
+    assert JitteredRetryPolicy(60, 2, 200, random=lambda: 1).delay_seconds(2) == 120
+
+def tests_policy_from_params():
+    assert isinstance(policy_from_params({}), FixedRetryPolicy)
+    assert policy_from_params({}).delay_seconds(1) == 300
+    policy = policy_from_params({'retry_policy': 'jittered', 'retry_interval_seconds': '30', 'retry_max_interval_seconds': '600'})
+    assert isinstance(policy, JitteredRetryPolicy)
+    assert (policy.interval_seconds, policy.multiplier, policy.max_interval_seconds) == (30, 2, 600)
+
+def tests_policy_from_bad_params_uses_defaults():
+    policy = policy_from_params({'retry_policy': 'never', 'retry_interval_seconds': 'soon'})
+    assert isinstance(policy, FixedRetryPolicy)
+    assert policy.delay_seconds(1) == 300
+
+@pytest.mark.parametrize('stop_on_ack, invocations', [(True, 2), (False, 3)])
+def tests_simulate_acknowledged(stop_on_ack, invocations):
+    #Sent at 0 and 60, acknowledged at 90 - the sweep still checks at 180
+    result = simulate(ExponentialRetryPolicy(60, 2, 3600), 3, ack_after_seconds=90, stop_on_ack=stop_on_ack)
+    assert result == {'invocations': invocations, 'sends': 2, 'outcome': 'Acknowledged', 'seconds': 90}
+
+def tests_simulate_unacknowledged():
+    #First send plus 3 retries, then one more check to mark it Unacknowledged
+    result = simulate(FixedRetryPolicy(300), 3)
+    assert result == {'invocations': 5, 'sends': 4, 'outcome': 'Unacknowledged', 'seconds': 1200}
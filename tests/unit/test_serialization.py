@@ -0,0 +1,54 @@
+import decimal
+import json
+import pytest
+from boto3.dynamodb.types import Binary
+from reminder_app import serialization
+from reminder_app.serialization import dumps, json_response, static_response
+
+D = decimal.Decimal
+
+ITEM = {
+    'reminder_id': '1',
+    'retry_count': D('2'),
+    'updated_at': D('1600000000000'),
+    'score': D('-1.5'),
+    'whole': D('3.0'),
+    'tags': {'b', 'a'},
+    'numbers': {D('2'), D('1.5')},
+    'data': Binary(b'\x00\x01'),
+    'remind_msg': u'Café',
+    'notify_by': {'type': 'SMS', 'phone_number': '+15555550100'},
+    'history': [D('1'), None, True]
+}
+
+EXPECTED = (u'{"reminder_id":"1","retry_count":2,"updated_at":1600000000000,"score":-1.5,"whole":3,"tags":["a","b"],'
+    u'"numbers":[1.5,2],"data":"AAE=","remind_msg":"Café","notify_by":{"type":"SMS","phone_number":"+15555550100"},'
+    u'"history":[1,null,true]}')
+
+def backends():
+    found = [serialization._stdlib_dumps_bytes]
+    if serialization.orjson is not None:
+        found.append(serialization._orjson_dumps_bytes)
+    return found
+
+@pytest.mark.parametrize('dumps_bytes', backends())
+def tests_dynamodb_types(dumps_bytes):
+    #Both backends give the same bytes
+    assert dumps_bytes(ITEM).decode('utf-8') == EXPECTED
+    #DynamoDB numbers go up to 38 digits - over 64 bits orjson hands over to the standard library
+    assert dumps_bytes({'n': D('12345678901234567890123')}) == b'{"n":12345678901234567890123}'
+    with pytest.raises(TypeError):
+        dumps_bytes({'when': object()})
+
+def tests_dumps():
+    assert dumps(ITEM) == EXPECTED
+    assert json.loads(dumps(ITEM))['score'] == -1.5
+
+def tests_responses():
+    assert json_response([{'retry_count': D('1')}]) == {'statusCode': 200, 'body': '[{"retry_count":1}]'}
+    not_found = static_response(404, 'Reminder not found')
+    response = not_found()
+    response['headers'] = {'X-Next-Cursor': 'abc'}
+    #Each call gets its own copy of the envelope
+    assert not_found() == {'statusCode': 404, 'body': 'Reminder not found'}
+    assert static_response(200, {})() == {'statusCode': 200, 'body': '{}'}
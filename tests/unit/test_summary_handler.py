@@ -0,0 +1,110 @@
+import pytest
+from botocore.stub import Stubber
+from reminder_app import summary_reminder_handler
+from reminder_app.summary_reminder_handler import update_summaries, summary_table, coalesce
+
+@pytest.fixture
+def summary_stub():
+    with Stubber(summary_table.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+#Users one after the other so the stubbed responses are consumed in order
+@pytest.fixture(autouse=True)
+def sequential(monkeypatch):
+    monkeypatch.setattr(summary_reminder_handler, 'SUMMARY_CONCURRENCY', 1)
+
+def image(reminder_id, user_id, state, updated_at):
+    return {'reminder_id': {'S': reminder_id}, 'user_id': {'S': user_id}, 'state': {'S': state},
+        'notify_date_time': {'S': '2020-01-01T12:00:00.000000Z'}, 'updated_at': {'N': updated_at}}
+
+# old_state / state - the state before and after the change, None for INSERT and REMOVE
+def record(event_name, reminder_id, sequence_number, user_id='1', old_state=None, state='Pending', updated_at='1'):
+    keys = {'reminder_id': {'S': reminder_id}, 'user_id': {'S': user_id}}
+    dynamodb = {'Keys': keys, 'ApproximateCreationDateTime': 1577880000, 'SequenceNumber': str(sequence_number)}
+    if event_name != 'INSERT':
+        dynamodb['OldImage'] = image(reminder_id, user_id, old_state, '1')
+    if event_name != 'REMOVE':
+        dynamodb['NewImage'] = image(reminder_id, user_id, state, updated_at)
+    return {'eventName': event_name, 'dynamodb': dynamodb}
+
+def read_summary(user_id):
+    return {'TableName': 'test-stack-ReminderSummaryTable', 'Key': {'user_id': user_id},
+        'ProjectionExpression': 'sequence_number', 'ConsistentRead': True}
+
+def tests_records_are_coalesced_per_user():
+    changes = coalesce([
+        record('INSERT', 'a', 100),
+        record('INSERT', 'b', 101, user_id='2'),
+        record('MODIFY', 'a', 102, old_state='Pending', state='Acknowledged', updated_at='5'),
+        record('REMOVE', 'c', 103, old_state='Unacknowledged'),
+    ])
+    assert list(changes) == ['1', '2']
+    assert [change['sequence_number'] for change in changes['1']] == [100, 102, 103]
+    assert changes['1'][1] == {'sequence_number': 102, 'counts': {'Pending': -1, 'Acknowledged': 1}, 'total': 0, 'updated_at': 5}
+    #REMOVE records have no updated_at of their own
+    assert changes['1'][2] == {'sequence_number': 103, 'counts': {'Unacknowledged': -1}, 'total': -1, 'updated_at': 1577880000000}
+    assert changes['2'] == [{'sequence_number': 101, 'counts': {'Pending': 1}, 'total': 1, 'updated_at': 1}]
+
+def tests_update_summaries_adds_deltas_once_per_user(summary_stub):
+    summary_stub.add_response('get_item', {}, read_summary('1'))
+    summary_stub.add_response('update_item', {}, {
+        'TableName': 'test-stack-ReminderSummaryTable',
+        'Key': {'user_id': '1'},
+        'UpdateExpression': 'ADD #total :total, #c0 :c0, #c1 :c1 SET #updated_at = :updated_at, #sequence_number = :sequence_number',
+        'ConditionExpression': 'attribute_not_exists(#sequence_number)',
+        'ExpressionAttributeNames': {'#total': 'total', '#updated_at': 'updated_at', '#sequence_number': 'sequence_number',
+            '#c0': 'count_Pending', '#c1': 'count_Unacknowledged'},
+        'ExpressionAttributeValues': {':total': 1, ':updated_at': 1577880005000, ':sequence_number': 103, ':c0': 2, ':c1': -1}
+    })
+    #Records up to the last one applied are skipped - the update is conditional on it
+    summary_stub.add_response('get_item', {'Item': {'sequence_number': {'N': '100'}}}, read_summary('2'))
+    summary_stub.add_response('update_item', {}, {
+        'TableName': 'test-stack-ReminderSummaryTable',
+        'Key': {'user_id': '2'},
+        'UpdateExpression': 'ADD #total :total SET #updated_at = :updated_at, #sequence_number = :sequence_number',
+        'ConditionExpression': '#sequence_number = :applied',
+        'ExpressionAttributeNames': {'#total': 'total', '#updated_at': 'updated_at', '#sequence_number': 'sequence_number'},
+        'ExpressionAttributeValues': {':total': 0, ':updated_at': 7, ':sequence_number': 104, ':applied': 100}
+    })
+
+    result = update_summaries({'Records': [
+        record('INSERT', 'a', 100),
+        record('INSERT', 'b', 101, updated_at='1577880005000'),
+        record('REMOVE', 'c', 103, old_state='Unacknowledged'),
+        record('INSERT', 'e', 99, user_id='2'),
+        #A change that keeps the state only moves updated_at
+        record('MODIFY', 'd', 104, user_id='2', old_state='Pending', state='Pending', updated_at='7'),
+    ]}, None)
+    assert result == {'records': 5, 'users': 2, 'batchItemFailures': []}
+
+def tests_update_summaries_replayed_batch_is_not_counted_again(summary_stub):
+    #Both users were written by the failed attempt - the retry writes nothing
+    summary_stub.add_response('get_item', {'Item': {'sequence_number': {'N': '101'}}}, read_summary('1'))
+    summary_stub.add_response('get_item', {'Item': {'sequence_number': {'N': '102'}}}, read_summary('2'))
+
+    result = update_summaries({'Records': [record('INSERT', 'a', 100), record('INSERT', 'b', 101),
+        record('INSERT', 'c', 102, user_id='2')]}, None)
+    assert result['batchItemFailures'] == []
+
+def tests_update_summaries_reports_failed_users(summary_stub):
+    summary_stub.add_response('get_item', {}, read_summary('1'))
+    summary_stub.add_response('update_item', {})
+    summary_stub.add_client_error('get_item', service_error_code='ProvisionedThroughputExceededException', http_status_code=400,
+        expected_params=read_summary('2'))
+
+    result = update_summaries({'Records': [record('INSERT', 'a', 100), record('INSERT', 'b', 101, user_id='2'),
+        record('INSERT', 'c', 102, user_id='2')]}, None)
+    #Retried from the first record of the user that failed - user 1 skips what it already applied
+    assert result['batchItemFailures'] == [{'itemIdentifier': '101'}]
+
+def tests_update_summaries_retries_on_concurrent_write(summary_stub):
+    summary_stub.add_response('get_item', {})
+    summary_stub.add_client_error('update_item', service_error_code='ConditionalCheckFailedException', http_status_code=400)
+    summary_stub.add_response('get_item', {'Item': {'sequence_number': {'N': '50'}}})
+    summary_stub.add_response('update_item', {})
+
+    assert update_summaries({'Records': [record('INSERT', 'a', 100)]}, None)['batchItemFailures'] == []
+
+def tests_update_summaries_without_records(summary_stub):
+    assert update_summaries({'Records': []}, None) == {'records': 0, 'users': 0, 'batchItemFailures': []}
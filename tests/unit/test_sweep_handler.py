@@ -0,0 +1,273 @@
+import pytest
+from datetime import datetime, timedelta
+from reminder_app import execute_reminder_handler, sweep_reminder_handler
+from reminder_app.scheduler import bucket_for, due_buckets, SWEEP_BUCKET_SECONDS, SWEEP_LOOKBACK_BUCKETS
+from reminder_app.date_utils import datetime_to_isostr
+from reminder_app.reminder_repository import InMemoryReminderRepository, reminder_key
+
+START = datetime(2020, 1, 1, 12, 0, 0)
+
+class SimClock(object):
+    now = START
+
+class FakeDatetime(datetime):
+    @classmethod
+    def utcnow(cls):
+        return SimClock.now
+
+def make_reminder(reminder_id, due, notify_type):
+    return {
+        'reminder_id': reminder_id,
+        'user_id': '1',
+        'notify_date_time': datetime_to_isostr(due),
+        'remind_msg': 'Pay your taxes',
+        'state': 'Pending',
+        'to_execute': 'true',
+        'retry_count': 0,
+        'notify_by': {'type': notify_type},
+        'due_bucket': bucket_for(due),
+        'wake_at': datetime_to_isostr(due)
+    }
+
+REMINDERS = [
+    make_reminder('A', START + timedelta(minutes = 10), 'SMS'),
+    make_reminder('B', START + timedelta(minutes = 23), 'Email'),
+    make_reminder('C', START + timedelta(minutes = 7), 'SMS'),
+]
+
+#The SSM parameter holding the sweep's low water mark
+@pytest.fixture(autouse=True)
+def low_water_mark(mocker):
+    mark = {}
+    mocker.patch.object(sweep_reminder_handler, 'load_low_water_mark', side_effect=lambda: mark.get('bucket'))
+    mocker.patch.object(sweep_reminder_handler, 'save_low_water_mark', side_effect=lambda bucket: mark.update(bucket=bucket))
+    return mark
+
+@pytest.fixture
+def simulation(mocker):
+    sends = []
+    record = lambda item, *args: sends.append((SimClock.now, item['reminder_id']))
+    mocker.patch.object(execute_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(execute_reminder_handler, 'send_sms', side_effect=record)
+    mocker.patch.object(execute_reminder_handler, 'send_email', side_effect=record)
+    mocker.patch.object(execute_reminder_handler.config, 'get_int', return_value=3)
+    mocker.patch.object(execute_reminder_handler.config, 'params', return_value={'max_retry_count': '3'})
+
+    def run(driver):
+        del sends[:]
+        reminders = InMemoryReminderRepository(REMINDERS)
+        mocker.patch.object(execute_reminder_handler, 'reminders', reminders)
+        mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+        step = driver()
+        for minute in range(0, 41):
+            SimClock.now = START + timedelta(minutes = minute)
+            #Reminder C is acknowledged by the user after its third notification
+            if minute == 20:
+                reminders.update({'reminder_id': 'C', 'user_id': '1'}, {'state': 'Acknowledged'})
+            step()
+        return sorted(sends), reminders
+    return run
+
+# Mirrors ReminderStateMachine - wait_to_execute until notify_date_time then executeNotifyLambda while to_execute is true
+def step_functions_driver():
+    waits = {item['reminder_id']: execute_reminder_handler.isostr_to_datetime(item['notify_date_time']) for item in REMINDERS}
+    def step():
+        for reminder_id, wake_at in list(waits.items()):
+            if wake_at <= SimClock.now:
+                result = execute_reminder_handler.execute_reminder({'reminder_id': reminder_id}, None)
+                if result['to_execute'] == 'true':
+                    waits[reminder_id] = execute_reminder_handler.isostr_to_datetime(result['notify_date_time'])
+                else:
+                    del waits[reminder_id]
+    return step
+
+def sweep_driver():
+    return lambda: sweep_reminder_handler.sweep_reminders({}, None)
+
+def tests_sweep_delivers_same_notifications_as_step_functions(simulation):
+    step_function_sends, _ = simulation(step_functions_driver)
+    sweep_sends, reminders = simulation(sweep_driver)
+
+    assert sweep_sends == step_function_sends
+    assert [sent_at for sent_at, reminder_id in step_function_sends if reminder_id == 'C'] == \
+        [START + timedelta(minutes = m) for m in (7, 12, 17)]
+    #Acknowledged reminders drop out of the due bucket index
+    assert 'due_bucket' not in reminders.get('C')
+    #A is never acknowledged - sent once plus max_retry_count retries, then given up on
+    assert [sent_at for sent_at, reminder_id in step_function_sends if reminder_id == 'A'] == \
+        [START + timedelta(minutes = m) for m in (10, 15, 20, 25)]
+    assert reminders.get('A')['state'] == 'Unacknowledged'
+    assert reminders.get('A')['retry_count'] == 4
+    assert 'due_bucket' not in reminders.get('A')
+
+def tests_sweep_does_not_recreate_reminder_deleted_while_sending(mocker):
+    due = START - timedelta(minutes = 1)
+    reminders = InMemoryReminderRepository([make_reminder('D', due, 'SMS')])
+    mocker.patch.object(execute_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(execute_reminder_handler.config, 'params', return_value={'max_retry_count': '3'})
+    mocker.patch.object(execute_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+    #The user deletes the reminder while it is being sent
+    mocker.patch.object(execute_reminder_handler, 'send_sms', side_effect=lambda item: reminders.delete(reminder_key(item)))
+    SimClock.now = START
+
+    summary = sweep_reminder_handler.sweep_reminders({}, None)
+    assert summary['completed'] == 1 and summary['failed'] == 0
+    assert reminders.get('D') is None
+    #Moving it to its next bucket or out of the index does not bring it back either
+    assert sweep_reminder_handler.apply_result(reminder_key(make_reminder('D', due, 'SMS')),
+        {'to_execute': 'true', 'reminder_id': 'D', 'notify_date_time': datetime_to_isostr(START)}) == 'completed'
+    assert sweep_reminder_handler.apply_result({'reminder_id': 'D', 'user_id': '1'}, {'to_execute': 'false'}) == 'completed'
+    assert reminders.get('D') is None
+
+def tests_sweep_stops_after_its_time(mocker):
+    reminders = InMemoryReminderRepository([make_reminder('E', START - timedelta(minutes = 1), 'SMS')])
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'SWEEP_MAX_SECONDS', -1)
+    SimClock.now = START
+
+    summary = sweep_reminder_handler.sweep_reminders({}, None)
+    #Left in its bucket for the next sweep
+    assert summary['stopped'] and summary['executed'] == 0
+    assert reminders.get('E')['due_bucket'] == bucket_for(START - timedelta(minutes = 1))
+
+def tests_sweep_grouped_in_bounded_batches_per_bucket(mocker):
+    due = START - timedelta(minutes = 1)
+    reminders = InMemoryReminderRepository([dict(make_reminder(str(i), due, 'Email'), user_id=str(i % 2)) for i in range(5)] +
+        [make_reminder('older', START - timedelta(minutes = 30), 'Email')])
+    calls = []
+    def execute(event, context):
+        calls.append([key['user_id'] + '/' + key['reminder_id'] for key in event['reminders']])
+        return {'results': [{'reminder_id': key['reminder_id'], 'to_execute': 'false'} for key in event['reminders']]}
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'SES_TEMPLATE', 'template')
+    mocker.patch.object(sweep_reminder_handler, 'SWEEP_BATCH_SIZE', 2)
+    mocker.patch.object(sweep_reminder_handler, 'execute_reminders_batch', side_effect=execute)
+    SimClock.now = START
+
+    summary = sweep_reminder_handler.sweep_reminders({}, None)
+    assert summary['completed'] == 6
+    #Oldest bucket first, then the others of a bucket at most SWEEP_BATCH_SIZE at a time with a user's reminders together
+    assert calls[0] == ['1/older']
+    assert [len(call) for call in calls[1:]] == [2, 2, 1]
+    assert [key.split('/')[0] for call in calls[1:] for key in call] == ['0', '0', '0', '1', '1']
+
+def tests_sweep_resumes_from_low_water_mark(mocker, low_water_mark):
+    #Due long before the lookback - the rule was disabled or sweeps kept failing
+    due = START - timedelta(hours = 3)
+    reminders = InMemoryReminderRepository([make_reminder('F', due, 'SMS'), make_reminder('G', due, 'SMS')])
+    sends = []
+    def send_sms(item):
+        if item['reminder_id'] == 'G':
+            raise KeyError('phone_number')
+        sends.append(item['reminder_id'])
+    mocker.patch.object(execute_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(execute_reminder_handler.config, 'params', return_value={'max_retry_count': '3'})
+    mocker.patch.object(execute_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(execute_reminder_handler, 'send_sms', side_effect=send_sms)
+    low_water_mark['bucket'] = bucket_for(due)
+    SimClock.now = START
+
+    summary = sweep_reminder_handler.sweep_reminders({}, None)
+    assert sends == ['F'] and summary['failed'] == 1
+    #The failed reminder is retried from the current bucket and the mark moves up to it
+    assert reminders.get('G')['due_bucket'] == bucket_for(START)
+    assert low_water_mark['bucket'] == bucket_for(START)
+
+def tests_sweep_stopped_keeps_low_water_mark(mocker, low_water_mark):
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', InMemoryReminderRepository())
+    mocker.patch.object(sweep_reminder_handler, 'SWEEP_MAX_SECONDS', -1)
+    low_water_mark['bucket'] = bucket_for(START - timedelta(hours = 3))
+    SimClock.now = START
+
+    sweep_reminder_handler.sweep_reminders({}, None)
+    assert low_water_mark['bucket'] == bucket_for(START - timedelta(hours = 3))
+
+def tests_due_buckets_from_low_water_mark():
+    now = START + timedelta(minutes = 7)
+    buckets = due_buckets(now, bucket_for(START - timedelta(hours = 3)))
+    assert buckets[0] == bucket_for(START - timedelta(hours = 3)) and buckets[-1] == bucket_for(now)
+    assert len(buckets) == 3 * 3600 // SWEEP_BUCKET_SECONDS + 2
+
+def tests_due_buckets_cover_lookback():
+    now = START + timedelta(minutes = 7)
+    buckets = due_buckets(now)
+    assert len(buckets) == SWEEP_LOOKBACK_BUCKETS + 1
+    assert buckets[-1] == bucket_for(now)
+    assert buckets[-1] - buckets[0] == SWEEP_LOOKBACK_BUCKETS * SWEEP_BUCKET_SECONDS
+
+def tests_sweep_digest_sends_one_message_per_user_target(mocker):
+    messages = []
+    record = lambda item, *args: messages.append((SimClock.now, item['remind_msg']))
+    mocker.patch.object(execute_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(execute_reminder_handler, 'send_sms', side_effect=record)
+    mocker.patch.object(execute_reminder_handler.config, 'get_int', return_value=1)
+    mocker.patch.object(execute_reminder_handler.config, 'params', return_value={'max_retry_count': '1'})
+    mocker.patch.object(execute_reminder_handler, 'DIGEST_MODE', True)
+    mocker.patch.object(sweep_reminder_handler, 'DIGEST_MODE', True)
+
+    def sms_reminder(reminder_id, due, phone_number='+1-123-456-7890'):
+        return dict(make_reminder(reminder_id, due, 'SMS'), remind_msg=reminder_id,
+            notify_by={'type': 'SMS', 'phone_number': phone_number})
+    reminders = InMemoryReminderRepository([
+        sms_reminder('X', START + timedelta(minutes = 7)),
+        #Joins X as it is due within the digest window
+        sms_reminder('Y', START + timedelta(minutes = 9)),
+        sms_reminder('Z', START + timedelta(minutes = 7), phone_number='+1-000-000-0000'),
+    ])
+    mocker.patch.object(execute_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+
+    for minute in range(0, 20):
+        SimClock.now = START + timedelta(minutes = minute)
+        sweep_reminder_handler.sweep_reminders({}, None)
+
+    assert sorted(messages) == [
+        (START + timedelta(minutes = 7), '- X\n- Y'),
+        (START + timedelta(minutes = 7), 'Z'),
+        (START + timedelta(minutes = 12), '- X\n- Y'),
+        (START + timedelta(minutes = 12), 'Z'),
+    ]
+    #Each reminder of the digest counts its own sends
+    assert [reminders.get(reminder_id)['state'] for reminder_id in 'XYZ'] == ['Unacknowledged'] * 3
+    assert [reminders.get(reminder_id)['retry_count'] for reminder_id in 'XYZ'] == [2, 2, 2]
+
+def tests_sweep_digest_keeps_retries_at_their_own_time(mocker):
+    messages = []
+    record = lambda item, *args: messages.append((SimClock.now, item['remind_msg']))
+    mocker.patch.object(execute_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(sweep_reminder_handler, 'datetime', FakeDatetime)
+    mocker.patch.object(execute_reminder_handler, 'send_sms', side_effect=record)
+    mocker.patch.object(execute_reminder_handler.config, 'get_int', return_value=1)
+    mocker.patch.object(execute_reminder_handler.config, 'params', return_value={'max_retry_count': '1'})
+    mocker.patch.object(execute_reminder_handler, 'DIGEST_MODE', True)
+    mocker.patch.object(sweep_reminder_handler, 'DIGEST_MODE', True)
+
+    sms_reminder = lambda reminder_id, due: dict(make_reminder(reminder_id, due, 'SMS'), remind_msg=reminder_id,
+        notify_by={'type': 'SMS', 'phone_number': '+1-123-456-7890'})
+    reminders = InMemoryReminderRepository([
+        sms_reminder('X', START + timedelta(minutes = 7)),
+        #Already sent once, its retry check at minute 8 falls in X's digest window
+        sms_reminder('Y', START + timedelta(minutes = 3)),
+    ])
+    mocker.patch.object(execute_reminder_handler, 'reminders', reminders)
+    mocker.patch.object(sweep_reminder_handler, 'reminders', reminders)
+
+    for minute in range(0, 20):
+        SimClock.now = START + timedelta(minutes = minute)
+        sweep_reminder_handler.sweep_reminders({}, None)
+
+    assert sorted(messages) == [
+        (START + timedelta(minutes = 3), 'Y'),
+        (START + timedelta(minutes = 7), 'X'),
+        (START + timedelta(minutes = 8), 'Y'),
+        (START + timedelta(minutes = 12), 'X'),
+    ]